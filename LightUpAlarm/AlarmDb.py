@@ -11,60 +11,90 @@
 #   id: primary key ID for the alarms row
 #   hour: Indicates the hour value for the alarm. Integer from 0 to 23.
 #   minute: Indicates the minute value for the alarm. Integer from 0 to 59.
-#   monday: Indicates if the alarm repeats every monday. Boolean.
-#   tuesday: Indicates if the alarm repeats every tuesday. Boolean.
-#   wednesday: Indicates if the alarm repeats every wednesday. Boolean.
-#   thursday: Indicates if the alarm repeats every thursday. Boolean.
-#   friday: Indicates if the alarm repeats every friday. Boolean.
-#   saturday: Indicates if the alarm repeats every saturday. Boolean.
-#   sunday: Indicates if the alarm repeats every sunday. Boolean.
+#   repeat_mask: Indicates the weekdays the alarm repeats. Integer bit mask
+#                from 0 to 127, with monday as bit 0 and sunday as bit 6.
 #   enabled: Indicates if the alarm is enabled (turned on). Boolean.
 #   label: Stores a string to accompany the alarm as a label.
 #   timestamp: Indicates time of the last modification, in seconds since 1970.
+#   uid: Unique string to identify the alarm across the synchronised systems.
+#   revision: Indicates the alarms revision of the last change to the alarm.
+# The enabled and repeat_mask columns are indexed to quickly retrieve the
+# active alarms. Databases created with the previous schema, with a boolean
+# column for each weekday, are automatically migrated when opened.
+#
+# The alarms revision increases with every change to the alarms, so the
+# changes since any revision can be retrieved to synchronise other systems.
+# The deleted alarms are kept in a 'tombstones' table for that purpose:
+#   uid: Unique string of the deleted alarm.
+#   timestamp: Indicates time of the deletion, in seconds since 1970.
+#   revision: Indicates the alarms revision of the deletion.
+# The tombstones are removed once they are older than the last 1000 alarms
+# revisions, so a system synchronising from an older revision gets all the
+# alarms again as a full synchronisation, which replaces all its alarms.
 #
 # It also contains a 'settings' table to contain general alarm configuration
 # settings. The rows and columns are predetermined to the following
 # configuration for simple conversion to json.
 #   row 1 -> column 'snooze_time', column 'offset_alert_time'
 #
+# And a 'snoozes' table with the snoozed alarms, to survive a restart:
+#   alarm_id: Primary key ID of the snoozed alarm, one snooze per alarm.
+#   alert_time: Time, in seconds since 1970, for the snoozed alarm to alert.
+#
 from __future__ import unicode_literals, absolute_import, print_function
 import sys
 import json
-import time
+import uuid
 import types
-# StringIO embedded into io in python 3
-try:
-    import StringIO
-except ImportError:
-    from io import StringIO
+import threading
 try:
     import dataset
+    import sqlalchemy
+    from sqlalchemy.pool import QueuePool
 except ImportError:
     print("The dataset package needs to be installed !\nThe LightUpAlarm " +
           "folder contains a README file with more information.")
     sys.exit(1)
 try:
     from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.Clock import SystemClock
     from LightUpAlarm.Py23Compatibility import *
 except ImportError:
     from AlarmItem import AlarmItem
+    from Clock import SystemClock
     from Py23Compatibility import *
 
 
 class AlarmDb(object):
     """ Creates and manages a Sqlite database to store and retrieve alarms. """
 
+    # Long-lived dataset Database instances, one per database file, shared by
+    # all AlarmDb instances (and threads) of the process. Each one owns a single
+    # SQLAlchemy engine with its connection pool and reflected table metadata.
+    __databases = {}
+    __databases_lock = threading.Lock()
+    # Current alarms revision of each database file, and the lock held while
+    # the alarms are changed, so that each change gets the next revision and
+    # the revision is only increased once the change has been committed
+    __revisions = {}
+    __write_lock = threading.RLock()
+    # Number of alarms revisions the tombstones are kept for
+    tombstone_retention = 1000
+
     #
     # constructor
     #
-    def __init__(self, db_name=None):
+    def __init__(self, db_name=None, clock=None):
         """
         AlarmDbHelper initialiser. It can take an argument to indicate the
         sqlite database filename.
         By default if no settings are found in the db it wll add the snooze
         time to be 3 min, and the offset alert time to be -15 min.
         :param db_name: Optional string indicating the database filename.
+        :param clock: Optional Clock instance to read the time for the alarm
+                      timestamps. Defaults to the system clock.
         """
+        self.__clock = clock if clock is not None else SystemClock()
         if isinstance(db_name, str_type):
             self.db_file = 'sqlite:///%s.db' % db_name
         else:
@@ -73,25 +103,186 @@ class AlarmDb(object):
                       'constructor is not a valid String !')
             self.db_file = 'sqlite:///alarmdatabase.db'
 
-        # Check if the settings table is empty
-        settings_table = self.__connect_settings()
-        rows = settings_table.all()
-        if rows.count == 0:
-            settings_table.insert(dict(snooze_time=3, offset_alert_time=-15))
+        # Opening the database also sets the default settings if required
+        self.open()
+
+    #
+    # db connection lifecycle member functions
+    #
+    def open(self):
+        """
+        Opens the database for this instance file, or reuses the one already
+        opened by any other AlarmDb instance for the same file.
+        The SQLAlchemy engine is created with a thread-safe connection pool, so
+        the same database can be shared by the CLI, server and alarm threads.
+        The first time the database is opened the default settings are added
+        to the settings table if it is empty, so that check only runs once per
+        process instead of for every AlarmDb instance.
+        :return: The dataset Database instance for this database file.
+        """
+        # Fast path without locking, dict access is atomic
+        database = AlarmDb.__databases.get(self.db_file)
+        if database is None:
+            with AlarmDb.__databases_lock:
+                database = AlarmDb.__databases.get(self.db_file)
+                if database is None:
+                    revision = AlarmDb.__prepare_alarms_schema(self.db_file)
+                    database = dataset.connect(
+                        self.db_file,
+                        engine_kwargs=dict(
+                            poolclass=QueuePool, pool_size=5, max_overflow=10,
+                            connect_args={'check_same_thread': False}))
+                    settings_table = database['settings']
+                    if settings_table.all().count == 0:
+                        settings_table.insert(
+                            dict(snooze_time=3, offset_alert_time=-15))
+                    AlarmDb.__revisions[self.db_file] = revision
+                    AlarmDb.__databases[self.db_file] = database
+        return database
+
+    def close(self):
+        """
+        Closes the database for this instance file, disposing of the connection
+        pool shared by all the AlarmDb instances using the same file. It will
+        be transparently reopened if any of those instances is used again.
+        :return: Boolean indicating if there was an open database to close.
+        """
+        with AlarmDb.__databases_lock:
+            database = AlarmDb.__databases.pop(self.db_file, None)
+        if database is None:
+            return False
+        database.engine.dispose()
+        return True
+
+    @classmethod
+    def close_all(cls):
+        """
+        Closes all the databases opened by any AlarmDb instance. To be used on
+        application exit.
+        """
+        with cls.__databases_lock:
+            databases = list(cls.__databases.values())
+            cls.__databases.clear()
+        for database in databases:
+            database.engine.dispose()
+
+    @staticmethod
+    def __prepare_alarms_schema(db_file):
+        """
+        Creates the 'alarms', 'tombstones' and 'snoozes' tables and their
+        indexes if they do not exist, and migrates the tables from the previous
+        schemas (a boolean column per weekday, without the synchronisation
+        columns, or snoozes without a unique alarm ID) if required.
+        It runs before the dataset Database is created, so that it reflects
+        the final table schema.
+        :param db_file: String with the database SQLAlchemy url.
+        :return: Integer with the current alarms revision.
+        """
+        engine = sqlalchemy.create_engine(db_file)
+        try:
+            with engine.begin() as connection:
+                columns = []
+                if engine.dialect.has_table(connection, 'alarms'):
+                    columns = [row[1] for row in connection.execute(
+                        'PRAGMA table_info(alarms)')]
+                if columns and 'repeat_mask' not in columns:
+                    connection.execute(
+                        'ALTER TABLE alarms RENAME TO alarms_legacy')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS alarms ('
+                    'id INTEGER NOT NULL PRIMARY KEY, hour INTEGER, '
+                    'minute INTEGER, repeat_mask INTEGER, enabled BOOLEAN, '
+                    'label TEXT, timestamp BIGINT, uid TEXT, '
+                    'revision INTEGER)')
+                if columns and 'repeat_mask' not in columns:
+                    # Columns might be missing if the legacy table was empty
+                    legacy = dict((column, column if column in columns else
+                                   'NULL') for column in
+                                  ('hour', 'minute', 'enabled', 'label',
+                                   'timestamp'))
+                    legacy['repeat_mask'] = ' + '.join(
+                        'COALESCE(%s, 0) * %d' % (day.lower(), 1 << i)
+                        for i, day in enumerate(AlarmItem.day_names)
+                        if day.lower() in columns) or '0'
+                    connection.execute(
+                        'INSERT INTO alarms (id, hour, minute, repeat_mask, '
+                        'enabled, label, timestamp) SELECT id, %(hour)s, '
+                        '%(minute)s, %(repeat_mask)s, %(enabled)s, '
+                        '%(label)s, %(timestamp)s FROM alarms_legacy' % legacy)
+                    connection.execute('DROP TABLE alarms_legacy')
+                elif columns and 'uid' not in columns:
+                    connection.execute('ALTER TABLE alarms ADD COLUMN uid TEXT')
+                    connection.execute(
+                        'ALTER TABLE alarms ADD COLUMN revision INTEGER')
+                # The alarms from before the synchronisation get an uid, and
+                # the first revision so they are included in any full sync
+                for row in connection.execute(
+                        'SELECT id FROM alarms WHERE uid IS NULL').fetchall():
+                    connection.execute(
+                        'UPDATE alarms SET uid = ?, revision = 1 WHERE id = ?',
+                        (uuid.uuid4().hex, row[0]))
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS tombstones ('
+                    'uid TEXT NOT NULL PRIMARY KEY, timestamp BIGINT, '
+                    'revision INTEGER)')
+                # The snoozes table used to be created by dataset, with its
+                # own ID column, so an alarm could end up with two snoozes
+                snooze_columns = []
+                if engine.dialect.has_table(connection, 'snoozes'):
+                    snooze_columns = [row[1] for row in connection.execute(
+                        'PRAGMA table_info(snoozes)') if row[5]]
+                if snooze_columns and snooze_columns != ['alarm_id']:
+                    connection.execute(
+                        'ALTER TABLE snoozes RENAME TO snoozes_legacy')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS snoozes ('
+                    'alarm_id INTEGER NOT NULL PRIMARY KEY, '
+                    'alert_time BIGINT NOT NULL)')
+                if snooze_columns and snooze_columns != ['alarm_id']:
+                    # The latest snooze of each alarm replaces the older ones
+                    connection.execute(
+                        'INSERT OR REPLACE INTO snoozes (alarm_id, alert_time) '
+                        'SELECT alarm_id, alert_time FROM snoozes_legacy '
+                        'WHERE alarm_id IS NOT NULL AND alert_time IS NOT NULL '
+                        'ORDER BY id')
+                    connection.execute('DROP TABLE snoozes_legacy')
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS ix_alarms_active ON alarms '
+                    '(enabled, repeat_mask)')
+                connection.execute(
+                    'CREATE UNIQUE INDEX IF NOT EXISTS ix_alarms_uid ON alarms '
+                    '(uid)')
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS ix_alarms_revision ON alarms '
+                    '(revision)')
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS ix_tombstones_revision ON '
+                    'tombstones (revision)')
+                return connection.execute(
+                    'SELECT MAX(revision) FROM (SELECT revision FROM alarms '
+                    'UNION ALL SELECT revision FROM tombstones)'
+                ).scalar() or 0
+        finally:
+            engine.dispose()
 
     #
     # db connection member functions
     #
     def __connect_alarms(self):
         """ Connecting to a SQLite database table 'alarms'. """
-        alarms_table = dataset.connect(self.db_file)['alarms']
+        alarms_table = self.open()['alarms']
         return alarms_table
 
     def __connect_settings(self):
         """ Connecting to a SQLite database table 'settings'. """
-        settings_table = dataset.connect(self.db_file)['settings']
+        settings_table = self.open()['settings']
         return settings_table
 
+    def __connect_snoozes(self):
+        """ Connecting to a SQLite database table 'snoozes'. """
+        snoozes_table = self.open()['snoozes']
+        return snoozes_table
+
     #
     # member functions to set settings
     #
@@ -159,6 +350,55 @@ class AlarmDb(object):
             success = bool(insert_success)
         return success
 
+    #
+    # member functions for the alarm snoozes
+    #
+    def set_snooze(self, alarm_id, alert_time):
+        """
+        Saves the snooze of an alarm, replacing any previous snooze for it.
+        :param alarm_id: Integer to indicate the ID of the snoozed alarm.
+        :param alert_time: Time, in seconds since 1970, for the snoozed alarm
+                           to alert.
+        :return: Boolean indicating the operation success.
+        """
+        snooze_dict = dict(
+            alarm_id=alarm_id, alert_time=int(round(alert_time)))
+        database = self.open()
+        # The alarm_id primary key keeps a single snooze per alarm
+        result = database.executable.execute(
+            database['snoozes'].table.insert().prefix_with('OR REPLACE'),
+            snooze_dict)
+        return result.rowcount > 0
+
+    def get_snoozes(self):
+        """
+        Retrieves all the alarm snoozes.
+        :return: Dictionary with the snoozed alarm IDs as keys and their alert
+                 time, in seconds since 1970, as values.
+        """
+        snoozes_table = self.__connect_snoozes()
+        return dict((row['alarm_id'], row['alert_time'])
+                    for row in snoozes_table.all())
+
+    def delete_snooze(self, alarm_id):
+        """
+        Removes the snooze of an alarm.
+        :param alarm_id: Integer to indicate the ID of the snoozed alarm.
+        :return: Boolean indicating the success of the 'delete' operation.
+        """
+        snoozes_table = self.__connect_snoozes()
+        success = snoozes_table.delete(alarm_id=alarm_id)
+        return success
+
+    def delete_all_snoozes(self):
+        """
+        Removes all the alarm snoozes.
+        :return: Boolean indicating the success of the 'delete' operation.
+        """
+        snoozes_table = self.__connect_snoozes()
+        success = snoozes_table.delete()
+        return success
+
     #
     # member functions to retrieve alarm data
     #
@@ -176,18 +416,7 @@ class AlarmDb(object):
         :return: List of AlarmItems containing all alarms. Returns an empty list
                  if there aren't any.
         """
-        alarms_table = self.__connect_alarms()
-        alarm_list = []
-        for alarm in alarms_table:
-            alarm_list.append(
-                AlarmItem(alarm['hour'], alarm['minute'],
-                          days=(alarm['monday'], alarm['tuesday'],
-                                alarm['wednesday'], alarm['thursday'],
-                                alarm['friday'], alarm['saturday'],
-                                alarm['sunday']),
-                          enabled=alarm['enabled'], label=alarm['label'],
-                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
-        return alarm_list
+        return self.__select_alarms()
 
     def get_all_enabled_alarms(self):
         """
@@ -195,19 +424,7 @@ class AlarmDb(object):
         :return: List of AlarmItems containing all enabled alarms. Returns an
                  empty list if there aren't any.
         """
-        alarms_table = self.__connect_alarms()
-        alarm_list = []
-        enabled_alarms = alarms_table.find(enabled=True)
-        for alarm in enabled_alarms:
-            alarm_list.append(
-                AlarmItem(alarm['hour'], alarm['minute'],
-                          days=(alarm['monday'], alarm['tuesday'],
-                                alarm['wednesday'], alarm['thursday'],
-                                alarm['friday'], alarm['saturday'],
-                                alarm['sunday']),
-                          enabled=alarm['enabled'], label=alarm['label'],
-                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
-        return alarm_list
+        return self.__select_alarms(lambda c: c.enabled == True)
 
     def get_all_disabled_alarms(self):
         """
@@ -215,19 +432,35 @@ class AlarmDb(object):
         :return: List of AlarmItems containing all disabled alarms. Returns an
                  empty list if there aren't any.
         """
-        alarms_table = self.__connect_alarms()
-        alarm_list = []
-        disabled_alarms = alarms_table.find(enabled=False)
-        for alarm in disabled_alarms:
-            alarm_list.append(
-                AlarmItem(alarm['hour'], alarm['minute'],
-                          days=(alarm['monday'], alarm['tuesday'],
-                                alarm['wednesday'], alarm['thursday'],
-                                alarm['friday'], alarm['saturday'],
-                                alarm['sunday']),
-                          enabled=alarm['enabled'], label=alarm['label'],
-                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
-        return alarm_list
+        return self.__select_alarms(lambda c: c.enabled == False)
+
+    def get_all_active_alarms(self):
+        """
+        Returns all the active alarms (enabled with at least one repeat day) in
+        a list of AlarmItems. The filter is done in an indexed query.
+        :return: List of AlarmItems containing all active alarms. Returns an
+                 empty list if there aren't any.
+        """
+        return self.__select_alarms(
+            lambda c: sqlalchemy.and_(c.enabled == True, c.repeat_mask != 0))
+
+    def __select_alarms(self, where=None):
+        """
+        Selects rows from the 'alarms' table, ordered by ID, and materialises
+        them into AlarmItems in a single pass. The query is executed directly
+        with SQLAlchemy, as the dataset result iterator converts every row into
+        an OrderedDict, which is slower than building the AlarmItems.
+        :param where: Optional function that receives the table columns and
+                      returns the SQLAlchemy filter expression for the query.
+        :return: List of AlarmItems with the selected rows.
+        """
+        database = self.open()
+        table = database['alarms'].table
+        query = table.select()
+        if where is not None:
+            query = query.where(where(table.c))
+        query = query.order_by(table.c.id)
+        return AlarmItem.from_rows(database.executable.execute(query))
 
     def get_alarm(self, alarm_id):
         """
@@ -242,46 +475,253 @@ class AlarmDb(object):
         if alarm_dict is None:
             return None
         else:
-            return AlarmItem(alarm_dict['hour'], alarm_dict['minute'],
-                             days=(alarm_dict['monday'], alarm_dict['tuesday'],
-                                   alarm_dict['wednesday'],
-                                   alarm_dict['thursday'],
-                                   alarm_dict['friday'], alarm_dict['saturday'],
-                                   alarm_dict['sunday']),
-                             enabled=alarm_dict['enabled'],
-                             label=alarm_dict['label'],
-                             timestamp=alarm_dict['timestamp'],
-                             alarm_id=alarm_dict['id'])
+            return AlarmDb.__alarm_from_dict(alarm_dict)
 
-    def export_alarms_json(self):
+    def get_alarms(self, alarm_ids):
         """
-        Exports all the alarm data into a JSON string.
-        The dataset.freeze() method exports the table into a file object, but
-        it is going to be "tricked" into getting an string object to send back.
-        Because it also closes the object file we need to overwrite the close
-        function to retrieve the data and, then restore it back to normal.
-        :return: String containing all the alarm data
+        Get the alarms with the given IDs from the database, using a single
+        'IN' query for every batch of up to 500 IDs, as SQLite limits the
+        number of parameters per query.
+        :param alarm_ids: Iterable of integers to indicate the primary keys of
+                          the alarms to get.
+        :return: List of AlarmItems with the alarms data, ordered by ID. IDs
+                 not found are not included.
         """
-        def fake_close():
-            pass
-        out_iostr = StringIO.StringIO()
-        original_close = out_iostr.close
-        alarms_table = self.__connect_alarms()
+        alarm_ids = sorted(set(alarm_ids))
+        alarms = []
+        for i in range(0, len(alarm_ids), 500):
+            batch = alarm_ids[i:i + 500]
+            alarms.extend(self.__select_alarms(lambda c: c.id.in_(batch)))
+        return alarms
 
-        # Retrieve the db as a json StringIO without the close method
-        out_iostr.close = fake_close
-        dataset.freeze(alarms_table.all(), format='json', fileobj=out_iostr)
-        out_str = out_iostr.getvalue()
-        out_iostr.close = original_close
-        out_iostr.close()
+    @staticmethod
+    def __alarm_from_dict(alarm_dict):
+        """
+        Converts an 'alarms' table row into an AlarmItem. The row data was
+        validated before being saved, so the trusted constructor is used.
+        :param alarm_dict: Dictionary with the data from an 'alarms' table row.
+        :return: AlarmItem with the row data.
+        """
+        return AlarmItem.from_row(alarm_dict['hour'], alarm_dict['minute'],
+                                  repeat_mask=alarm_dict['repeat_mask'],
+                                  enabled=alarm_dict['enabled'],
+                                  label=alarm_dict['label'],
+                                  timestamp=alarm_dict['timestamp'],
+                                  alarm_id=alarm_dict['id'])
 
-        # Get only the required data and format it
-        alarms_dict = {'alarms': json.loads(out_str)['results']}
+    @staticmethod
+    def __dict_from_alarm(alarm_item):
+        """
+        Converts an AlarmItem into an 'alarms' table row, without the ID.
+        :param alarm_item: AlarmItem with the data for the row.
+        :return: Dictionary with the 'alarms' table row data.
+        """
+        return dict(hour=alarm_item.hour, minute=alarm_item.minute,
+                    repeat_mask=alarm_item.repeat_mask,
+                    enabled=alarm_item.enabled, label=alarm_item.label,
+                    timestamp=alarm_item.timestamp)
+
+    def export_alarms_json(self):
+        """
+        Exports all the alarm data into a JSON string, with a boolean value
+        per repeat weekday.
+        :return: String containing all the alarm data
+        """
+        alarms_list = []
+        for alarm in self.get_all_alarms():
+            alarm_dict = dict(id=alarm.id_, hour=alarm.hour,
+                              minute=alarm.minute, enabled=alarm.enabled,
+                              label=alarm.label, timestamp=alarm.timestamp)
+            for day_name, day_repeat in zip(AlarmItem.day_names, alarm.repeat):
+                alarm_dict[day_name.lower()] = day_repeat
+            alarms_list.append(alarm_dict)
+        alarms_dict = {'alarms': alarms_list}
 
         # This commented out line would prettify the string
         #json.dumps(alarms_dict, indent=4, separators=(',', ': '))
         return json.dumps(alarms_dict)
 
+    #
+    # member functions for the alarms revision and synchronisation
+    #
+    def get_revision(self):
+        """
+        Gets the alarms revision, which increases with every change to the
+        alarms. It is kept in memory, so it can be checked without reading the
+        database. The revision is increased after the change is committed, so
+        it should be read before the alarms data it is used to tag.
+        :return: Integer with the alarms revision.
+        """
+        self.open()
+        return AlarmDb.__revisions.get(self.db_file, 0)
+
+    def __set_revision(self, revision):
+        """
+        Sets the alarms revision once a change has been committed. To be called
+        with the write lock held.
+        :param revision: Integer with the revision of the committed change.
+        """
+        AlarmDb.__revisions[self.db_file] = revision
+
+    def get_changes(self, since=0):
+        """
+        Gets the alarms changed and deleted after an alarms revision, to
+        synchronise them into another system.
+        The tombstones are only kept for the last tombstone_retention
+        revisions, so for an older revision the deletions might have been
+        removed. In that case all the alarms and tombstones are returned as a
+        full synchronisation, which has to replace all the alarms of the other
+        system, as done by apply_changes() with full set to True.
+        :param since: Integer with the alarms revision of the last
+                      synchronisation, 0 to get all the alarms and tombstones.
+        :return: Tuple with the current alarms revision, a list of
+                 (uid, AlarmItem) tuples with the changed alarms, a list of
+                 (uid, timestamp) tuples with the deleted alarms, and a Boolean
+                 indicating if it is a full synchronisation. The changes can be
+                 newer than the returned revision, but never older.
+        """
+        # The revision is read first, so no change up to it can be missed
+        revision = self.get_revision()
+        full = 0 < since < revision - AlarmDb.tombstone_retention
+        if full is True:
+            since = 0
+        database = self.open()
+        table = database['alarms'].table
+        rows = database.executable.execute(
+            table.select().where(table.c.revision > since).order_by(
+                table.c.revision)).fetchall()
+        alarms = list(zip([row['uid'] for row in rows],
+                          AlarmItem.from_rows(rows)))
+        table = database['tombstones'].table
+        deleted = [(row['uid'], row['timestamp']) for row in
+                   database.executable.execute(
+                       table.select().where(table.c.revision > since).order_by(
+                           table.c.revision))]
+        return revision, alarms, deleted, full
+
+    def apply_changes(self, alarms=(), deleted=(), full=False):
+        """
+        Applies the alarm changes and deletions from another system, as
+        retrieved with its get_changes(), in a single transaction.
+        The conflicts are resolved with the last writer wins rule on the alarm
+        timestamps, so a change is only applied if it is newer than the local
+        alarm or tombstone. On the same timestamp a deletion wins, and between
+        two changes the alarm data decides, so all systems reach the same
+        result. The applied changes keep their timestamp and get a new local
+        revision, so they are passed on to the systems synchronising from this
+        one.
+        :param alarms: Iterable of (uid, AlarmItem) tuples with the changed
+                       alarms. The AlarmItem IDs are ignored.
+        :param deleted: Iterable of (uid, timestamp) tuples with the deleted
+                        alarms.
+        :param full: Boolean indicating a full synchronisation, as returned by
+                     get_changes(), in which case the local alarms not included
+                     in the alarms are deleted, as their tombstones might have
+                     been removed from the other system.
+        :return: Tuple with a list of AlarmItems of the added alarms, a list of
+                 AlarmItems of the edited alarms, and a list of the IDs of the
+                 deleted alarms, or None if any of the inputs is invalid (in
+                 which case nothing is applied).
+        """
+        alarms = list(alarms)
+        deleted = list(deleted)
+        for uid, alarm_item in alarms:
+            if not isinstance(uid, str_type) or \
+                    not isinstance(alarm_item, AlarmItem) or \
+                    alarm_item.timestamp is None:
+                print('ERROR: Provided alarms to AlarmDb().apply_changes must '
+                      'be (uid, AlarmItem) tuples with a timestamp and not '
+                      '(%s, %s) !' % (type(uid), type(alarm_item)),
+                      file=sys.stderr)
+                return None
+        for uid, timestamp in deleted:
+            if not isinstance(uid, str_type) or \
+                    not isinstance(timestamp, int_type):
+                print('ERROR: Provided deleted alarms to AlarmDb().'
+                      'apply_changes must be (uid, timestamp) tuples and not '
+                      '(%s, %s) !' % (type(uid), type(timestamp)),
+                      file=sys.stderr)
+                return None
+
+        added, edited, deleted_ids = [], [], []
+        tombstones = 0
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            database = self.open()
+            with database:
+                alarms_table = database['alarms']
+                tombstones_table = database['tombstones']
+                for uid, alarm_item in alarms:
+                    new_dict = AlarmDb.__dict_from_alarm(alarm_item)
+                    alarm_dict = alarms_table.find_one(uid=uid)
+                    if alarm_dict is None:
+                        tombstone = tombstones_table.find_one(uid=uid)
+                        if tombstone is not None and \
+                                AlarmDb.__version(tombstone, deleted=True) >= \
+                                AlarmDb.__version(new_dict):
+                            continue
+                        new_dict['uid'] = uid
+                        new_dict['revision'] = revision
+                        new_dict['id'] = alarms_table.insert(new_dict)
+                        tombstones_table.delete(uid=uid)
+                        added.append(AlarmDb.__alarm_from_dict(new_dict))
+                    elif AlarmDb.__version(new_dict) > \
+                            AlarmDb.__version(alarm_dict):
+                        new_dict['id'] = alarm_dict['id']
+                        new_dict['revision'] = revision
+                        alarms_table.update(new_dict, ['id'])
+                        edited.append(AlarmDb.__alarm_from_dict(new_dict))
+                for uid, timestamp in deleted:
+                    tombstone = dict(
+                        uid=uid, timestamp=timestamp, revision=revision)
+                    alarm_dict = alarms_table.find_one(uid=uid)
+                    if alarm_dict is None:
+                        old_tombstone = tombstones_table.find_one(uid=uid)
+                        if old_tombstone is not None and \
+                                old_tombstone['timestamp'] >= timestamp:
+                            continue
+                    elif AlarmDb.__version(alarm_dict) > \
+                            AlarmDb.__version(tombstone, deleted=True):
+                        continue
+                    else:
+                        alarms_table.delete(id=alarm_dict['id'])
+                        deleted_ids.append(alarm_dict['id'])
+                    # Unknown alarms are recorded as well, to pass them on
+                    tombstones_table.upsert(tombstone, ['uid'])
+                    tombstones += 1
+                if full:
+                    uids = [uid for uid, _ in alarms]
+                    table = alarms_table.table
+                    query = sqlalchemy.select([table.c.id])
+                    if uids:
+                        query = query.where(~table.c.uid.in_(uids))
+                    ids = [row[0] for row in
+                           database.executable.execute(query)]
+                    if ids and self.__delete_alarm_rows(
+                            database, revision, lambda c: c.id.in_(ids)):
+                        deleted_ids.extend(ids)
+                        tombstones += len(ids)
+                if tombstones:
+                    AlarmDb.__purge_tombstones(database, revision)
+            if added or edited or tombstones:
+                self.__set_revision(revision)
+        return added, edited, deleted_ids
+
+    @staticmethod
+    def __version(row, deleted=False):
+        """
+        Gets the version of an alarm or tombstone row, to be compared when
+        resolving the synchronisation conflicts. They are ordered by timestamp,
+        then the deletions go after the changes, then by the alarm data.
+        :param row: Dictionary with the 'alarms' or 'tombstones' table row.
+        :param deleted: Boolean indicating if the row is a tombstone.
+        :return: Tuple to compare the versions.
+        """
+        if deleted is True:
+            return row['timestamp'], 1
+        return (row['timestamp'], 0, row['hour'], row['minute'],
+                row['repeat_mask'], bool(row['enabled']), row['label'] or '')
+
     #
     # member functions to add alarm data
     #
@@ -304,21 +744,67 @@ class AlarmDb(object):
                   file=sys.stderr)
             return
 
-        # When a new alarm is added, include the current time (in seconds since
-        # 1970) as the timestamp if not defined already
-        if alarm_item.timestamp is None:
-            alarm_item.timestamp = int(round(time.time()))
-
-        alarms_table = self.__connect_alarms()
-        key = alarms_table.insert(
-            dict(hour=alarm_item.hour, minute=alarm_item.minute,
-                 monday=alarm_item.monday, tuesday=alarm_item.tuesday,
-                 wednesday=alarm_item.wednesday, thursday=alarm_item.thursday,
-                 friday=alarm_item.friday, saturday=alarm_item.saturday,
-                 sunday=alarm_item.sunday, enabled=alarm_item.enabled,
-                 label=alarm_item.label, timestamp=alarm_item.timestamp))
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            key = self.__insert_alarm_row(
+                self.__connect_alarms(), revision, alarm_item)
+            self.__set_revision(revision)
         return key
 
+    def add_alarms(self, alarm_items):
+        """
+        Adds several alarms to the database in a single transaction. The
+        timestamp of each AlarmItem is set as in add_alarm().
+        :param alarm_items: Iterable of AlarmItems to add.
+        :return: List of the new rows primary keys, in the same order as the
+                 input alarms, or None if any item is not an AlarmItem (in which
+                 case nothing is added).
+        """
+        alarm_items = list(alarm_items)
+        for alarm_item in alarm_items:
+            if not isinstance(alarm_item, AlarmItem):
+                print('ERROR: Provided alarms to AlarmDb().add_alarms must ' +
+                      'be of the AlarmItem type and not %s !' %
+                      type(alarm_item),
+                      file=sys.stderr)
+                return None
+
+        timestamp = int(round(self.__clock.time()))
+        keys = []
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            database = self.open()
+            with database:
+                alarms_table = database['alarms']
+                for alarm_item in alarm_items:
+                    keys.append(self.__insert_alarm_row(
+                        alarms_table, revision, alarm_item, timestamp))
+            if keys:
+                self.__set_revision(revision)
+        return keys
+
+    def __insert_alarm_row(self, alarms_table, revision, alarm_item,
+                           timestamp=None):
+        """
+        Inserts an AlarmItem into the 'alarms' table with a new uid. When a new
+        alarm is added, the current time (in seconds since 1970) is included
+        as the timestamp if not defined already.
+        To be called with the write lock held.
+        :param alarms_table: dataset Table of the 'alarms' table.
+        :param revision: Integer with the alarms revision of the change.
+        :param alarm_item: AlarmItem to add.
+        :param timestamp: Optional time to use if the alarm has no timestamp,
+                          instead of the current time.
+        :return: Integer row primary key.
+        """
+        if alarm_item.timestamp is None:
+            alarm_item.timestamp = timestamp if timestamp is not None else \
+                int(round(self.__clock.time()))
+        alarm_dict = AlarmDb.__dict_from_alarm(alarm_item)
+        alarm_dict['uid'] = uuid.uuid4().hex
+        alarm_dict['revision'] = revision
+        return alarms_table.insert(alarm_dict)
+
     #
     # member functions to edit alarm data
     #
@@ -326,88 +812,80 @@ class AlarmDb(object):
                    enabled=None, label=None):
         """
         Edits an alarm to the database with the new input data.
-        Uses the input sanitation of the AlarmItem class before the data is set.
+        Uses the input sanitation of the AlarmItem class to validate all the
+        inputs at once before any data is set. Only the columns with a changed
+        value are written, together with a new timestamp, in a single UPDATE
+        within a single transaction, so the alarm is never left half edited.
+        :param alarm_id: Integer to indicate the ID of the alarm to be edited.
         :param hour: Optional integer to indicate the new alarm hour.
         :param minute: Optional integer to indicate the new alarm minute.
         :param days: Optional 7-item list of booleans to indicate the new repeat
                      week days.
         :param enabled: Optional boolean to indicate new alarm enabled state.
-        :return: Boolean indicating the success of the 'edit' operation.
+        :param label: Optional string to indicate the new alarm label.
+        :return: AlarmItem with the updated alarm data, or None if the input
+                 data was invalid or the alarm could not be found.
         """
-        alarms_table = self.__connect_alarms()
-        success = True
-
-        # Parse hour variable
-        if hour is not None:
-            alarm_item = AlarmItem(hour, 0)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, hour=alarm_item.hour), ['id'])
-                if not individual_success:
-                    success = False
-            else:
-                success = False
-
-        # Parse minute variable
-        if minute is not None:
-            alarm_item = AlarmItem(0, minute)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, minute=alarm_item.minute), ['id'])
-                if not individual_success:
-                    success = False
-            else:
-                success = False
-
-        # Parse days variable
-        if days is not None:
-            alarm_item = AlarmItem(0, 0, days=days)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, monday=alarm_item.monday,
-                         tuesday=alarm_item.tuesday,
-                         wednesday=alarm_item.wednesday,
-                         thursday=alarm_item.thursday,
-                         friday=alarm_item.friday,
-                         saturday=alarm_item.saturday,
-                         sunday=alarm_item.sunday),
-                    ['id'])
-                if not individual_success:
-                    success = False
-            else:
-                success = False
-
-        # Parse enabled variable
-        if enabled is not None:
-            alarm_item = AlarmItem(0, 0, enabled=enabled)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, enabled=alarm_item.enabled), ['id'])
-                if not individual_success:
-                    success = False
-            else:
-                success = False
-
-        # Parse label variable
-        if label is not None:
-            alarm_item = AlarmItem(0, 0, label=label)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, label=alarm_item.label), ['id'])
-                if not individual_success:
-                    success = False
-            else:
-                success = False
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            database = self.open()
+            with database:
+                alarm_dict, changed = self.__edit_alarm_row(
+                    database['alarms'], revision, alarm_id, hour=hour,
+                    minute=minute, days=days, enabled=enabled, label=label)
+            if changed is True:
+                self.__set_revision(revision)
 
-        # Apply the timestamp if changes have been successful
-        if success is True:
-            new_timestamp = int(round(time.time()))
-            individual_success = alarms_table.update(
-                dict(id=alarm_id, timestamp=new_timestamp), ['id'])
-            if not individual_success:
-                success = False
+        if alarm_dict is None:
+            return None
+        return AlarmDb.__alarm_from_dict(alarm_dict)
 
-        return success
+    def __edit_alarm_row(self, alarms_table, revision, alarm_id, hour=None,
+                         minute=None, days=None, enabled=None, label=None):
+        """
+        Edits an 'alarms' table row as described in edit_alarm(). To be called
+        within a transaction with the write lock held.
+        :param alarms_table: dataset Table of the 'alarms' table.
+        :param revision: Integer with the alarms revision of the change.
+        :return: Tuple with the dictionary of the edited row data, or None if
+                 the input data was invalid or the alarm could not be found,
+                 and a boolean indicating if the row has been changed.
+        """
+        # Validate all inputs together, the ones not being edited get defaults
+        alarm_item = AlarmItem(
+            hour if hour is not None else 0,
+            minute if minute is not None else 0,
+            days=days if days is not None else (False,) * 7,
+            enabled=enabled if enabled is not None else True,
+            label=label if label is not None else '')
+        if alarm_item is None:
+            return None, False
+
+        alarm_dict = alarms_table.find_one(id=alarm_id)
+        if alarm_dict is None:
+            return None, False
+
+        changes = {}
+        if hour is not None and alarm_dict['hour'] != alarm_item.hour:
+            changes['hour'] = alarm_item.hour
+        if minute is not None and alarm_dict['minute'] != alarm_item.minute:
+            changes['minute'] = alarm_item.minute
+        if days is not None and \
+                alarm_dict['repeat_mask'] != alarm_item.repeat_mask:
+            changes['repeat_mask'] = alarm_item.repeat_mask
+        if enabled is not None and alarm_dict['enabled'] != alarm_item.enabled:
+            changes['enabled'] = alarm_item.enabled
+        if label is not None and alarm_dict['label'] != alarm_item.label:
+            changes['label'] = alarm_item.label
+
+        # Only write, with a new timestamp, if something has changed
+        if changes:
+            changes['id'] = alarm_id
+            changes['timestamp'] = int(round(self.__clock.time()))
+            changes['revision'] = revision
+            alarms_table.update(changes, ['id'])
+            alarm_dict.update(changes)
+        return alarm_dict, bool(changes)
 
     def update_alarm(self, alarm):
         """
@@ -417,21 +895,60 @@ class AlarmDb(object):
         :return: Boolean indicating the success of the 'update' operation.
         """
         if isinstance(alarm, AlarmItem):
-            alarms_table = self.__connect_alarms()
-            alarm.timestamp = int(round(time.time()))
-            success = alarms_table.update(
-                dict(id=alarm.id_, hour=alarm.hour, minute=alarm.minute,
-                     monday=alarm.monday, tuesday=alarm.tuesday,
-                     wednesday=alarm.wednesday, thursday=alarm.thursday,
-                     friday=alarm.friday, saturday=alarm.saturday,
-                     sunday=alarm.sunday, enabled=alarm.enabled,
-                     label=alarm.label, timestamp=alarm.timestamp),
-                ['id'])
+            with AlarmDb.__write_lock:
+                revision = self.get_revision() + 1
+                alarms_table = self.__connect_alarms()
+                alarm.timestamp = int(round(self.__clock.time()))
+                alarm_dict = AlarmDb.__dict_from_alarm(alarm)
+                alarm_dict['id'] = alarm.id_
+                alarm_dict['revision'] = revision
+                success = alarms_table.update(alarm_dict, ['id'])
+                if success is True:
+                    self.__set_revision(revision)
         else:
             success = False
 
         return success
 
+    def update_alarms(self, alarms):
+        """
+        Updates several alarms in the database in a single transaction, and
+        updates the timestamp in the alarm instances. If any of the alarms
+        cannot be updated none of them are.
+        :param alarms: Iterable of AlarmItem instances of the alarms to update.
+        :return: Boolean indicating the success of the 'update' operation.
+        """
+        alarms = list(alarms)
+        for alarm in alarms:
+            if not isinstance(alarm, AlarmItem) or alarm.id_ is None:
+                return False
+
+        timestamp = int(round(self.__clock.time()))
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            database = self.open()
+            database.begin()
+            try:
+                alarms_table = database['alarms']
+                for alarm in alarms:
+                    alarm_dict = AlarmDb.__dict_from_alarm(alarm)
+                    alarm_dict['id'] = alarm.id_
+                    alarm_dict['timestamp'] = timestamp
+                    alarm_dict['revision'] = revision
+                    if not alarms_table.update(alarm_dict, ['id']):
+                        database.rollback()
+                        return False
+            except Exception:
+                database.rollback()
+                raise
+            database.commit()
+            if alarms:
+                self.__set_revision(revision)
+
+        for alarm in alarms:
+            alarm.timestamp = timestamp
+        return True
+
     #
     # member functions to remove alarm data
     #
@@ -442,15 +959,147 @@ class AlarmDb(object):
                          removed.
         :return: Boolean indicating the success of the 'delete' operation.
         """
-        alarms_table = self.__connect_alarms()
-        success = alarms_table.delete(id=alarm_id)
-        return success
+        return self.__delete_alarms(lambda c: c.id == alarm_id)
+
+    def delete_alarms(self, alarm_ids):
+        """
+        Remove the alarms with the given IDs from the database in a single
+        transaction.
+        :param alarm_ids: Iterable of integers to indicate the primary keys of
+                          the rows to be removed.
+        :return: Boolean indicating the success of the 'delete' operation.
+        """
+        alarm_ids = list(alarm_ids)
+        if not alarm_ids:
+            return False
+        return self.__delete_alarms(lambda c: c.id.in_(alarm_ids))
 
     def delete_all_alarms(self):
         """
-        Remove all the alarms by dropping the table and creating it again.
+        Remove all the alarms from the database.
         :return: Boolean indicating the success of the 'delete' operation.
         """
-        alarms_table = self.__connect_alarms()
-        success = alarms_table.delete()
-        return success
+        return self.__delete_alarms()
+
+    def __delete_alarms(self, where=None):
+        """
+        Removes alarms from the database, replacing them with tombstones for
+        the synchronisation, in a single transaction.
+        :param where: Optional function that receives the 'alarms' table
+                      columns and returns the SQLAlchemy filter expression for
+                      the alarms to remove. All the alarms are removed if None.
+        :return: Boolean indicating if any alarm has been removed.
+        """
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            database = self.open()
+            with database:
+                deleted = self.__delete_alarm_rows(database, revision, where)
+            if deleted is True:
+                self.__set_revision(revision)
+        return deleted
+
+    def __delete_alarm_rows(self, database, revision, where=None):
+        """
+        Removes rows from the 'alarms' table and adds their tombstones. To be
+        called within a transaction with the write lock held.
+        :param database: dataset Database of this instance file.
+        :param revision: Integer with the alarms revision of the change.
+        :param where: Optional function that receives the 'alarms' table
+                      columns and returns the SQLAlchemy filter expression for
+                      the alarms to remove. All the alarms are removed if None.
+        :return: Boolean indicating if any alarm has been removed.
+        """
+        timestamp = int(round(self.__clock.time()))
+        table = database['alarms'].table
+        query = sqlalchemy.select([table.c.uid])
+        delete = table.delete()
+        if where is not None:
+            query = query.where(where(table.c))
+            delete = delete.where(where(table.c))
+        uids = [row[0] for row in database.executable.execute(query)]
+        if uids:
+            database.executable.execute(
+                database['tombstones'].table.insert().prefix_with(
+                    'OR REPLACE'),
+                [dict(uid=uid, timestamp=timestamp, revision=revision)
+                 for uid in uids])
+            database.executable.execute(delete)
+            AlarmDb.__purge_tombstones(database, revision)
+        return bool(uids)
+
+    @staticmethod
+    def __purge_tombstones(database, revision):
+        """
+        Removes the tombstones older than the last tombstone_retention alarms
+        revisions. To be called within a transaction with the write lock held.
+        :param database: dataset Database of the tombstones.
+        :param revision: Integer with the alarms revision of the change.
+        """
+        table = database['tombstones'].table
+        database.executable.execute(table.delete().where(
+            table.c.revision <= revision - AlarmDb.tombstone_retention))
+
+    #
+    # member functions to apply several alarm operations at once
+    #
+    def apply_operations(self, operations):
+        """
+        Applies several add, edit and delete alarm operations in a single
+        transaction, in the given order. The operations are only saved if all
+        of them succeed, otherwise none of them are.
+        :param operations: Iterable of tuples with an operation name and its
+                           arguments, one of:
+                             ('add', AlarmItem)
+                             ('edit', alarm_id, dictionary with the
+                              edit_alarm() keyword arguments)
+                             ('delete', alarm_id)
+        :return: List with the result of each operation: the new alarm ID for
+                 'add', the edited AlarmItem for 'edit', and True for 'delete'.
+                 The operations that failed have a None result.
+        """
+        operations = list(operations)
+        results = []
+        changed = False
+        with AlarmDb.__write_lock:
+            revision = self.get_revision() + 1
+            database = self.open()
+            database.begin()
+            try:
+                alarms_table = database['alarms']
+                for operation in operations:
+                    result = None
+                    if operation[0] == 'add' and \
+                            isinstance(operation[1], AlarmItem):
+                        result = self.__insert_alarm_row(
+                            alarms_table, revision, operation[1])
+                        changed = True
+                    elif operation[0] == 'edit':
+                        alarm_dict, edited = self.__edit_alarm_row(
+                            alarms_table, revision, operation[1],
+                            **operation[2])
+                        if alarm_dict is not None:
+                            result = AlarmDb.__alarm_from_dict(alarm_dict)
+                        changed = changed or edited
+                    elif operation[0] == 'delete':
+                        alarm_id = operation[1]
+                        if self.__delete_alarm_rows(
+                                database, revision,
+                                lambda c: c.id == alarm_id):
+                            result = True
+                            changed = True
+                    else:
+                        print('ERROR: Provided operation to AlarmDb().'
+                              'apply_operations is not valid: %s !' %
+                              (operation,), file=sys.stderr)
+                    results.append(result)
+            except Exception:
+                database.rollback()
+                raise
+            if any(result is None for result in results):
+                database.rollback()
+            else:
+                database.commit()
+                if changed is True:
+                    self.__set_revision(revision)
+        return results
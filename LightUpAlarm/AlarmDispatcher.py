@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+#
+# Class to execute the alarm alert callbacks from a queue.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import sys
+import threading
+import traceback
+import collections
+import multiprocessing
+try:
+    from LightUpAlarm.Clock import SystemClock
+except ImportError:
+    from Clock import SystemClock
+
+
+class AlarmDispatcher(object):
+    """
+    Executes the alarm alerts, and their callbacks, in the same order they are
+    dispatched. The alerts are placed into a queue, from which a bounded pool
+    of worker threads takes them. The worker threads are launched as required,
+    up to the maximum number, and then wait for new alerts.
+
+    The same alert (same alarm data and callback) dispatched more than once
+    for the same minute is only executed once, as an alarm is meant to alert
+    once per minute.
+
+    If a timeout is set, each callback is executed on its own thread and its
+    worker waits for it for up to the timeout. If it has not finished by then
+    the worker continues with the next alert, so a slow callback, like one
+    controlling hardware, cannot hold the alerts behind it for longer than the
+    timeout. Python threads cannot be killed, so the late callback will still
+    run to completion.
+
+    For a hard deadline the callbacks can instead be executed in a supervised
+    child process each, which is terminated if it has not finished by the
+    timeout. A hung device driver or a callback holding the GIL then cannot
+    stall the alarm evaluation. Anything the callback starts, like threads,
+    ends with its process, so it has to finish its work before returning.
+
+    The number of executed, completed, failed (raised an exception), crashed
+    (process killed or exited abnormally) and timed out callbacks is recorded
+    in the alert statistics.
+
+    With no worker threads the alerts are executed straight away from the
+    thread dispatching them, which is useful to replay alarm schedules with a
+    simulated clock.
+    """
+
+    #
+    # metaclass methods
+    #
+    ISOLATION_MODES = ('thread', 'process')
+
+    def __init__(self, max_workers=2, timeout=60, clock=None,
+                 isolation='thread', alert_listener=None):
+        """
+        AlarmDispatcher initialiser.
+        :param max_workers: Maximum number of alerts executed at the same time.
+                            0 to execute the alerts from the dispatching thread.
+        :param timeout: Time, in seconds, after which a worker stops waiting
+                        for a callback and continues with the next alert. None
+                        to wait for each callback to finish.
+        :param clock: Clock instance to read the time. Defaults to the system
+                      clock.
+        :param isolation: 'thread' to execute the callbacks in this process, or
+                          'process' to execute each one in a child process
+                          terminated after the timeout.
+        :param alert_listener: Optional function called from this process as
+                               each alert is executed, with the alert AlarmItem,
+                               the ID of its alarm (or timer) and the alert
+                               index given to dispatch().
+        """
+        self.__max_workers = max(max_workers, 0)
+        self.__timeout = timeout
+        self.__clock = clock if clock is not None else SystemClock()
+        if isolation not in AlarmDispatcher.ISOLATION_MODES:
+            print('ERROR: AlarmDispatcher isolation mode "%s" not recognised, '
+                  'using "thread".' % isolation, file=sys.stderr)
+            isolation = 'thread'
+        self.__isolation = isolation
+        self.__alert_listener = alert_listener
+
+        # Alert statistics, with their own lock as they are updated from the
+        # alert threads
+        self.__stats_lock = threading.Lock()
+        self.__stats = {'executed': 0, 'completed': 0, 'failed': 0,
+                        'crashed': 0, 'timed_out': 0}
+
+        # Protects the queue and the dispatched alerts record
+        self.__lock = threading.Lock()
+        self.__condition = threading.Condition(self.__lock)
+        # FIFO queue of (AlarmItem, callback, alarm ID, alert index) tuples
+        self.__queue = collections.deque()
+        # Dictionary with the start of the minute of the last dispatch, for
+        # each alert alarm data and callback
+        self.__dispatched = {}
+        self.__latest_minute = 0
+        self.__workers = []
+        self.__idle_workers = 0
+        self.__run = True
+
+    #
+    # member methods
+    #
+    def dispatch(self, alarm_item, callback, alert_time=None, alarm_id=None,
+                 alert_index=0):
+        """
+        Queues an alert to be executed by the worker threads.
+        :param alarm_item: AlarmItem that is alerting.
+        :param callback: Callback function to execute for the alert, or None.
+        :param alert_time: Time, in seconds since 1970, of the alert. Defaults
+                           to the current time.
+        :param alarm_id: ID of the alarm, or timer, the alert belongs to, as
+                         the AlarmItems of the offset alerts have no ID.
+                         Defaults to the AlarmItem ID.
+        :param alert_index: 0 for the alarm alert, the offset alert index + 1
+                            for an offset alert, or None for a timer alert.
+        :return: Boolean indicating if the alert has been queued, False if the
+                 same alert has already been dispatched for its minute.
+        """
+        if alert_time is None:
+            alert_time = self.__clock.time()
+        if alarm_id is None:
+            alarm_id = alarm_item.id_
+        minute_start = \
+            int(alert_time) - self.__clock.localtime(alert_time).tm_sec
+        alert_key = (alarm_id, alert_index, alarm_item.hour, alarm_item.minute,
+                     alarm_item.repeat_mask, callback)
+        with self.__lock:
+            if self.__run is False:
+                return False
+            if self.__dispatched.get(alert_key) == minute_start:
+                return False
+            # Alerts from previous minutes cannot be repeated any longer
+            if minute_start > self.__latest_minute:
+                self.__latest_minute = minute_start
+                for key, minute in list(self.__dispatched.items()):
+                    if minute < minute_start:
+                        del self.__dispatched[key]
+            self.__dispatched[alert_key] = minute_start
+
+            if self.__max_workers > 0:
+                self.__queue.append(
+                    (alarm_item, callback, alarm_id, alert_index))
+                if self.__idle_workers < len(self.__queue) and \
+                        len(self.__workers) < self.__max_workers:
+                    worker = threading.Thread(
+                        name='AlarmDispatcher worker', target=self.__work)
+                    worker.daemon = True
+                    self.__workers.append(worker)
+                    worker.start()
+                self.__condition.notify()
+                return True
+
+        # Without worker threads the alert is executed straight away
+        self.__execute(alarm_item, callback, alarm_id, alert_index)
+        return True
+
+    def stop(self):
+        """
+        Causes the worker threads to exit once all the queued alerts have been
+        executed. Any alert dispatched afterwards is discarded.
+        """
+        with self.__lock:
+            self.__run = False
+            self.__condition.notify_all()
+
+    def pending_alerts(self):
+        """
+        :return: Number of alerts queued and not yet taken by a worker.
+        """
+        with self.__lock:
+            return len(self.__queue)
+
+    def get_workers(self):
+        """
+        :return: List of the worker threads currently running.
+        """
+        with self.__lock:
+            return list(self.__workers)
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the number of alert callbacks 'executed',
+                 'completed', 'failed', 'crashed' and 'timed_out'. In thread
+                 isolation a timed out callback is also counted as completed
+                 or failed once it eventually finishes.
+        """
+        with self.__stats_lock:
+            return dict(self.__stats)
+
+    def __record(self, outcome):
+        """
+        Increases the count of an alert statistic.
+        :param outcome: Key of the statistic to increase.
+        """
+        with self.__stats_lock:
+            self.__stats[outcome] += 1
+
+    #
+    # worker thread methods
+    #
+    def __work(self):
+        """
+        Worker thread loop. Executes the queued alerts in order, and waits for
+        new alerts when the queue is empty.
+        """
+        while True:
+            with self.__lock:
+                self.__idle_workers += 1
+                while not self.__queue and self.__run:
+                    self.__condition.wait()
+                self.__idle_workers -= 1
+                if not self.__queue:
+                    self.__workers.remove(threading.current_thread())
+                    return
+                alert = self.__queue.popleft()
+            self.__execute(*alert)
+
+    def __execute(self, alarm_item, callback, alarm_id, alert_index):
+        """
+        Executes an alert, on its own thread if there is a timeout, or on its
+        own process with the process isolation.
+        :param alarm_item: AlarmItem that is alerting.
+        :param callback: Callback function to execute for the alert, or None.
+        :param alarm_id: ID of the alarm, or timer, the alert belongs to.
+        :param alert_index: Index of the alert, as given to dispatch().
+        """
+        print('\nALERT for the Alarm %s, with label:"%s" !!!' %
+              (alarm_item.id_, alarm_item.label))
+        if self.__alert_listener is not None:
+            try:
+                self.__alert_listener(alarm_item, alarm_id, alert_index)
+            except Exception:
+                print('ERROR: The alert listener raised an exception for the '
+                      'Alarm %s:\n%s' %
+                      (alarm_id, traceback.format_exc()), file=sys.stderr)
+        if callback is None:
+            return
+        self.__record('executed')
+        if self.__isolation == 'process':
+            self.__execute_process(alarm_item, callback)
+            return
+        if self.__timeout is None:
+            self.__alert(alarm_item, callback)
+            return
+        alert_thread = threading.Thread(
+            name='AlarmDispatcher alert %s' % alarm_item.id_,
+            target=self.__alert, args=(alarm_item, callback))
+        alert_thread.daemon = True
+        alert_thread.start()
+        alert_thread.join(self.__timeout)
+        if alert_thread.is_alive():
+            self.__record('timed_out')
+            print('WARNING: The alert callback for the Alarm %s has not '
+                  'finished after %s seconds, continuing with the next alert.'
+                  % (alarm_item.id_, self.__timeout), file=sys.stderr)
+
+    def __execute_process(self, alarm_item, callback):
+        """
+        Executes an alert callback in a child process, and waits for it up to
+        the timeout before terminating it.
+        :param alarm_item: AlarmItem that is alerting.
+        :param callback: Callback function to execute for the alert.
+        """
+        try:
+            process = AlarmDispatcher.__process_context().Process(
+                name='AlarmDispatcher alert %s' % alarm_item.id_,
+                target=AlarmDispatcher._process_alert,
+                args=(alarm_item.id_, callback))
+            process.daemon = True
+            process.start()
+        except Exception:
+            self.__record('crashed')
+            print('ERROR: Could not start the alert process for the Alarm %s:'
+                  '\n%s' % (alarm_item.id_, traceback.format_exc()),
+                  file=sys.stderr)
+            return
+        process.join(self.__timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+            self.__record('timed_out')
+            print('WARNING: The alert process for the Alarm %s has not '
+                  'finished after %s seconds and has been terminated.'
+                  % (alarm_item.id_, self.__timeout), file=sys.stderr)
+        elif process.exitcode == 0:
+            self.__record('completed')
+        elif process.exitcode == 1:
+            # The exception has already been printed by the child process
+            self.__record('failed')
+        else:
+            self.__record('crashed')
+            print('ERROR: The alert process for the Alarm %s crashed with exit '
+                  'code %s.' % (alarm_item.id_, process.exitcode),
+                  file=sys.stderr)
+
+    @staticmethod
+    def __process_context():
+        """
+        :return: The multiprocessing context to create the alert processes.
+                 Forking is preferred, as it does not need the callback to be
+                 pickled, where it is available.
+        """
+        if hasattr(multiprocessing, 'get_context'):
+            try:
+                return multiprocessing.get_context('fork')
+            except ValueError:
+                return multiprocessing.get_context()
+        return multiprocessing
+
+    @staticmethod
+    def _process_alert(alarm_id, callback):
+        """
+        Executes an alert callback as the target of a child process, exiting
+        with code 1 if the callback raises an exception.
+        :param alarm_id: ID of the AlarmItem that is alerting.
+        :param callback: Callback function to execute for the alert.
+        """
+        try:
+            callback()
+        except Exception:
+            print('ERROR: The alert callback for the Alarm %s raised an '
+                  'exception:\n%s' % (alarm_id, traceback.format_exc()),
+                  file=sys.stderr)
+            sys.stderr.flush()
+            sys.exit(1)
+
+    def __alert(self, alarm_item, callback):
+        """
+        Executes the callback of an alarm alert, printing any exception raised
+        by the callback.
+        :param alarm_item: AlarmItem that is alerting.
+        :param callback: Callback function to execute for the alert.
+        """
+        try:
+            callback()
+        except Exception:
+            self.__record('failed')
+            print('ERROR: The alert callback for the Alarm %s raised an '
+                  'exception:\n%s' %
+                  (alarm_item.id_, traceback.format_exc()), file=sys.stderr)
+        else:
+            self.__record('completed')
@@ -7,11 +7,14 @@
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
 from __future__ import unicode_literals, absolute_import, print_function
-import collections
 try:
     from LightUpAlarm.Py23Compatibility import *
 except ImportError:
     from Py23Compatibility import *
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class AlarmItem(object):
@@ -33,8 +36,28 @@ class AlarmItem(object):
                    was modified. This is stored and read from the storage
                    database, so this class does not set the value without an
                    input (stays as None).
+    The repeat weekdays are stored as a 7-bit integer mask, accessible with the
+    repeat_mask property, with Monday as the least significant bit (1 << 0) and
+    Sunday as the most significant (1 << 6).
+    Instances use __slots__ instead of a per-instance __dict__ to reduce the
+    memory used by large lists of alarms, so new attributes cannot be added.
     """
 
+    __slots__ = ('__id', '__hour', '__minute', '__enabled', '__repeat_mask',
+                 '__label', '__timestamp')
+
+    # Name mangled attribute names of the slots, used to copy the instance data
+    __slot_attributes = tuple('_AlarmItem' + slot for slot in __slots__)
+
+    # Names of the weekdays, indexed in the same order as the repeat mask bits
+    day_names = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+                 'Saturday', 'Sunday')
+
+    # Repeat tuple for each possible repeat mask value, to avoid recreating it
+    __repeat_tuples = tuple(
+        tuple(bool(mask & (1 << day)) for day in range(7))
+        for mask in range(128))
+
     #
     # metaclass methods: constructor, initialiser and print
     #
@@ -66,15 +89,8 @@ class AlarmItem(object):
         instance.__hour = 0
         # Indicates if the alarm is enabled or not
         instance.__enabled = False
-        # Contains the days of the weeks that this alarm repeats
-        instance.__repeat = collections.OrderedDict()
-        instance.__repeat['Monday'] = False
-        instance.__repeat['Tuesday'] = False
-        instance.__repeat['Wednesday'] = False
-        instance.__repeat['Thursday'] = False
-        instance.__repeat['Friday'] = False
-        instance.__repeat['Saturday'] = False
-        instance.__repeat['Sunday'] = False
+        # Bit mask of the days of the week that this alarm repeats
+        instance.__repeat_mask = 0
         # Contains the label string
         instance.__label = ''
         # Contains the timestamp of the last time it was modified
@@ -132,14 +148,91 @@ class AlarmItem(object):
         enabled = 'Yes' if self.enabled is True else 'No'
         ret_str = 'Alarm ID: %3d | Time: %02d:%02d | Enabled: %3s | Repeat: ' %\
                   (self.id_, self.hour, self.minute, enabled)
-        for day in self.__repeat:
-            if self.__repeat[day] is True:
-                ret_str += "%s " % str(day)[:3]
+        for day, day_name in enumerate(AlarmItem.day_names):
+            if self.__repeat_mask & (1 << day):
+                ret_str += "%s " % day_name[:3]
             else:
                 ret_str += "--- "
 
         return ret_str
 
+    #
+    # trusted constructors for data already validated (e.g. from the database)
+    #
+    @classmethod
+    def from_row(cls, hour, minute, repeat_mask=0, enabled=True, label='',
+                 timestamp=None, alarm_id=None):
+        """
+        Creates an instance without running the accessors input sanitation.
+        Only meant for data that has already been validated, like the rows
+        stored in the alarms database, as invalid data will not be detected.
+        :param hour: Integer to indicate the alarm hour.
+        :param minute: Integer to indicate the alarm minute.
+        :param repeat_mask: Integer bit mask of the repeat weekdays.
+        :param enabled: Boolean to indicate alarm enabled state.
+        :param label: String to accompany the alarm.
+        :param timestamp: Time, in seconds since 1970, that this alarm was last
+                          modified.
+        :param alarm_id: Integer to indicate the Alarm ID
+        :return: Instance of the AlarmItem class.
+        """
+        instance = object.__new__(cls)
+        instance.__id = alarm_id
+        instance.__hour = hour
+        instance.__minute = minute
+        instance.__enabled = bool(enabled)
+        instance.__repeat_mask = repeat_mask or 0
+        instance.__label = label if label is not None else ''
+        instance.__timestamp = timestamp
+        return instance
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Creates a list of instances from an iterable of 'alarms' table rows,
+        in a single pass and without the accessors input sanitation.
+        :param rows: Iterable of dictionaries (or database result rows) with the
+                     id, hour, minute, repeat_mask, enabled, label and
+                     timestamp keys.
+        :return: List of AlarmItem instances, in the same order as the rows.
+        """
+        new_object = object.__new__
+        alarms = []
+        append = alarms.append
+        for row in rows:
+            instance = new_object(cls)
+            instance.__id = row['id']
+            instance.__hour = row['hour']
+            instance.__minute = row['minute']
+            instance.__enabled = bool(row['enabled'])
+            instance.__repeat_mask = row['repeat_mask'] or 0
+            label = row['label']
+            instance.__label = label if label is not None else ''
+            instance.__timestamp = row['timestamp']
+            append(instance)
+        return alarms
+
+    def frozen(self):
+        """
+        Creates a read only copy of this alarm.
+        :return: FrozenAlarmItem instance with the same data as this alarm.
+        """
+        frozen_alarm = object.__new__(FrozenAlarmItem)
+        for attribute in AlarmItem.__slot_attributes:
+            object.__setattr__(frozen_alarm, attribute,
+                               getattr(self, attribute))
+        return frozen_alarm
+
+    def thawed(self):
+        """
+        Creates a modifiable copy of this alarm.
+        :return: AlarmItem instance with the same data as this alarm.
+        """
+        alarm = object.__new__(AlarmItem)
+        for attribute in AlarmItem.__slot_attributes:
+            setattr(alarm, attribute, getattr(self, attribute))
+        return alarm
+
     #
     # id accesor
     #
@@ -264,124 +357,128 @@ class AlarmItem(object):
     timestamp = property(__get_timestamp, __set_timestamp)
 
     #
-    # repeat accesor
+    # repeat accesors
     #
     def __get_repeat(self):
         """
         Returns the days of the week alarm repetition in the form of a tuple.
         :return: Tuple with 7 booleans to indicate repetition for the weekdays.
         """
-        repeat_tuple = (self.__repeat['Monday'], self.__repeat['Tuesday'],
-                        self.__repeat['Wednesday'], self.__repeat['Thursday'],
-                        self.__repeat['Friday'], self.__repeat['Saturday'],
-                        self.__repeat['Sunday'])
-        return repeat_tuple
+        return AlarmItem.__repeat_tuples[self.__repeat_mask]
 
     def __set_repeat(self, new_repeat):
         """
         Checks that it is a list/tuple of 7 booleans and if so assigns them to
-        the _repeat dictionary.
+        the repeat mask.
         :param new_repeat: List of containing 7 booleans to indicate the days
                            of the week the alarm repeats.
         """
         if len(new_repeat) == 7:
-            for day in new_repeat:
-                if not isinstance(day, bool_type):
+            new_mask = 0
+            for day, day_repeat in enumerate(new_repeat):
+                if not isinstance(day_repeat, bool_type):
                     print('ERROR: All items in the AlarmItem().repeat list ' +
                           'have to be Booleans!', file=sys.stderr)
                     break
+                if day_repeat is True:
+                    new_mask |= 1 << day
             else:
-                day_int = 0
-                for day in self.__repeat:
-                    self.__repeat[day] = new_repeat[day_int]
-                    day_int += 1
+                self.__repeat_mask = new_mask
         else:
             print('ERROR: The AlarmItem().repeat must be a list of 7 booleans!',
                   file=sys.stderr)
 
     repeat = property(__get_repeat, __set_repeat)
 
+    def __get_repeat_mask(self):
+        return self.__repeat_mask
+
+    def __set_repeat_mask(self, new_repeat_mask):
+        """
+        Checks input is an integer between 0 and 127 (7 bits, one per weekday
+        with Monday as the least significant bit).
+        :param new_repeat_mask: New repeat weekdays bit mask.
+        """
+        if isinstance(new_repeat_mask, int_type) and \
+                not isinstance(new_repeat_mask, bool_type) and \
+                0 <= new_repeat_mask < 128:
+            self.__repeat_mask = new_repeat_mask
+        else:
+            print('ERROR: Provided AlarmItem().repeat_mask is not an Integer ' +
+                  'between 0 and 127: %s!' % new_repeat_mask, file=sys.stderr)
+
+    repeat_mask = property(__get_repeat_mask, __set_repeat_mask)
+
+    def __set_day(self, day, new_value, day_name):
+        """
+        Sets the repeat state for a single weekday after checking the input is
+        a boolean.
+        :param day: Weekday index, 0 for Monday to 6 for Sunday.
+        :param new_value: Boolean to indicate if the alarm repeats that day.
+        :param day_name: Name of the day accessor, for the error message.
+        """
+        if isinstance(new_value, bool_type):
+            if new_value is True:
+                self.__repeat_mask |= 1 << day
+            else:
+                self.__repeat_mask &= ~(1 << day)
+        else:
+            print('ERROR: New value for the AlarmItem().%s variable has ' %
+                  day_name + 'to be a Boolean !', file=sys.stderr)
+
     def __get_monday(self):
-        return self.__repeat['Monday']
+        return bool(self.__repeat_mask & 0x01)
 
     def __set_monday(self, new_monday):
-        if isinstance(new_monday, bool_type):
-            self.__repeat['Monday'] = new_monday
-        else:
-            print('ERROR: New value for the AlarmItem().monday variable has ' +
-                  'to be a Boolean !', file=sys.stderr)
+        self.__set_day(0, new_monday, 'monday')
 
     monday = property(__get_monday, __set_monday)
 
     def __get_tuesday(self):
-        return self.__repeat['Tuesday']
+        return bool(self.__repeat_mask & 0x02)
 
     def __set_tuesday(self, new_tuesday):
-        if isinstance(new_tuesday, bool_type):
-            self.__repeat['Tuesday'] = new_tuesday
-        else:
-            print('ERROR: New value for the AlarmItem().tuesday variable has ' +
-                  'to be a Boolean !', file=sys.stderr)
+        self.__set_day(1, new_tuesday, 'tuesday')
 
     tuesday = property(__get_tuesday, __set_tuesday)
 
     def __get_wednesday(self):
-        return self.__repeat['Wednesday']
+        return bool(self.__repeat_mask & 0x04)
 
     def __set_wednesday(self, new_wednesday):
-        if isinstance(new_wednesday, bool_type):
-            self.__repeat['Wednesday'] = new_wednesday
-        else:
-            print('ERROR: New value for the AlarmItem().wednesday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
+        self.__set_day(2, new_wednesday, 'wednesday')
 
     wednesday = property(__get_wednesday, __set_wednesday)
 
     def __get_thursday(self):
-        return self.__repeat['Thursday']
+        return bool(self.__repeat_mask & 0x08)
 
     def __set_thursday(self, new_thursday):
-        if isinstance(new_thursday, bool_type):
-            self.__repeat['Thursday'] = new_thursday
-        else:
-            print('ERROR: New value for the AlarmItem().thursday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
+        self.__set_day(3, new_thursday, 'thursday')
 
     thursday = property(__get_thursday, __set_thursday)
 
     def __get_friday(self):
-        return self.__repeat['Friday']
+        return bool(self.__repeat_mask & 0x10)
 
     def __set_friday(self, new_friday):
-        if isinstance(new_friday, bool_type):
-            self.__repeat['Friday'] = new_friday
-        else:
-            print('ERROR: New value for the AlarmItem().friday variable has ' +
-                  'to be a Boolean !', file=sys.stderr)
+        self.__set_day(4, new_friday, 'friday')
 
     friday = property(__get_friday, __set_friday)
 
     def __get_saturday(self):
-        return self.__repeat['Saturday']
+        return bool(self.__repeat_mask & 0x20)
 
     def __set_saturday(self, new_saturday):
-        if isinstance(new_saturday, bool_type):
-            self.__repeat['Saturday'] = new_saturday
-        else:
-            print('ERROR: New value for the AlarmItem().saturday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
+        self.__set_day(5, new_saturday, 'saturday')
 
     saturday = property(__get_saturday, __set_saturday)
 
     def __get_sunday(self):
-        return self.__repeat['Sunday']
+        return bool(self.__repeat_mask & 0x40)
 
     def __set_sunday(self, new_sunday):
-        if isinstance(new_sunday, bool_type):
-            self.__repeat['Sunday'] = new_sunday
-        else:
-            print('ERROR: New value for the AlarmItem().sunday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
+        self.__set_day(6, new_sunday, 'sunday')
 
     sunday = property(__get_sunday, __set_sunday)
 
@@ -393,11 +490,7 @@ class AlarmItem(object):
         Checks if there are any repeat days enabled.
         :return: A boolean value indicating if an repeat weekday is activated.
         """
-        any_enabled = False
-        for day in self.__repeat:
-            if self.__repeat[day] is True:
-                any_enabled = True
-        return any_enabled
+        return self.__repeat_mask != 0
 
     def is_active(self):
         """
@@ -405,10 +498,7 @@ class AlarmItem(object):
         weekday set to repeat.
         :return: Boolean indicating the 'active' state.
         """
-        if self.enabled is True and self.any_day_enabled() is True:
-            return True
-        else:
-            return False
+        return self.__enabled is True and self.__repeat_mask != 0
 
     #
     # member methods to calculate time
@@ -418,49 +508,69 @@ class AlarmItem(object):
         Calculates the time in minutes that will elapse from the initial
         reference input time and weekday and the first time this alarm will have
         to trigger an alert (independently of this alarm being active or not).
+        The repeat mask is rotated so that its first bit is the reference
+        weekday, and the next alert day is found from its lowest set bit.
         :param hour: start hour, value 0-23.
         :param minute: start minute, value 0-59.
         :param weekday: start weekday, value 0-6.
         :return: Integer indicating the amount in minutes until the alarm
-                 triggers from the initial reference time and weekday.
-        """
-        alarm_day_minute = self.minute + (self.hour * 60)
-        ref_day_minute = minute + (hour * 60)
-        one_day_minutes = 1440
-
-        # First corner case, check the same day after input time
-        if (self.repeat[weekday] is True) and \
-                (alarm_day_minute >= ref_day_minute):
-            return alarm_day_minute - ref_day_minute
-
-        # Check the rest of the week until, but not including, the same day
-        day = weekday + 1
-        if day > 6:
-            day = 0
-        day_count = 1
-        while day != weekday:
-            if self.repeat[day] is True:
-                # Add the days in minutes and relative time to reference
-                minutes_difference = day_count * one_day_minutes
-                if alarm_day_minute >= ref_day_minute:
-                    minutes_difference += alarm_day_minute - ref_day_minute
-                else:
-                    minutes_difference -= ref_day_minute - alarm_day_minute
-                # Returns on first encountered alarm
-                return minutes_difference
-            else:
-                day += 1
-                day_count += 1
-                if day > 6:
-                    day = 0
-
-        # Second corner case, check the same day before input time
-        if (self.repeat[weekday] is True) and \
-                (ref_day_minute > alarm_day_minute):
-            return (one_day_minutes * 7) - ref_day_minute + alarm_day_minute
-
-        # Alarm has no enabled days
-        return None
+                 triggers from the initial reference time and weekday. None if
+                 the alarm has no repeat days.
+        """
+        mask = self.__repeat_mask
+        if mask == 0:
+            return None
+        difference = self.__minute + (self.__hour * 60) - minute - (hour * 60)
+
+        # Bit n of the rotated mask is the weekday n days after the reference,
+        # duplicated to bits 7-13 for the same days on the following week
+        rotated = ((mask >> weekday) | (mask << (7 - weekday))) & 0x7F
+        rotated |= rotated << 7
+        # The reference day only counts if the alarm time has not passed yet
+        skip_days = 1 if difference < 0 else 0
+        rotated >>= skip_days
+        days = skip_days + (rotated & -rotated).bit_length() - 1
+        return (days * 1440) + difference
+
+    @staticmethod
+    def minutes_to_alert_batch(alarms, hour, minute, weekday):
+        """
+        Calculates minutes_to_alert() for a list of alarms in a single call.
+        If numpy is installed the calculation is vectorised, otherwise each
+        alarm is calculated individually.
+        :param alarms: List of AlarmItems.
+        :param hour: start hour, value 0-23.
+        :param minute: start minute, value 0-59.
+        :param weekday: start weekday, value 0-6.
+        :return: List of Integers with the minutes until each alarm triggers,
+                 in the same order as the input list. Items are None for the
+                 alarms without repeat days.
+        """
+        if numpy is None:
+            return [alarm.minutes_to_alert(hour, minute, weekday)
+                    for alarm in alarms]
+        if len(alarms) == 0:
+            return []
+
+        count = len(alarms)
+        masks = numpy.fromiter(
+            (alarm.__repeat_mask for alarm in alarms), numpy.int64, count)
+        difference = numpy.fromiter(
+            (alarm.__minute + (alarm.__hour * 60) for alarm in alarms),
+            numpy.int64, count) - (minute + (hour * 60))
+
+        rotated = ((masks >> weekday) | (masks << (7 - weekday))) & 0x7F
+        rotated |= rotated << 7
+        skip_days = (difference < 0).astype(numpy.int64)
+        rotated >>= skip_days
+        # The lowest set bit is a power of two, so its log2 is exact
+        lowest_bit = numpy.maximum(rotated & -rotated, 1)
+        days = skip_days + numpy.log2(lowest_bit).astype(numpy.int64)
+
+        minutes = ((days * 1440) + difference).tolist()
+        for index in numpy.flatnonzero(masks == 0):
+            minutes[index] = None
+        return minutes
 
     def diff_alarm(self, min_difference):
         """
@@ -468,59 +578,91 @@ class AlarmItem(object):
         a time difference indicated by the parameter.
         It edits the label to indicate the time difference.
         It does not copy the ID nor the timestamp.
-        We are reducing the use case to have a range of -59 to 59 minutes to
-        simplify the code.
-        :para min_difference: Time difference, positive or negative in minutes
-                              from -59 to 59, for the new Alarm.
+        The difference can be of any size, if it moves the alarm time into a
+        different day the repeat weekdays are rotated accordingly.
+        :para min_difference: Time difference, positive or negative in minutes,
+                              for the new Alarm.
         :return: Alarm instance with this data + time difference. Returns None
                  if there was an issue with the input data
         """
-        # Input sanitation to given user case
+        # Input sanitation
         if not isinstance(min_difference, int_type):
             print('ERROR: Provided diff_alarm min_difference type is not an '
                   'Integer: %s!' % min_difference, file=sys.stderr)
             return None
-        else:
-            if not (-60 < min_difference < 60):
-                print('ERROR: Provided diff_alarm min_difference is not between'
-                      ' -59 and 59: %s!' % min_difference, file=sys.stderr)
-                return None
-
-        extra_hours = 0
-        extra_days = 0
-
-        new_minute = self.minute + min_difference
-        while new_minute >= 60:
-            new_minute %= 60
-            extra_hours += 1
-        while new_minute < 0:
-            new_minute += 60
-            extra_hours -= 1
-
-        new_hour = self.hour + extra_hours
-        while new_hour >= 24:
-            new_hour %= 24
-            extra_days += 1
-        while new_hour < 0:
-            new_hour += 24
-            extra_days -= 1
-
-        new_days = list(self.repeat)
-        if extra_days < 0:
-            # Move all items up by 1 per day
-            while extra_days < 0:
-                new_days.append(new_days.pop(0))
-                extra_days += 1
-        elif extra_days > 0:
-            # Move all items down by 1 per day, input sanitation protects
-            # against this breaking if extra_days > 6
-            list_to_head = new_days[(len(new_days) - extra_days):]
-            new_days = list_to_head + \
-                new_days[0:(len(new_days) - extra_days)]
-
-        new_label = self.label + \
-            (" (Alarm %s %+dmin)" % (self.id_, min_difference))
-
-        alarm_diff = AlarmItem(new_hour, new_minute, days=new_days,
-                               enabled=self.enabled, label=new_label)
-        return alarm_diff
+
+        # Floor division, so negative differences roll back to previous days
+        extra_days, new_day_minute = divmod(
+            self.__minute + (self.__hour * 60) + min_difference, 1440)
+        new_hour, new_minute = divmod(new_day_minute, 60)
+
+        # Rotate the 7 bits of the repeat mask by the number of extra days
+        extra_days %= 7
+        new_repeat_mask = ((self.__repeat_mask << extra_days) |
+                           (self.__repeat_mask >> (7 - extra_days))) & 0x7F
+
+        new_label = self.__label + \
+            (" (Alarm %s %+dmin)" % (self.__id, min_difference))
+
+        return AlarmItem.from_row(new_hour, new_minute,
+                                  repeat_mask=new_repeat_mask,
+                                  enabled=self.__enabled, label=new_label)
+
+
+class FrozenAlarmItem(AlarmItem):
+    """
+    Read only variant of the AlarmItem class. It has the same data items and
+    constructor input validation, but any attempt to modify the data after the
+    instance has been created prints an error and leaves the data unchanged.
+    Useful to share the same alarm instance between threads.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, hour, minute,
+                days=(False, False, False, False, False, False, False),
+                enabled=True, label='', timestamp=None, alarm_id=None):
+        """
+        Validates the inputs with the AlarmItem constructor.
+        :return: instance of the FrozenAlarmItem class. Returns None if input
+                 data is invalid.
+        """
+        alarm = AlarmItem(hour, minute, days=days, enabled=enabled,
+                          label=label, timestamp=timestamp, alarm_id=alarm_id)
+        if alarm is None:
+            return None
+        return alarm.frozen()
+
+    def __setattr__(self, name, value):
+        print('ERROR: FrozenAlarmItem instances are read only, cannot set ' +
+              '%s!' % name, file=sys.stderr)
+
+    def __delattr__(self, name):
+        print('ERROR: FrozenAlarmItem instances are read only, cannot ' +
+              'delete %s!' % name, file=sys.stderr)
+
+    @classmethod
+    def from_row(cls, *args, **kwargs):
+        """
+        Creates a read only instance with the AlarmItem.from_row() trusted
+        constructor, without the accessors input sanitation.
+        :return: Instance of the FrozenAlarmItem class.
+        """
+        return AlarmItem.from_row(*args, **kwargs).frozen()
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Creates a list of read only instances with the AlarmItem.from_rows()
+        trusted constructor, without the accessors input sanitation.
+        :return: List of FrozenAlarmItem instances, in the same order as the
+                 rows.
+        """
+        return [alarm.frozen() for alarm in AlarmItem.from_rows(rows)]
+
+    def frozen(self):
+        """
+        The instance is already read only, so it is not copied.
+        :return: This FrozenAlarmItem instance.
+        """
+        return self
@@ -7,23 +7,27 @@
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
 # Alarm management system. It saves alarms into a database using the AlarmDb
-# class and launches a running thread per active alarm using the AlarmThread
-# class.
+# class and registers the active alarms into a single AlarmScheduler thread,
+# which triggers the alarm alerts into an AlarmDispatcher to execute them.
 # It also provides access to the Alarm settings (snooze time, and alarm
-# offset alert time).
+# offset alert time), and snoozes the alarms with one-shot scheduler timers.
 #
 from __future__ import unicode_literals, absolute_import, print_function
 import sys
-import time
+import traceback
 try:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
-    from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+    from LightUpAlarm.Clock import SystemClock
     from LightUpAlarm.Py23Compatibility import *
 except ImportError:
     from AlarmDb import AlarmDb
     from AlarmItem import AlarmItem
-    from AlarmThread import AlarmThread
+    from AlarmScheduler import AlarmScheduler
+    from AlarmDispatcher import AlarmDispatcher
+    from Clock import SystemClock
     from Py23Compatibility import *
 
 
@@ -35,7 +39,9 @@ class AlarmManager(object):
     #
     # Instance initialiser
     #
-    def __init__(self, alert_callback=None, offset_alert_callback=None):
+    def __init__(self, alert_callback=None, offset_alert_callback=None,
+                 clock=None, offset_alerts=None, alert_isolation='thread',
+                 alert_timeout=60, alarm_db=None):
         """
         On initialization we connect to the database and check if there are
         any alarms to load. If not, load a couple of dummy alarms.
@@ -45,122 +51,263 @@ class AlarmManager(object):
         :param offset_alert_callback: Optional argument to register a callback
                                       function to be executed on an offset time
                                       of the alarm.
+        :param clock: Optional Clock instance used by the alarm scheduler and
+                      the alarm timestamps. Defaults to the system clock.
+        :param offset_alerts: Optional list of (offset time in minutes,
+                              callback) tuples, the default offset alerts for
+                              all the alarms. If not provided each alarm has a
+                              single offset alert, at the offset alert time
+                              from the settings and the offset_alert_callback.
+        :param alert_isolation: 'thread' to execute the alert callbacks in this
+                                process, or 'process' to execute each one in
+                                a supervised child process.
+        :param alert_timeout: Time, in seconds, an alert callback can run for
+                              before the next alert is executed. With the
+                              process isolation it is a hard deadline after
+                              which the callback process is terminated.
+        :param alarm_db: Optional AlarmDb instance to store the alarms and
+                         settings, used for all the database access of this
+                         AlarmManager. Defaults to the default database.
         """
         # Save the alarm callback functions as a private member variable
         self.__alert_callback = alert_callback
         self.__offset_alert_callback = offset_alert_callback
-
-        # Create a private member list for the alarm threads
-        self.__alarm_threads = []
+        self.__offset_alerts = \
+            tuple(offset_alerts) if offset_alerts is not None else None
+        # Dictionary of offset alerts lists that override the default for an
+        # alarm, with the alarm ID as the key
+        self.__alarm_offset_alerts = {}
+        self.__clock = clock if clock is not None else SystemClock()
+        self.__alarm_db = alarm_db if alarm_db is not None else \
+            AlarmDb(clock=self.__clock)
+        # Functions called with the alarm changes and alert events
+        self.__event_listeners = []
+
+        # Launch the scheduler thread that will trigger the alarm alerts, which
+        # are then executed by the dispatcher worker threads
+        self.__dispatcher = AlarmDispatcher(
+            timeout=alert_timeout, clock=self.__clock,
+            isolation=alert_isolation, alert_listener=self.__alert_event)
+        self.__scheduler = AlarmScheduler(
+            dispatcher=self.__dispatcher, clock=self.__clock)
+        self.__scheduler.start()
 
         # Set dummy alarms if database empty
-        if AlarmDb().get_number_of_alarms() == 0:
+        if self.__alarm_db.get_number_of_alarms() == 0:
             self.load_dummy_alarms()
 
         # Register and launch any active (enabled with repeat days) alarms
         # from the database
-        alarms = AlarmManager.get_all_active_alarms()
+        alarms = self.get_all_active_alarms()
         for alarm in alarms:
             self.__set_alarm_thread(alarm)
 
+        # Restore the snoozed alarms from the database
+        self.__load_snoozes()
+
     #
     # Methods to get an edit settings
     #
-    @staticmethod
-    def get_snooze_time():
+    def get_snooze_time(self):
         """
-        Static method, gets the current set snooze time interval.
+        Gets the current set snooze time interval.
         :return: Integer with the snooze time interval in minutes.
         """
-        return AlarmDb().get_snooze_time()
+        return self.__alarm_db.get_snooze_time()
 
-    @staticmethod
-    def set_snooze_time(snooze_time):
+    def set_snooze_time(self, snooze_time):
         """
-        Static method, sets the current snooze time interval.
+        Sets the current snooze time interval.
         :param snooze_time: Integer, new snooze time in minutes.
         :return: Boolean indicating the operation success.
         """
-        return AlarmDb().set_snooze_time(snooze_time)
+        return self.__alarm_db.set_snooze_time(snooze_time)
 
-    @staticmethod
-    def get_offset_alert_time():
+    def get_offset_alert_time(self):
         """
-        Static method, gets the offset alert time (the time difference before or
+        Gets the offset alert time (the time difference before or
         after the alarm alert is triggered), used to set some action.
         :return: Integer, the offset alert time in minutes.
         """
-        return AlarmDb().get_offset_alert_time()
+        return self.__alarm_db.get_offset_alert_time()
 
-    @staticmethod
-    def set__offset_alert_time(offset_alert_time):
+    def set__offset_alert_time(self, offset_alert_time):
         """
-        Static method, sets the offset alert time (the time before or after the
+        Sets the offset alert time (the time before or after the
         alarm alert is triggered), used to set some additional action to the
         alarm alert.
         :param offset_alert_time: Integer, offset alert time in minutes.
         :return: Boolean indicating the operation success.
         """
-        return AlarmDb().set_offset_alert_time(offset_alert_time)
+        return self.__alarm_db.set_offset_alert_time(offset_alert_time)
+
+    def get_alarm_offset_alerts(self, alarm_id):
+        """
+        Gets the offset alerts used for an alarm.
+        :param alarm_id: Integer to indicate the ID of the alarm.
+        :return: Tuple of (offset time in minutes, callback) tuples.
+        """
+        offset_alerts = self.__alarm_offset_alerts.get(alarm_id)
+        if offset_alerts is None:
+            offset_alerts = self.__get_default_offset_alerts()
+        return offset_alerts
+
+    def set_alarm_offset_alerts(self, alarm_id, offset_alerts):
+        """
+        Sets the offset alerts of an alarm, overriding the default ones, and
+        reschedules the alarm if it is running. The override is not saved into
+        the database, as it contains callback functions.
+        :param alarm_id: Integer to indicate the ID of the alarm.
+        :param offset_alerts: List of (offset time in minutes, callback)
+                              tuples, or None to go back to the default offset
+                              alerts.
+        :return: Boolean indicating if the alarm is running in the scheduler.
+        """
+        if offset_alerts is None:
+            self.__alarm_offset_alerts.pop(alarm_id, None)
+        else:
+            self.__alarm_offset_alerts[alarm_id] = tuple(offset_alerts)
+        alarm = self.__scheduler.get_alarm(alarm_id)
+        if alarm is None:
+            return False
+        return self.__set_alarm_thread(alarm)
+
+    def __get_default_offset_alerts(self):
+        """
+        :return: Tuple of (offset time in minutes, callback) tuples with the
+                 offset alerts for the alarms without an override.
+        """
+        if self.__offset_alerts is not None:
+            return self.__offset_alerts
+        return ((self.get_offset_alert_time(), self.__offset_alert_callback),)
+
+    #
+    # member methods to snooze and dismiss alarms
+    #
+    def snooze(self, alarm_id):
+        """
+        Snoozes an alarm, so that it alerts again once the snooze time has
+        elapsed, replacing any previous snooze of the alarm. The snooze is a
+        one-shot timer in the alarm scheduler thread, and it is saved into the
+        database to be restored if the AlarmManager is restarted.
+        :param alarm_id: Integer to indicate the ID of the alarm to snooze.
+        :return: Time, in seconds since 1970, of the snoozed alert, or None if
+                 the alarm could not be found.
+        """
+        alarm = self.__scheduler.get_alarm(alarm_id)
+        if alarm is None:
+            alarm = self.get_alarm(alarm_id)
+            if alarm is None:
+                print('ERROR: Could not snooze the Alarm %s, it does not '
+                      'exist.' % alarm_id, file=sys.stderr)
+                return None
+        # Truncated, as rounding up could delay a short snooze
+        alert_time = int(
+            self.__clock.time() + self.get_snooze_time() * 60)
+        self.__alarm_db.set_snooze(alarm_id, alert_time)
+        self.__set_snooze_timer(alarm, alert_time)
+        self.__notify('snooze', id=alarm_id, alert_time=alert_time)
+        return alert_time
+
+    def dismiss(self, alarm_id):
+        """
+        Dismisses an alarm, cancelling its snooze if it has been snoozed.
+        :param alarm_id: Integer to indicate the ID of the alarm to dismiss.
+        :return: Boolean indicating if a snooze has been cancelled.
+        """
+        cancelled = self.__scheduler.cancel_timer(alarm_id)
+        self.__alarm_db.delete_snooze(alarm_id)
+        if cancelled is True:
+            self.__notify('dismiss', id=alarm_id)
+        return cancelled
+
+    def get_snooze(self, alarm_id):
+        """
+        Gets the snoozed alert time of an alarm.
+        :param alarm_id: Integer to indicate the ID of the alarm.
+        :return: Time, in seconds since 1970, of the snoozed alert, or None if
+                 the alarm is not snoozed.
+        """
+        return self.__scheduler.get_timer(alarm_id)
+
+    def __set_snooze_timer(self, alarm, alert_time):
+        """
+        Sets the snooze timer of an alarm into the alarm scheduler. The timer
+        only executes the alert callback, which can run in a child process, as
+        the snooze is removed from the database by the alert listener.
+        :param alarm: AlarmItem of the snoozed alarm.
+        :param alert_time: Time, in seconds since 1970, of the snoozed alert.
+        """
+        self.__scheduler.set_timer(
+            alarm.id_, alert_time, alarm, self.__alert_callback)
+
+    def __load_snoozes(self):
+        """
+        Sets the snooze timers saved in the database. The snoozes for deleted
+        alarms, or that are too late to alert, are removed.
+        """
+        snoozes = self.__alarm_db.get_snoozes()
+        if not snoozes:
+            return
+        alarms = dict((alarm.id_, alarm) for alarm in
+                      self.__alarm_db.get_alarms(snoozes.keys()))
+        # Alerts later than the scheduler grace period are not triggered
+        grace_period = self.__scheduler.get_grace_period()
+        if grace_period is None:
+            min_alert_time = None
+        else:
+            min_alert_time = self.__clock.time() - grace_period
+        for alarm_id, alert_time in snoozes.items():
+            if alarm_id in alarms and \
+                    (min_alert_time is None or alert_time >= min_alert_time):
+                self.__set_snooze_timer(alarms[alarm_id], alert_time)
+            else:
+                self.__alarm_db.delete_snooze(alarm_id)
 
     #
-    # static methods to retrieve alarms
+    # methods to retrieve alarms
     #
-    @staticmethod
-    def get_all_alarms():
+    def get_all_alarms(self):
         """
-        Static method, gets all the alarms from the database.
+        Gets all the alarms from the database.
         :return: List of AlarmItems containing all alarms. Returns an empty list
                  if there aren't any.
         """
-        return AlarmDb().get_all_alarms()
+        return self.__alarm_db.get_all_alarms()
 
-    @staticmethod
-    def get_number_of_alarms():
+    def get_number_of_alarms(self):
         """
         Gets the number of alarms stored in the database.
         :return: Integer indicating the number of alarms in the db.
         """
-        return AlarmDb().get_number_of_alarms()
+        return self.__alarm_db.get_number_of_alarms()
 
-    @staticmethod
-    def get_all_enabled_alarms():
+    def get_all_enabled_alarms(self):
         """
         Gets all the enabled alarms from the database.
         :return: List of AlarmItems containing all enabled alarms. Returns an
                  empty list if there aren't any.
         """
-        return AlarmDb().get_all_enabled_alarms()
+        return self.__alarm_db.get_all_enabled_alarms()
 
-    @staticmethod
-    def get_all_disabled_alarms():
+    def get_all_disabled_alarms(self):
         """
         Gets all the disabled alarms from the database.
         :return: List of AlarmItems containing all enabled alarms. Returns an
                  empty list if there aren't any.
         """
-        return AlarmDb().get_all_disabled_alarms()
+        return self.__alarm_db.get_all_disabled_alarms()
 
-    @staticmethod
-    def get_all_active_alarms():
+    def get_all_active_alarms(self):
         """
         Gets all the active alarms (enabled with at least one repeating day)
         from the database.
         :return: List of AlarmItems containing all enabled alarms. Returns an
                  empty list if there aren't any.
         """
-        active_alarms = AlarmManager.get_all_enabled_alarms()
-        # Need to iterate backwards in order to remove items safely
-        if active_alarms:
-            for i in xrange(len(active_alarms) - 1, -1, -1):
-                if active_alarms[i].any_day_enabled() is False:
-                    del active_alarms[i]
-            return active_alarms
-        else:
-            return []
+        return self.__alarm_db.get_all_active_alarms()
 
-    @staticmethod
-    def get_alarm(alarm_id):
+    def get_alarm(self, alarm_id):
         """
         Get the alarm with the given ID from the database.
         :param alarm_id: Integer to indicate the primary key of the Alarm to
@@ -168,30 +315,130 @@ class AlarmManager(object):
         :return: AlarmItem with the alarm data, or None if id could not be
                  found.
         """
-        return AlarmDb().get_alarm(alarm_id)
+        return self.__alarm_db.get_alarm(alarm_id)
 
-    @staticmethod
-    def get_next_alarm():
+    def get_alarms(self, alarm_ids):
+        """
+        Get the alarms with the given IDs from the database in a single query.
+        :param alarm_ids: Iterable of integers to indicate the primary keys of
+                          the Alarms to get.
+        :return: List of AlarmItems with the alarms data, ordered by ID. IDs
+                 not found are not included.
         """
-        Gets the current time and all the active alarms. For each of these
-        alarms it calculates the elapsed time that will pass for its next alert.
-        Then it sorts the list based on this value and returns closes.
-        :return: AlarmItem of the next alarm to alert.
+        return self.__alarm_db.get_alarms(alarm_ids)
+
+    def get_revision(self):
         """
-        # now_time[3] = tm_hour, now_time[4] = tm_minute, now_time[6] = tm_wday
-        now_time = time.localtime(time.time())
+        Gets the revision of the alarms data, which increases every time the
+        alarms are added, edited or deleted. It is kept by the AlarmDb in
+        memory, so it can be checked without reading the database.
+        The revision is increased after the database is changed, so it should
+        be read before reading the alarms data it is used to tag.
+        :return: Integer with the alarms data revision.
+        """
+        return self.__alarm_db.get_revision()
+
+    #
+    # Methods for the alarm events
+    #
+    def add_event_listener(self, listener):
+        """
+        Registers a function to be called with every alarm event, with the
+        event type string and a dictionary with the event data, which always
+        includes the alarms data 'revision'. The events are:
+          'add', 'edit': An alarm has been added or edited, AlarmItem 'alarm'.
+          'delete': An alarm has been deleted, alarm 'id'.
+          'delete_all': All the alarms have been deleted.
+          'alert', 'offset_alert': An alarm, or one of its offset alerts, is
+                                   alerting, AlarmItem 'alarm' with the alert
+                                   time and the alarm 'id'.
+          'snooze': An alarm has been snoozed, alarm 'id' and 'alert_time'.
+          'dismiss': The snooze of an alarm has been cancelled, alarm 'id'.
+        The listeners are called from the thread causing the event, so they
+        should return quickly.
+        :param listener: Function to call with the alarm events.
+        """
+        self.__event_listeners.append(listener)
+
+    def remove_event_listener(self, listener):
+        """
+        Removes a function registered with add_event_listener().
+        :param listener: Function to remove.
+        :return: Boolean indicating if the listener was registered.
+        """
+        try:
+            self.__event_listeners.remove(listener)
+            return True
+        except ValueError:
+            return False
+
+    def __notify(self, event_type, **data):
+        """
+        Calls the event listeners with an alarm event, printing any exception
+        they raise.
+        :param event_type: String with the event type.
+        :param data: Keyword arguments with the event data.
+        """
+        data['revision'] = self.__alarm_db.get_revision()
+        for listener in list(self.__event_listeners):
+            try:
+                listener(event_type, data)
+            except Exception:
+                print('ERROR: An alarm event listener raised an exception for '
+                      'the "%s" event:\n%s' %
+                      (event_type, traceback.format_exc()), file=sys.stderr)
+
+    def __alert_event(self, alarm_item, alarm_id, alert_index):
+        """
+        Sends the alert events, as a listener of the AlarmDispatcher alerts,
+        and removes the snoozes that have alerted. The listener is called from
+        this process before the alert callback is executed, so the database is
+        not accessed from the alert child processes.
+        :param alarm_item: AlarmItem of the alert.
+        :param alarm_id: ID of the alarm the alert belongs to, as the offset
+                         alerts AlarmItems have no ID.
+        :param alert_index: 0 for the alarm alert, higher for an offset alert,
+                            or None for a snooze alert.
+        """
+        # The snooze is removed unless the alarm has been snoozed again
+        if alert_index is None and self.__scheduler.get_timer(alarm_id) is None:
+            self.__alarm_db.delete_snooze(alarm_id)
+        if alert_index:
+            self.__notify('offset_alert', alarm=alarm_item, id=alarm_id)
+        else:
+            self.__notify('alert', alarm=alarm_item, id=alarm_id)
 
-        all_alarms = AlarmManager.get_all_active_alarms()
-        if len(all_alarms) > 0:
-            for alarm in all_alarms:
-                alarm.next_alert = alarm.minutes_to_alert(
-                    now_time[3], now_time[4], now_time[6])
-            sorted_alarms = sorted(
-                all_alarms, key=lambda a: a.next_alert)
-            return sorted_alarms[0]
+    def get_next_alarm(self):
+        """
+        Gets the next alarm to alert from the alarm scheduler queue, which is
+        kept up to date as the alarms are added, edited, removed and alerted,
+        so the database does not need to be read.
+        :return: AlarmItem of the next alarm to alert, or None if there are no
+                 active alarms.
+        """
+        upcoming = self.get_upcoming_alarms(number=1, window=None)
+        if upcoming:
+            return upcoming[0][1]
         else:
             return None
 
+    def get_upcoming_alarms(self, number=None, window=24*60*60):
+        """
+        Gets the next alarm alerts, in chronological order, from the alarm
+        scheduler queue.
+        :param number: Maximum number of alerts to get. None for no limit.
+        :param window: Time, in seconds from now, in which to look for alerts.
+                       None for no limit. Defaults to 24 hours.
+        :return: List of (alert time, AlarmItem) tuples, with the alert time in
+                 seconds since 1970. The AlarmItems are copies, so they can be
+                 modified without affecting the running alarms.
+        """
+        if self.__scheduler.is_alive() is False:
+            self.__restart_scheduler()
+        until = self.__clock.time() + window if window is not None else None
+        return [(alert_time, alarm.thawed()) for alert_time, alarm in
+                self.__scheduler.get_upcoming_alarms(number, until)]
+
     #
     # member methods to add alarms
     #
@@ -216,12 +463,32 @@ class AlarmManager(object):
             hour, minute, days=days, enabled=enabled, label=label,
             timestamp=timestamp)
         if alarm is not None:
-            alarm.id_ = AlarmDb().add_alarm(alarm)
+            alarm.id_ = self.__alarm_db.add_alarm(alarm)
             if alarm.id_ is not None:
+                self.__notify('add', alarm=alarm)
                 self.__set_alarm_thread(alarm)
                 return alarm.id_
         return None
 
+    def add_alarms(self, alarms):
+        """
+        Adds several alarms to the database in a single transaction. Once they
+        are all saved the alarm threads are reconciled a single time.
+        :param alarms: Iterable of AlarmItems to add. Their IDs are set to the
+                       new database IDs.
+        :return: List of integers with the newly created alarm IDs, in the same
+                 order as the input, or None if fail.
+        """
+        alarms = list(alarms)
+        alarm_ids = self.__alarm_db.add_alarms(alarms)
+        if alarm_ids is None:
+            return None
+        for alarm, alarm_id in zip(alarms, alarm_ids):
+            alarm.id_ = alarm_id
+            self.__notify('add', alarm=alarm)
+        self.check_threads_state()
+        return alarm_ids
+
     def load_dummy_alarms(self):
         """
         It loads 2 inactive dummy alarms into the database for demonstration
@@ -250,21 +517,20 @@ class AlarmManager(object):
         :param label: Strong to contain the alarm label.
         :return: Boolean indicating the success of the 'edit' operation.
         """
-        db = AlarmDb()
         # As the default values for AlarmDb.edit_alarm are all None as well we
-        # can send all through as is.
-        success = db.edit_alarm(
+        # can send all through as is. It returns the edited alarm on success.
+        alarm = self.__alarm_db.edit_alarm(
             alarm_id,  hour=hour, minute=minute, days=days, enabled=enabled,
             label=label)
 
         # If a successful edit was carried, then make sure the alarm is launched
-        if success is True:
-            self.__set_alarm_thread(AlarmManager.get_alarm(alarm_id))
-
-        return success
+        if alarm is None:
+            return False
+        self.__notify('edit', alarm=alarm)
+        self.__set_alarm_thread(alarm)
+        return True
 
-    @staticmethod
-    def update_alarm(alarm):
+    def update_alarm(self, alarm):
         """
         Updates the alarm in the database with an AlarmItem input data.
         This method also updates the timestamp stored into the instance passed
@@ -273,11 +539,31 @@ class AlarmManager(object):
         :return: Boolean indicating the success of the 'update' operation.
         """
         if isinstance(alarm, AlarmItem):
-            success = AlarmDb().update_alarm(alarm)
+            success = self.__alarm_db.update_alarm(alarm)
+            if success is True:
+                self.__notify('edit', alarm=alarm)
         else:
             success = False
         return success
 
+    def update_alarms(self, alarms):
+        """
+        Updates several alarms in the database, from AlarmItems data, in a
+        single transaction, and then reconciles the alarm threads a single time.
+        This method also updates the timestamp stored into the instances passed
+        as an argument.
+        :param alarms: Iterable of AlarmItem instances with data to update the
+                       database.
+        :return: Boolean indicating the success of the 'update' operation.
+        """
+        alarms = list(alarms)
+        success = self.__alarm_db.update_alarms(alarms)
+        if success is True:
+            for alarm in alarms:
+                self.__notify('edit', alarm=alarm)
+            self.check_threads_state()
+        return success
+
     def delete_alarm(self, alarm_id):
         """
         Remove the alarm with the given ID from the database and remove its
@@ -288,8 +574,33 @@ class AlarmManager(object):
         """
         # First we need to ensure it there is no alarm thread running for it
         self.__stop_alarm_thread(alarm_id)
+        self.__alarm_offset_alerts.pop(alarm_id, None)
+        self.dismiss(alarm_id)
         # Remove it from the database
-        return AlarmDb().delete_alarm(alarm_id)
+        success = self.__alarm_db.delete_alarm(alarm_id)
+        if success is True:
+            self.__notify('delete', id=alarm_id)
+        return success
+
+    def delete_alarms(self, alarm_ids):
+        """
+        Removes the alarms with the given IDs from the database in a single
+        transaction, and then reconciles the alarm threads a single time.
+        :param alarm_ids: Iterable of integers to indicate the primary keys of
+                          the Alarms to be removed.
+        :return: Boolean indicating the success of the 'delete' operation.
+        """
+        alarm_ids = list(alarm_ids)
+        success = self.__alarm_db.delete_alarms(alarm_ids)
+        if success is True:
+            for alarm_id in alarm_ids:
+                self.__notify('delete', id=alarm_id)
+        for alarm_id in alarm_ids:
+            self.__alarm_offset_alerts.pop(alarm_id, None)
+            if self.__scheduler.cancel_timer(alarm_id) is True:
+                self.__alarm_db.delete_snooze(alarm_id)
+        self.check_threads_state()
+        return success
 
     def delete_all_alarms(self):
         """
@@ -298,173 +609,258 @@ class AlarmManager(object):
         """
         # Ensure there are no alarm threads running anymore
         thread_success = self.__stop_all_alarm_threads()
+        self.__alarm_offset_alerts.clear()
+        self.__alarm_db.delete_all_snoozes()
         # Remove from database
-        db_success = AlarmDb().delete_all_alarms()
+        db_success = self.__alarm_db.delete_all_alarms()
+        if db_success is True:
+            self.__notify('delete_all')
 
         if thread_success is True and db_success is True:
             return True
         else:
             return False
 
+    #
+    # member methods to apply several alarm operations at once
+    #
+    def apply_operations(self, operations):
+        """
+        Applies several add, edit and delete alarm operations in a single
+        database transaction, and then reconciles the alarm threads a single
+        time. The operations are only saved if all of them succeed.
+        :param operations: Iterable of tuples with an operation name and its
+                           arguments, one of:
+                             ('add', AlarmItem)
+                             ('edit', alarm_id, dictionary with the
+                              edit_alarm() keyword arguments)
+                             ('delete', alarm_id)
+                           The IDs of the added AlarmItems are set to the new
+                           database IDs.
+        :return: List with the result of each operation: the new alarm ID for
+                 'add', the edited AlarmItem for 'edit', and True for 'delete'.
+                 The operations that failed have a None result, in which case
+                 none of the operations have been saved.
+        """
+        operations = list(operations)
+        results = self.__alarm_db.apply_operations(operations)
+        if any(result is None for result in results):
+            return results
+        for operation, result in zip(operations, results):
+            if operation[0] == 'add':
+                operation[1].id_ = result
+                self.__notify('add', alarm=operation[1])
+            elif operation[0] == 'edit':
+                self.__notify('edit', alarm=result)
+            else:
+                alarm_id = operation[1]
+                self.__notify('delete', id=alarm_id)
+                self.__alarm_offset_alerts.pop(alarm_id, None)
+                if self.__scheduler.cancel_timer(alarm_id) is True:
+                    self.__alarm_db.delete_snooze(alarm_id)
+        if operations:
+            self.check_threads_state()
+        return results
+
+    #
+    # member methods to synchronise the alarms with other systems
+    #
+    def get_changes(self, since=0):
+        """
+        Gets the alarms changed and deleted after an alarms revision, to
+        synchronise them into another system. The alarms are identified by an
+        uid, as their IDs are local to each system. The deletions are only kept
+        for the last 1000 revisions, so for an older revision all the alarms
+        are returned as a full synchronisation, which has to replace all the
+        alarms of the other system.
+        :param since: Integer with the alarms revision of the last
+                      synchronisation, 0 to get all the alarms and deletions.
+        :return: Tuple with the current alarms revision, to be used as the next
+                 'since' value, a list of (uid, AlarmItem) tuples with the
+                 changed alarms, a list of (uid, timestamp) tuples with the
+                 deleted alarms, and a Boolean indicating if it is a full
+                 synchronisation.
+        """
+        return self.__alarm_db.get_changes(since)
+
+    def apply_changes(self, alarms=(), deleted=(), full=False):
+        """
+        Applies the alarm changes and deletions from another system, as
+        retrieved with its get_changes(), in a single transaction. The newest
+        timestamp wins, so the alarms and deletions older than the local ones
+        are ignored. Once applied the alarm threads are reconciled a single
+        time.
+        :param alarms: Iterable of (uid, AlarmItem) tuples with the changed
+                       alarms.
+        :param deleted: Iterable of (uid, timestamp) tuples with the deleted
+                        alarms.
+        :param full: Boolean indicating a full synchronisation, which deletes
+                     the local alarms not included in the alarms.
+        :return: Integer with the number of alarms added, edited or deleted,
+                 or None if the input data was invalid.
+        """
+        result = self.__alarm_db.apply_changes(alarms, deleted, full)
+        if result is None:
+            return None
+        added, edited, deleted_ids = result
+        for alarm in added:
+            self.__notify('add', alarm=alarm)
+        for alarm in edited:
+            self.__notify('edit', alarm=alarm)
+        for alarm_id in deleted_ids:
+            self.__notify('delete', id=alarm_id)
+            self.__alarm_offset_alerts.pop(alarm_id, None)
+            if self.__scheduler.cancel_timer(alarm_id) is True:
+                self.__alarm_db.delete_snooze(alarm_id)
+        if added or edited or deleted_ids:
+            self.check_threads_state()
+        return len(added) + len(edited) + len(deleted_ids)
+
     #
     # member methods to launch, edit and stop alarm events
     #
     def __set_alarm_thread(self, alarm):
         """
         Takes an input alarm and determines if is active, in order to be
-        launched as an alarm thread, or if a thread should be changed due to
-        the new alarm data.
-        Maintains the thread list updated with the running alarms.
-        :param alarm: AlarmItem to launch, edited, or stop thread.
-        :return: Boolean indicating if Alarm Thread is running.
-        """
-        thread_up = False
-        # First check if the alarm to be register is already in the list
-        for i, alarm_thread in enumerate(self.__alarm_threads):
-            if alarm.id_ == alarm_thread.get_id():
-                # Already set as launched, check if should be stopped or edited
-                if alarm.is_active() is False:
-                    self.__stop_alarm_thread(alarm.id_)
-                else:
-                    alarm_thread.edit_alarm(alarm)
-                    # It is meant to be up and running, check that it is
-                    if alarm_thread.isAlive() is False:
-                        self.__alarm_threads[i] = AlarmThread(
-                            alarm,
-                            alarm_callback=self.__alert_callback,
-                            offset_alarm_time=self.get_offset_alert_time(),
-                            offset_callback=self.__offset_alert_callback)
-                        self.__alarm_threads[i].start()
-                    thread_up = alarm_thread.isAlive()
-                break
-        # Else only executes if no alarm with same ID was found
+        registered into the alarm scheduler thread, or if it should be edited
+        or removed from the scheduler due to the new alarm data.
+        :param alarm: AlarmItem to register, edit, or remove from the scheduler.
+        :return: Boolean indicating if Alarm is running in the scheduler.
+        """
+        if alarm.is_active() is True:
+            # It is meant to be up and running, check that the scheduler is
+            if self.__scheduler.is_alive() is False:
+                self.__restart_scheduler()
+            self.__scheduler.set_alarm(
+                alarm,
+                alarm_callback=self.__alert_callback,
+                offset_alerts=self.get_alarm_offset_alerts(alarm.id_))
+            return self.is_alarm_running(alarm.id_)
         else:
-            # Before thread is launched, check if the alarm is active
-            if alarm.is_active() is True:
-                alarm_thread = AlarmThread(
-                    alarm,
-                    alarm_callback=self.__alert_callback,
-                    offset_alarm_time=self.get_offset_alert_time(),
-                    offset_callback=self.__offset_alert_callback)
-                self.__alarm_threads.append(alarm_thread)
-                alarm_thread.start()
-                thread_up = alarm_thread.isAlive()
-
-        return thread_up
+            self.__stop_alarm_thread(alarm.id_)
+            return False
 
     def __stop_alarm_thread(self, alarm_id):
         """
-        Stops an AlarmThread and removes item from the threads list.
-        This method can take up to 2 seconds to run.
-        :param alarm_id: ID of the AlarmItem for the alarm thread to stop.
+        Removes an alarm from the alarm scheduler thread.
+        :param alarm_id: ID of the AlarmItem to remove from the scheduler.
         :return: Boolean indicating if the operation was successful.
         """
-        success = False
-        for alarm_thread in self.__alarm_threads:
-            if alarm_id == alarm_thread.get_id():
-                alarm_thread.stop()
-                # Check that it has really stopped for a maximum period of 3s
-                milliseconds_passed = 0
-                while alarm_thread.isAlive() and (milliseconds_passed < 3000):
-                    time.sleep(0.01)
-                    milliseconds_passed += 10
-                # isAlive returns False if it has stopped
-                success = not alarm_thread.isAlive()
-                if success is True:
-                    self.__alarm_threads.remove(alarm_thread)
-        return success
+        return self.__scheduler.remove_alarm(alarm_id)
 
     def __stop_all_alarm_threads(self):
         """
-        Stops all AlarmThreads and removes items from the threads list.
-        This method can take up to 15 seconds to run.
+        Removes all alarms from the alarm scheduler thread.
         :return: Boolean indicating if the operation was successful.
         """
-        for alarm_thread in self.__alarm_threads:
-            alarm_thread.stop()
-
-        # Check, for a max time of 15s, that all threads have really stopped
-        milliseconds_passed = 0
-        continue_trying = True
-        while continue_trying and (milliseconds_passed < 15000):
-            continue_trying = False
-            # Need to iterate backwards in order to remove items safely
-            for i in xrange(len(self.__alarm_threads) - 1, -1, -1):
-                if self.__alarm_threads[i].isAlive() is True:
-                    continue_trying = True
-                else:
-                    del self.__alarm_threads[i]
-            time.sleep(0.01)
-            milliseconds_passed += 10
-
-        if self.__alarm_threads:
-            return False
-        else:
-            return True
+        self.__scheduler.remove_all_alarms()
+        return True
+
+    def __restart_scheduler(self):
+        """
+        Launches a new alarm scheduler thread, with the same alarms registered
+        in the current one, to recover from the scheduler thread stopping.
+        """
+        old_scheduler = self.__scheduler
+        old_scheduler.stop()
+        self.__scheduler = AlarmScheduler(
+            dispatcher=self.__dispatcher, clock=self.__clock)
+        self.__register_alarms(
+            [old_scheduler.get_alarm(alarm_id)
+             for alarm_id in old_scheduler.get_alarm_ids()])
+        self.__load_snoozes()
+        self.__scheduler.start()
+
+    def __register_alarms(self, alarms):
+        """
+        Registers, or updates, several alarms into the alarm scheduler. The
+        alarms with the default offset alerts are registered in a single
+        scheduler operation.
+        :param alarms: List of AlarmItems to register.
+        """
+        default_alarms = []
+        for alarm in alarms:
+            offset_alerts = self.__alarm_offset_alerts.get(alarm.id_)
+            if offset_alerts is None:
+                default_alarms.append(alarm)
+            else:
+                self.__scheduler.set_alarm(
+                    alarm, alarm_callback=self.__alert_callback,
+                    offset_alerts=offset_alerts)
+        self.__scheduler.set_alarms(
+            default_alarms, alarm_callback=self.__alert_callback,
+            offset_alerts=self.__get_default_offset_alerts())
 
     def is_alarm_running(self, alarm_id):
         """
-        Checks if the given alarm ID is running as a thread.
-        :param alarm_id: ID of the AlarmItem for the alarm thread to check.
-        :return:
+        Checks if the given alarm ID is running in the alarm scheduler thread.
+        :param alarm_id: ID of the AlarmItem to check.
+        :return: Boolean indicating if the alarm is running.
         """
-        for alarm_thread in self.__alarm_threads:
-            if alarm_thread.get_id() == alarm_id:
-                return alarm_thread.isAlive()
-        return False
+        return self.__scheduler.is_alarm_set(alarm_id) and \
+            self.__scheduler.is_alive()
 
     def get_running_alarms(self):
         """
         Returns a list of all the running alarms (active alarms verified to be
-        running on their own thread).
+        running in the alarm scheduler thread).
         :return: List of AlarmItems that are currently running.
         """
-        # self test and self recovery
-        self.check_threads_state()
-        alarm_list = []
-        for alarm_thread in self.__alarm_threads:
-            alarm_list.append(AlarmManager.get_alarm(alarm_thread.get_id()))
-        return alarm_list
+        # self test and self recovery, which already loads the active alarms
+        active_alarms = self.__reconcile_alarms()[1]
+        running_ids = set(self.__scheduler.get_alarm_ids())
+        return [alarm for alarm in active_alarms if alarm.id_ in running_ids]
+
+    def get_alert_stats(self):
+        """
+        Returns the statistics of the alert callbacks executed so far.
+        :return: Dictionary with the number of alert callbacks 'executed',
+                 'completed', 'failed', 'crashed' and 'timed_out'.
+        """
+        return self.__dispatcher.get_stats()
 
     def check_threads_state(self):
         """
         Retrieves all the alarms and checks if the are running or not as they
-        should. Tries to correct any possible errors, and if it can't it prints
-        an error into stderr.
+        should, updating the running alarms with the stored data. Tries to
+        correct any possible errors, and if it can't it prints an error into
+        stderr.
         :return: Boolean indicating if everything was running correctly before
                  the method was called.
         """
+        return self.__reconcile_alarms()[0]
+
+    def __reconcile_alarms(self):
+        """
+        Implements check_threads_state(), loading the active alarms from the
+        database in a single query.
+        :return: Tuple with a boolean indicating if everything was running
+                 correctly before the method was called, and a list of the
+                 active AlarmItems, ordered by ID.
+        """
         previously_correct = True
-        running_counter = 0
-        all_alarms = AlarmManager.get_all_alarms()
-        for alarm in all_alarms:
-            if alarm.is_active() is True:
-                # This alarm should be running
-                running_counter += 1
-                if self.is_alarm_running(alarm.id_) is False:
-                    self.__set_alarm_thread(alarm)
-                    previously_correct = False
-            else:
-                # This alarm should not be running
-                if self.is_alarm_running(alarm.id_) is True:
-                    self.__stop_alarm_thread(alarm.id_)
-                    previously_correct = False
+        if self.__scheduler.is_alive() is False:
+            previously_correct = False
+            self.__restart_scheduler()
+
+        # Compare the IDs of the alarms meant to be running with the alarms
+        # registered in the scheduler
+        active_alarms = self.get_all_active_alarms()
+        active_ids = set(alarm.id_ for alarm in active_alarms)
+        running_ids = set(self.__scheduler.get_alarm_ids())
 
-        # Check we have as many threads as expected
-        if len(self.__alarm_threads) != running_counter:
+        # Alarms registered in the scheduler that should not be running
+        extra_ids = running_ids - active_ids
+        if extra_ids or (active_ids - running_ids):
             previously_correct = False
-            # We can only attempt to recover if there are extra threads not
-            # meant to be running
-            for alarm_thread in self.__alarm_threads:
-                for alarm in all_alarms:
-                    if alarm.id_ == alarm_thread.get_id():
-                        break
-                else:
-                    self.__stop_alarm_thread(alarm_thread.get_id())
-
-            if len(self.__alarm_threads) != running_counter:
-                print('ERROR: Could not correct the alarm threads in' +
-                      'AlarmManager().check_threads_state !',
-                      file=sys.stderr)
-
-        return previously_correct
+        self.__scheduler.remove_alarms(extra_ids)
+
+        # Register the missing alarms and update the running alarms with the
+        # latest data
+        self.__register_alarms(active_alarms)
+
+        if set(self.__scheduler.get_alarm_ids()) != active_ids:
+            print('ERROR: Could not correct the alarm threads in' +
+                  'AlarmManager().check_threads_state !', file=sys.stderr)
+
+        return previously_correct, active_alarms
@@ -0,0 +1,623 @@
+# -*- coding: utf-8 -*-
+#
+# Class to run the alerts of all the alarms from a single thread.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import sys
+import heapq
+import datetime
+import itertools
+import threading
+try:
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+    from LightUpAlarm.WakeEvent import WakeEvent
+    from LightUpAlarm.Clock import SystemClock
+except ImportError:
+    from AlarmDispatcher import AlarmDispatcher
+    from WakeEvent import WakeEvent
+    from Clock import SystemClock
+
+
+class _ScheduledAlarm(object):
+    """
+    Contains an alarm registered in the AlarmScheduler, with its callbacks and
+    the data required to keep its entries in the scheduler queue up to date.
+    """
+
+    __slots__ = ('alarm', 'alarm_callback', 'offsets', 'offset_alarms',
+                 'state', 'generation', 'last_alerts')
+
+    def __init__(self, alarm, alarm_callback, offsets):
+        self.alarm = alarm
+        self.alarm_callback = alarm_callback
+        # Tuple of (offset time in minutes, callback) for each offset alert
+        self.offsets = offsets
+        # AlarmItem of each offset alert, calculated when the alarm is queued
+        self.offset_alarms = []
+        self.state = None
+        # Incremented every time the alarm is rescheduled, so that old entries
+        # in the queue can be identified and discarded
+        self.generation = 0
+        # Start of the minute of the last alert, for the alarm and each offset
+        self.last_alerts = [None] * (len(offsets) + 1)
+
+
+class AlarmScheduler(threading.Thread):
+    """
+    This thread class triggers the alerts of all the registered AlarmItems from
+    a single thread. Instead of checking the time periodically for each alarm,
+    it keeps a priority queue with the time of the next alert of each alarm
+    and its offset (pre or post) alerts, and sleeps until the earliest of them.
+    An alarm can have any number of offset alerts, each with its own callback,
+    and their AlarmItems are only calculated when the alarm is (re)scheduled.
+    One-shot timers, like the alarm snoozes, are kept in the same queue.
+    Registering, editing or removing an alarm wakes up the thread to
+    recalculate its sleep time.
+
+    Queue entries are not removed when an alarm is edited or removed, instead
+    each alarm has a generation counter and entries from an older generation
+    are discarded when they reach the front of the queue.
+
+    As with the AlarmThread, this class does NOT edit the registered AlarmItem
+    instances. Before triggering an alert it checks that the alarm data has not
+    been modified since it was scheduled, if it has the alarm is rescheduled.
+
+    The alerts are passed to an AlarmDispatcher, which executes the callbacks
+    from its own worker threads, so that a long running callback does not delay
+    any other alert.
+
+    The alert times are absolute, so an alert that is due while the process is
+    stalled or the system is suspended is triggered as soon as the scheduler
+    runs again, as long as it is within the grace period after the alert time.
+    Alerts later than that are reported as missed instead of triggered. The
+    thread never sleeps for more than a few seconds at a time, as a wait
+    timeout does not count the time the system is suspended, and if the clock
+    is set back all the alarms are rescheduled from the new time.
+
+    The alert times are calculated in local time, so an alarm keeps its local
+    time across daylight saving time changes. On the night the clock goes
+    back the alarm is only alerted once, and on the night it goes forward an
+    alarm inside the skipped hour is alerted as soon as the hour is skipped.
+
+    The time is read from the clock provided to the constructor. With a
+    SimulatedClock the scheduler can be driven without starting its thread, by
+    advancing the clock and calling run_pending().
+    """
+
+    # Maximum time, in seconds, the thread sleeps before checking the time
+    __max_wait = 10
+
+    #
+    # metaclass methods
+    #
+    def __init__(self, dispatcher=None, clock=None, grace_period=60):
+        """
+        AlarmScheduler initialiser. The thread has to be started with start().
+        :param dispatcher: AlarmDispatcher to execute the alerts. If not
+                           provided the scheduler creates its own, which is
+                           stopped together with the scheduler.
+        :param clock: Clock instance to read the time and sleep. Defaults to
+                      the system clock.
+        :param grace_period: Time, in seconds from the start of the alert
+                             minute, during which a late alert is still
+                             triggered. None to always trigger late alerts.
+        """
+        threading.Thread.__init__(self, name='AlarmScheduler')
+        self.daemon = True
+
+        # Protects the alarms dictionary and the queue
+        self.__lock = threading.Lock()
+        # Dictionary of _ScheduledAlarms with the alarm ID as the key
+        self.__alarms = {}
+        # Dictionary of one-shot timers with the timer ID as the key, and a
+        # list with the alert time, AlarmItem, callback and timer generation
+        self.__timers = {}
+        # Priority queue with tuples of: alert time in seconds since 1970,
+        # sequence number, alarm or timer ID, generation and alert index (0 for
+        # the alarm, 1 onwards for its offset alerts, None for a timer)
+        self.__queue = []
+        self.__sequence = itertools.count()
+        # Time of the last check for due alerts, to detect the clock going back
+        self.__last_check = None
+        self.__grace_period = grace_period
+
+        # Set to wake up the thread when the alarms change
+        self.__wake_event = WakeEvent()
+        self.__clock = clock if clock is not None else SystemClock()
+
+        if dispatcher is None:
+            self.__dispatcher = AlarmDispatcher(clock=self.__clock)
+            self.__own_dispatcher = True
+        else:
+            self.__dispatcher = dispatcher
+            self.__own_dispatcher = False
+
+        self.__run = True
+
+    #
+    # control thread methods
+    #
+    def run(self):
+        """
+        Infinite loop function to run until it is stopped by calling the stop()
+        method. It triggers all the alerts that are due and then sleeps until
+        the next alert, or until it is woken up by a change in the alarms.
+        """
+        try:
+            while self.__run:
+                timeout = self.__run_pending()[1]
+                if timeout is None or timeout > AlarmScheduler.__max_wait:
+                    timeout = AlarmScheduler.__max_wait
+                if self.__run:
+                    self.__clock.wait(self.__wake_event, timeout)
+        finally:
+            self.__wake_event.close()
+            if self.__own_dispatcher is True:
+                self.__dispatcher.stop()
+
+    def stop(self):
+        """
+        Stops the infinite loop in run method and causes the thread to exit once
+        the current operation finishes.
+        """
+        self.__run = False
+        self.__wake_event.set()
+
+    def run_pending(self):
+        """
+        Triggers all the alerts that are due at the current clock time, from
+        the calling thread. Used to drive the scheduler with a simulated clock
+        without starting its thread.
+        :return: Number of alerts dispatched.
+        """
+        return self.__run_pending()[0]
+
+    def __run_pending(self):
+        """
+        Dispatches all the alerts that are due at the current clock time.
+        :return: Tuple with the number of alerts dispatched and the time in
+                 seconds until the next alert, or None if the queue is empty.
+        """
+        now = self.__clock.time()
+        alerts, missed, timeout = self.__pop_due_alerts(now)
+        for alarm_item, callback, alert_time, alarm_id, alert_index in alerts:
+            self.__dispatcher.dispatch(
+                alarm_item, callback, alert_time, alarm_id=alarm_id,
+                alert_index=alert_index)
+        for alarm_item, alert_time in missed:
+            print('WARNING: Missed the alert for the Alarm %s at %02d:%02d, '
+                  'the scheduler ran %d seconds late.' %
+                  (alarm_item.id_, alarm_item.hour, alarm_item.minute,
+                   now - alert_time), file=sys.stderr)
+        return len(alerts), timeout
+
+    #
+    # member methods to register alarms
+    #
+    def set_alarm(self, alarm_item, alarm_callback=None,
+                  offset_alarm_time=None, offset_callback=None,
+                  offset_alerts=None):
+        """
+        Registers an alarm to be alerted, or updates an already registered
+        alarm with the same ID. The alarm is only queued while it is active.
+        :param alarm_item: AlarmItem instance.
+        :param alarm_callback: Callback function to execute when alarm triggers.
+        :param offset_alarm_time: Indicates if a pre or post alarm alert shall
+                                  be triggered. Input sanitation done at
+                                  AlarmItem.diff_alarm()
+        :param offset_callback: If the offset_alarm_time is set, it will
+                                execute this callback on the pre or post alert.
+        :param offset_alerts: Iterable of (offset time in minutes, callback)
+                              tuples for additional pre or post alerts.
+        """
+        offsets = AlarmScheduler.__offsets(
+            offset_alarm_time, offset_callback, offset_alerts)
+        with self.__lock:
+            if self.__register(alarm_item, alarm_callback, offsets,
+                               self.__clock.time()) is True:
+                self.__wake_event.set()
+
+    def set_alarms(self, alarm_items, alarm_callback=None,
+                   offset_alarm_time=None, offset_callback=None,
+                   offset_alerts=None):
+        """
+        Registers, or updates, several alarms with the same callbacks and
+        offset alerts, acquiring the lock and waking up the thread once.
+        :param alarm_items: Iterable of AlarmItem instances.
+        :param alarm_callback: Callback function to execute when alarm triggers.
+        :param offset_alarm_time: Indicates if a pre or post alarm alert shall
+                                  be triggered. Input sanitation done at
+                                  AlarmItem.diff_alarm()
+        :param offset_callback: If the offset_alarm_time is set, it will
+                                execute this callback on the pre or post alert.
+        :param offset_alerts: Iterable of (offset time in minutes, callback)
+                              tuples for additional pre or post alerts.
+        """
+        offsets = AlarmScheduler.__offsets(
+            offset_alarm_time, offset_callback, offset_alerts)
+        rescheduled = False
+        with self.__lock:
+            now = self.__clock.time()
+            for alarm_item in alarm_items:
+                if self.__register(alarm_item, alarm_callback, offsets,
+                                   now) is True:
+                    rescheduled = True
+            if rescheduled is True:
+                self.__wake_event.set()
+
+    def remove_alarm(self, alarm_id):
+        """
+        Removes an alarm from the scheduler.
+        :param alarm_id: ID of the AlarmItem to remove.
+        :return: Boolean indicating if the alarm was registered.
+        """
+        with self.__lock:
+            scheduled = self.__alarms.pop(alarm_id, None)
+            if scheduled is not None:
+                scheduled.generation += 1
+                # Remove the queue entries if there are no alarms left
+                if not self.__alarms and not self.__timers:
+                    del self.__queue[:]
+        return scheduled is not None
+
+    def remove_alarms(self, alarm_ids):
+        """
+        Removes several alarms from the scheduler.
+        :param alarm_ids: Iterable of IDs of the AlarmItems to remove.
+        :return: Number of alarms that were registered and have been removed.
+        """
+        removed = 0
+        with self.__lock:
+            for alarm_id in alarm_ids:
+                scheduled = self.__alarms.pop(alarm_id, None)
+                if scheduled is not None:
+                    scheduled.generation += 1
+                    removed += 1
+            if not self.__alarms and not self.__timers:
+                del self.__queue[:]
+        return removed
+
+    def remove_all_alarms(self):
+        """ Removes all the alarms and timers from the scheduler. """
+        with self.__lock:
+            self.__alarms.clear()
+            self.__timers.clear()
+            del self.__queue[:]
+
+    #
+    # member methods for one-shot timers
+    #
+    def set_timer(self, timer_id, alert_time, alarm_item, callback=None):
+        """
+        Sets a one-shot timer to alert an alarm at the given time, replacing
+        any timer with the same ID. It is triggered like the alarm alerts, and
+        it is removed once triggered.
+        :param timer_id: Hashable ID for the timer.
+        :param alert_time: Time, in seconds since 1970, to trigger the timer.
+        :param alarm_item: AlarmItem to alert.
+        :param callback: Callback function to execute when the timer triggers.
+        """
+        with self.__lock:
+            # The sequence number is unique, so it is also used as generation
+            sequence = next(self.__sequence)
+            self.__timers[timer_id] = \
+                [alert_time, alarm_item, callback, sequence]
+            heapq.heappush(self.__queue,
+                           (alert_time, sequence, timer_id, sequence, None))
+            self.__wake_event.set()
+
+    def cancel_timer(self, timer_id):
+        """
+        Cancels a one-shot timer.
+        :param timer_id: ID of the timer to cancel.
+        :return: Boolean indicating if the timer was set.
+        """
+        with self.__lock:
+            return self.__timers.pop(timer_id, None) is not None
+
+    def get_timer(self, timer_id):
+        """
+        :param timer_id: ID of the timer to get.
+        :return: Time, in seconds since 1970, the timer will be triggered, or
+                 None if the timer is not set.
+        """
+        with self.__lock:
+            timer = self.__timers.get(timer_id)
+            return timer[0] if timer is not None else None
+
+    def is_alarm_set(self, alarm_id):
+        """
+        Checks if an alarm with the given ID is registered.
+        :param alarm_id: ID of the AlarmItem to check.
+        :return: Boolean indicating if the alarm is registered.
+        """
+        with self.__lock:
+            return alarm_id in self.__alarms
+
+    def get_alarm_ids(self):
+        """
+        :return: List with the IDs of all the registered alarms.
+        """
+        with self.__lock:
+            return list(self.__alarms.keys())
+
+    def get_alarm(self, alarm_id):
+        """
+        :param alarm_id: ID of the registered AlarmItem to get.
+        :return: Registered AlarmItem instance, or None if not found.
+        """
+        with self.__lock:
+            scheduled = self.__alarms.get(alarm_id)
+            return scheduled.alarm if scheduled is not None else None
+
+    def get_grace_period(self):
+        """
+        :return: Time, in seconds from the start of the alert minute, during
+                 which a late alert is still triggered, or None if the late
+                 alerts are always triggered.
+        """
+        return self.__grace_period
+
+    def get_next_alert_time(self):
+        """
+        :return: Time, in seconds since 1970, of the next alert in the queue,
+                 or None if the queue is empty. It might belong to an alarm that
+                 has been edited or removed since it was queued.
+        """
+        with self.__lock:
+            return self.__queue[0][0] if self.__queue else None
+
+    def get_upcoming_alarms(self, number=None, until=None):
+        """
+        Gets the next alarm alerts in the queue, in chronological order, without
+        the offset alerts. The queue is walked from its front, so the cost
+        depends on the number of alerts requested, not on the queue size.
+        Alarms modified without calling set_alarm() are not included until the
+        scheduler thread reschedules them.
+        :param number: Maximum number of alerts to get. None for no limit.
+        :param until: Time, in seconds since 1970, after which alerts are not
+                      included. None for no limit.
+        :return: List of (alert time, AlarmItem) tuples, with the alert time in
+                 seconds since 1970.
+        """
+        upcoming = []
+        with self.__lock:
+            queue = self.__queue
+            # Heap of the queue entries that can be the next one, and their
+            # position in the queue, to visit the queue heap in order
+            candidates = [(queue[0], 0)] if queue else []
+            while candidates and (number is None or len(upcoming) < number):
+                entry, index = heapq.heappop(candidates)
+                alert_time, _, alarm_id, generation, alert_index = entry
+                if until is not None and alert_time > until:
+                    break
+                for child in (2 * index + 1, 2 * index + 2):
+                    if child < len(queue):
+                        heapq.heappush(candidates, (queue[child], child))
+                if alert_index != 0:
+                    continue
+                scheduled = self.__alarms.get(alarm_id)
+                if scheduled is None or scheduled.generation != generation or \
+                        scheduled.state != \
+                        AlarmScheduler.__alarm_state(scheduled.alarm):
+                    continue
+                upcoming.append((alert_time, scheduled.alarm))
+        return upcoming
+
+    #
+    # scheduling methods, need to be called with the lock acquired
+    #
+    @staticmethod
+    def __offsets(offset_alarm_time, offset_callback, offset_alerts):
+        """
+        :return: Tuple of (offset time in minutes, callback) tuples, with the
+                 single offset alert first followed by the offset_alerts.
+        """
+        offsets = []
+        if offset_alarm_time is not None:
+            offsets.append((offset_alarm_time, offset_callback))
+        if offset_alerts is not None:
+            offsets.extend(
+                (offset_time, callback) for offset_time, callback in
+                offset_alerts)
+        return tuple(offsets)
+
+    @staticmethod
+    def __alarm_state(alarm_item):
+        """
+        :return: Tuple with the alarm data used to calculate the alert times.
+        """
+        return (alarm_item.hour, alarm_item.minute, alarm_item.repeat_mask,
+                alarm_item.enabled)
+
+    def __next_alert_time(self, alarm_item, start_time):
+        """
+        Calculates the time of the next alert of an alarm.
+        :param alarm_item: AlarmItem to calculate the alert time.
+        :param start_time: Time, in seconds since 1970, from which to look for
+                           the next alert. An alert on the same minute is valid.
+        :return: Time, in seconds since 1970, of the start of the minute of the
+                 next alert, or None if the alarm does not repeat any day.
+        """
+        local_time = self.__clock.localtime(start_time)
+        minutes = alarm_item.minutes_to_alert(
+            local_time.tm_hour, local_time.tm_min, local_time.tm_wday)
+        if minutes is None:
+            return None
+        alert_time = int(start_time) - local_time.tm_sec + (minutes * 60)
+
+        # If there is a daylight saving time change before the alert, convert
+        # its local time instead of adding the minutes
+        day_minutes = local_time.tm_hour * 60 + local_time.tm_min + minutes
+        alert_date = datetime.date(
+            local_time.tm_year, local_time.tm_mon, local_time.tm_mday) + \
+            datetime.timedelta(days=day_minutes // 1440)
+        alert_minute = (alert_date.year, alert_date.month, alert_date.day,
+                        (day_minutes % 1440) // 60, day_minutes % 60)
+        if self.__local_minute(alert_time) != alert_minute:
+            alert_time = int(self.__clock.mktime(alert_minute + (0, 0, 0, -1)))
+            # A local time skipped when the clock goes forward does not exist,
+            # so it is alerted on the first minute after the skipped ones
+            while self.__local_minute(alert_time - 60) >= alert_minute:
+                alert_time -= 60
+        return alert_time
+
+    def __local_minute(self, seconds):
+        """
+        :param seconds: Time in seconds since 1970.
+        :return: Tuple with the local year, month, day, hour and minute.
+        """
+        local_time = self.__clock.localtime(seconds)
+        return (local_time.tm_year, local_time.tm_mon, local_time.tm_mday,
+                local_time.tm_hour, local_time.tm_min)
+
+    def __register(self, alarm_item, alarm_callback, offsets, now):
+        """
+        Registers an alarm, or updates an already registered alarm with the
+        same ID, and queues it if the data used for its alert times changed.
+        :param alarm_item: AlarmItem instance.
+        :param alarm_callback: Callback function to execute when alarm triggers.
+        :param offsets: Tuple of (offset time in minutes, callback) tuples.
+        :param now: Current time in seconds since 1970.
+        :return: Boolean indicating if the alarm has been rescheduled.
+        """
+        scheduled = self.__alarms.get(alarm_item.id_)
+        if scheduled is None:
+            scheduled = _ScheduledAlarm(alarm_item, alarm_callback, offsets)
+            self.__alarms[alarm_item.id_] = scheduled
+        else:
+            scheduled.alarm = alarm_item
+            scheduled.alarm_callback = alarm_callback
+            # The callbacks can change without rescheduling the offset alerts
+            if [offset[0] for offset in scheduled.offsets] != \
+                    [offset[0] for offset in offsets]:
+                scheduled.state = None
+                scheduled.last_alerts = \
+                    scheduled.last_alerts[:1] + [None] * len(offsets)
+            scheduled.offsets = offsets
+        # Only reschedule if the data used for the alert times has changed
+        if scheduled.state != AlarmScheduler.__alarm_state(alarm_item):
+            self.__schedule(scheduled, now)
+            return True
+        return False
+
+    def __schedule(self, scheduled, now):
+        """
+        Queues the next alert and offset alerts of a registered alarm, and
+        invalidates any of its previous entries in the queue.
+        :param scheduled: _ScheduledAlarm to queue.
+        :param now: Current time in seconds since 1970.
+        """
+        scheduled.generation += 1
+        scheduled.state = AlarmScheduler.__alarm_state(scheduled.alarm)
+        scheduled.offset_alarms = []
+        if scheduled.alarm.is_active() is False:
+            return
+        self.__queue_alert(scheduled, 0, now)
+        for index, (offset_time, _) in enumerate(scheduled.offsets):
+            offset_alarm = scheduled.alarm.diff_alarm(offset_time)
+            scheduled.offset_alarms.append(offset_alarm)
+            if offset_alarm is not None:
+                self.__queue_alert(scheduled, index + 1, now)
+
+    def __queue_alert(self, scheduled, alert_index, now):
+        """
+        Queues the next alert of a registered alarm or one of its offset
+        alarms, never on the same minute as its last alert.
+        :param scheduled: _ScheduledAlarm to queue.
+        :param alert_index: 0 for the alarm, or the offset alert index + 1.
+        :param now: Current time in seconds since 1970.
+        """
+        last_alert = scheduled.last_alerts[alert_index]
+        # If the clock has been set back before the last alert it can repeat
+        if last_alert is not None and last_alert <= now < last_alert + 60:
+            now = last_alert + 60
+        if alert_index == 0:
+            alarm_item = scheduled.alarm
+        else:
+            alarm_item = scheduled.offset_alarms[alert_index - 1]
+        alert_time = self.__next_alert_time(alarm_item, now)
+        if alert_time is not None:
+            heapq.heappush(self.__queue, (
+                alert_time, next(self.__sequence), scheduled.alarm.id_,
+                scheduled.generation, alert_index))
+
+    def __pop_due_alerts(self, now):
+        """
+        Removes from the queue all the alerts that are due and queues their
+        next alert.
+        :param now: Current time in seconds since 1970.
+        :return: Tuple with a list of (AlarmItem, callback, alert time, alarm
+                 or timer ID, alert index) tuples for the alerts to trigger, a
+                 list of (AlarmItem, alert time) tuples for the alerts missed
+                 by more than the grace period, and the time in seconds until
+                 the next alert, or None if the queue is empty.
+        """
+        alerts = []
+        missed = []
+        with self.__lock:
+            if self.__last_check is not None and now < self.__last_check:
+                # The clock has been set back, so the queued alerts could skip
+                # the ones between the new time and the old one
+                del self.__queue[:]
+                for scheduled in self.__alarms.values():
+                    self.__schedule(scheduled, now)
+                for timer_id, timer in self.__timers.items():
+                    heapq.heappush(self.__queue, (
+                        timer[0], next(self.__sequence), timer_id, timer[3],
+                        None))
+            self.__last_check = now
+            while self.__queue and self.__queue[0][0] <= now:
+                alert_time, _, alarm_id, generation, alert_index = \
+                    heapq.heappop(self.__queue)
+                if alert_index is None:
+                    timer = self.__timers.get(alarm_id)
+                    if timer is None or timer[3] != generation:
+                        # Entry from a cancelled or replaced timer
+                        continue
+                    del self.__timers[alarm_id]
+                    if self.__grace_period is None or \
+                            now < alert_time + self.__grace_period:
+                        alerts.append((timer[1], timer[2], alert_time,
+                                       alarm_id, None))
+                    else:
+                        missed.append((timer[1], alert_time))
+                    continue
+                scheduled = self.__alarms.get(alarm_id)
+                if scheduled is None or scheduled.generation != generation:
+                    # Entry from a removed or rescheduled alarm
+                    continue
+                if scheduled.state != \
+                        AlarmScheduler.__alarm_state(scheduled.alarm):
+                    # The AlarmItem was modified without calling set_alarm()
+                    self.__schedule(scheduled, now)
+                    continue
+                if alert_index == 0:
+                    alarm_item = scheduled.alarm
+                    callback = scheduled.alarm_callback
+                else:
+                    alarm_item = scheduled.offset_alarms[alert_index - 1]
+                    callback = scheduled.offsets[alert_index - 1][1]
+                # Alerts later than the grace period, for example after the
+                # system has been suspended, are not triggered
+                if self.__grace_period is None or \
+                        now < alert_time + self.__grace_period:
+                    alerts.append((alarm_item, callback, alert_time,
+                                   alarm_id, alert_index))
+                else:
+                    missed.append((alarm_item, alert_time))
+                scheduled.last_alerts[alert_index] = alert_time
+                self.__queue_alert(scheduled, alert_index, now)
+            if self.__queue:
+                timeout = max(self.__queue[0][0] - now, 0)
+            else:
+                timeout = None
+        return alerts, missed, timeout
@@ -12,16 +12,22 @@
 from __future__ import (unicode_literals, absolute_import, print_function,
     division)
 import sys
-import time
-import random
 import threading
+try:
+    from LightUpAlarm.WakeEvent import WakeEvent
+    from LightUpAlarm.Clock import SystemClock
+except ImportError:
+    from WakeEvent import WakeEvent
+    from Clock import SystemClock
 
 
 class AlarmThread(threading.Thread):
     """
     This thread class contains an instance to an AlarmItem and when it is
-    running checks the time every 5 seconds to determine if the Alarm (or any
-    pre or post alert) should be triggered.
+    running checks the time every second to determine if the Alarm (or any
+    pre or post alert) should be triggered. Between checks it waits on an event
+    instead of sleeping, so stopping the thread or editing its alarm takes
+    effect straight away.
 
     This class does NOT edit the variables from the AlarmItem instance reference
     that it takes as constructor parameter. It does attach a callback function
@@ -34,19 +40,20 @@ class AlarmThread(threading.Thread):
 
     It is for this reason that locks are not required for the AlarmItem data or
     the __run private variable (modifiable by the externally accessible stop()
-    method).
+    method). Both stop() and edit_alarm() only set an event afterwards to wake
+    up the thread.
     """
 
-    # This class variable blocks any alarm thread to execute the callback while
+    # This class lock blocks any alarm thread to execute the callback while
     # it is already running. This is because the callback is most likely to be
     # controlling hardware
-    __alert_running = False
+    __alert_lock = threading.Lock()
 
     #
     # metaclass methods
     #
     def __init__(self, alarm_item, alarm_callback=None, offset_alarm_time=None,
-                 offset_callback=None):
+                 offset_callback=None, clock=None):
         """
         AlarmThread initialiser. Takes an AlarmItem instance, a callback
         function and a pre or post alert time and callback to initialise the
@@ -58,6 +65,8 @@ class AlarmThread(threading.Thread):
                                  Alar.diff_alarm()
         :param offset_callback: If the offset_alarm_time is set, it will
                                 execute this callback on the pre or post alert.
+        :param clock: Clock instance to read the time and sleep. Defaults to
+                      the system clock.
         """
         threading.Thread.__init__(self)
         self.daemon = True
@@ -78,6 +87,14 @@ class AlarmThread(threading.Thread):
             if self.__offset_alarm is not None:
                 self.__offset_flag = True
 
+        # Local date and time of the last alert, for the alarm and its offset,
+        # to not execute the callbacks more than once per minute, even when a
+        # minute is repeated because the clock goes back for daylight saving
+        self.__last_alert = None
+        self.__last_offset_alert = None
+
+        self.__clock = clock if clock is not None else SystemClock()
+        self.__wake_event = WakeEvent()
         self.__run = True
 
     #
@@ -86,51 +103,55 @@ class AlarmThread(threading.Thread):
     def run(self):
         """
         Infinite loop function to run until it is stopped by calling the stop()
-        method. It sleeps for 1 second between iterations.
+        method. It waits for up to 1 second between iterations.
         At each iteration it first determines if the alarm is enabled and set to
         trigger any day, if so it then checks if this time is the alarm time.
         """
-        while self.__run:
-            # Only check for the time if the Alarm is active
-            if self.__alarm.is_active() is True:
-                time_now = time.localtime(time.time())
-                alert_triggered = False
-
-                # Check if it is the alarm time
-                if (self.__alarm.repeat[time_now.tm_wday] is True) and \
-                        (self.__alarm.hour == time_now.tm_hour) and \
-                        (self.__alarm.minute == time_now.tm_min):
-                    self.alarm_alert(self.__alarm, self.__alarm_callback)
-                    alert_triggered = True
-
-                if self.__offset_flag is True:
-                    # Sync and check if it is the pre/post alert time
-                    self.sync_offset_alarm()
-                    if (self.__offset_alarm.repeat[time_now.tm_wday] is True) \
-                            and (self.__offset_alarm.hour == time_now.tm_hour) \
-                            and (self.__offset_alarm.minute == time_now.tm_min):
-                        self.alarm_alert(
-                            self.__offset_alarm, self.__offset_callback)
-                        alert_triggered = True
-
-                if alert_triggered:
-                    # Wait for the current minute to be over, in order to not
-                    # execute the callback/s more than once
-                    time_to_elapse = time_now
-                    while (time_to_elapse.tm_hour == time_now.tm_hour) and \
-                          (time_to_elapse.tm_min == time_now.tm_min):
-                        time.sleep(1)
-                        time_now = time.localtime(time.time())
-
-            # Now just sleep for 5 seconds before checking again
-            time.sleep(1)
+        try:
+            while self.__run:
+                # Only check for the time if the Alarm is active
+                if self.__alarm.is_active() is True:
+                    self.__check_alerts(self.__clock.time())
+                if self.__run:
+                    self.__clock.wait(self.__wake_event, 1)
+        finally:
+            self.__wake_event.close()
 
     def stop(self):
         """
         Stops the infinite loop in run method and causes the thread to exit once
-        the current operation finishes.
+        the current operation finishes, without waiting for the next check.
         """
         self.__run = False
+        self.__wake_event.set()
+
+    def __check_alerts(self, now):
+        """
+        Triggers the alarm and offset alarm alerts if it is their alert time
+        and they have not been triggered already during this minute.
+        :param now: Current time in seconds since 1970.
+        """
+        time_now = self.__clock.localtime(now)
+        local_minute = (time_now.tm_year, time_now.tm_yday, time_now.tm_hour,
+                        time_now.tm_min)
+
+        # Check if it is the alarm time
+        if (self.__last_alert != local_minute) and \
+                (self.__alarm.repeat[time_now.tm_wday] is True) and \
+                (self.__alarm.hour == time_now.tm_hour) and \
+                (self.__alarm.minute == time_now.tm_min):
+            self.__last_alert = local_minute
+            self.alarm_alert(self.__alarm, self.__alarm_callback)
+
+        if self.__offset_flag is True:
+            # Sync and check if it is the pre/post alert time
+            self.sync_offset_alarm()
+            if (self.__last_offset_alert != local_minute) and \
+                    (self.__offset_alarm.repeat[time_now.tm_wday] is True) \
+                    and (self.__offset_alarm.hour == time_now.tm_hour) \
+                    and (self.__offset_alarm.minute == time_now.tm_min):
+                self.__last_offset_alert = local_minute
+                self.alarm_alert(self.__offset_alarm, self.__offset_callback)
 
     #
     # member methods
@@ -158,6 +179,8 @@ class AlarmThread(threading.Thread):
             if self.__offset_flag is True:
                 self.__offset_alarm = \
                     self.__alarm.diff_alarm(self.__offset_time)
+            # Check the new alarm data without waiting for the next check
+            self.__wake_event.set()
             success = True
         else:
             print('ERROR: Provided AlarmItem is not correct for this thread.\n'
@@ -185,20 +208,12 @@ class AlarmThread(threading.Thread):
     def alarm_alert(cls, alarm_item, callback):
         """
         This method is executed when the alarm alert is raised.
-        It executes the callback indicated on AlertThread constructor.
+        It executes the callback indicated on AlertThread constructor. Alerts
+        from different threads are executed one at a time.
         """
-        # Try to block reentry
-        while cls.__alert_running is True:
-            time.sleep(float(random.randint(1, 100)) / 1000.0)
-        # Now should be safe to execute
-        cls.__alert_running = True
-
-        try:
+        with cls.__alert_lock:
             # run AlertManager callback event
             print('\nALERT for the Alarm %s, with label:"%s" !!!' %
                   (alarm_item.id_, alarm_item.label))
             if callback is not None:
                 callback()
-        finally:
-            # Unblock
-            cls.__alert_running = False
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Clock classes used by the alarm classes to read the time and to sleep.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# The alarm classes take an optional clock argument, and use the SystemClock
+# by default. The SimulatedClock only moves forward when it is advanced, so it
+# can be used to test or replay the alarm schedules without waiting for them.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import time
+import threading
+
+
+class SystemClock(object):
+    """
+    Clock with the real system time. It has no state, so the same instance can
+    be shared by all the alarm classes.
+    """
+
+    @staticmethod
+    def time():
+        """
+        :return: Current time, in seconds since 1970.
+        """
+        return time.time()
+
+    def localtime(self, seconds=None):
+        """
+        :param seconds: Time, in seconds since 1970, to convert. Defaults to
+                        the current time.
+        :return: time.struct_time with the local time.
+        """
+        if seconds is None:
+            seconds = self.time()
+        return time.localtime(seconds)
+
+    @staticmethod
+    def mktime(local_time):
+        """
+        :param local_time: time.struct_time or 9-tuple with a local time. Use
+                           -1 as the DST flag to let the time zone decide it.
+        :return: Time, in seconds since 1970, of the local time.
+        """
+        return time.mktime(local_time)
+
+    @staticmethod
+    def sleep(seconds):
+        """
+        Sleeps the calling thread.
+        :param seconds: Time to sleep, in seconds.
+        """
+        time.sleep(seconds)
+
+    @staticmethod
+    def wait(wake_event, timeout=None):
+        """
+        Sleeps until a WakeEvent is set or the timeout elapses.
+        :param wake_event: WakeEvent to wait on.
+        :param timeout: Maximum time to sleep, in seconds. None to sleep until
+                        the event is set.
+        """
+        wake_event.wait(timeout)
+
+
+class SimulatedClock(SystemClock):
+    """
+    Clock with a simulated time, which only changes when it is advanced or set
+    by calling advance() or set_time(). Threads sleeping or waiting on this
+    clock are woken up once the simulated time reaches their wake up time.
+    The local time conversions use the system time zone.
+    """
+
+    #
+    # metaclass methods
+    #
+    def __init__(self, start_time=None):
+        """
+        SimulatedClock initialiser.
+        :param start_time: Initial simulated time, in seconds since 1970.
+                           Defaults to the current system time.
+        """
+        if start_time is None:
+            start_time = time.time()
+        self.__now = float(start_time)
+        self.__lock = threading.Lock()
+        self.__condition = threading.Condition(self.__lock)
+        # Dictionary with the WakeEvents being waited on, and their wake up time
+        self.__waiters = {}
+
+    #
+    # clock methods
+    #
+    def time(self):
+        """
+        :return: Current simulated time, in seconds since 1970.
+        """
+        with self.__lock:
+            return self.__now
+
+    def sleep(self, seconds):
+        """
+        Sleeps the calling thread until the simulated time has advanced the
+        given number of seconds.
+        :param seconds: Time to sleep, in seconds.
+        """
+        with self.__condition:
+            wake_time = self.__now + seconds
+            while self.__now < wake_time:
+                self.__condition.wait()
+
+    def wait(self, wake_event, timeout=None):
+        """
+        Sleeps until a WakeEvent is set or the simulated time has advanced
+        past the timeout.
+        :param wake_event: WakeEvent to wait on.
+        :param timeout: Maximum time to sleep, in simulated seconds. None to
+                        sleep until the event is set.
+        """
+        if timeout is not None:
+            with self.__lock:
+                if timeout <= 0:
+                    wake_event.set()
+                else:
+                    self.__waiters[wake_event] = self.__now + timeout
+        try:
+            wake_event.wait()
+        finally:
+            with self.__lock:
+                self.__waiters.pop(wake_event, None)
+
+    #
+    # simulation control methods
+    #
+    def advance(self, seconds):
+        """
+        Advances the simulated time and wakes up the threads sleeping until
+        then.
+        :param seconds: Time to advance, in seconds.
+        """
+        with self.__lock:
+            new_time = self.__now + seconds
+        self.set_time(new_time)
+
+    def set_time(self, new_time):
+        """
+        Sets the simulated time, which can go backwards to simulate a system
+        clock change, and wakes up the threads sleeping until then.
+        :param new_time: New simulated time, in seconds since 1970.
+        """
+        with self.__condition:
+            self.__now = float(new_time)
+            for wake_event, wake_time in list(self.__waiters.items()):
+                if wake_time <= self.__now:
+                    del self.__waiters[wake_event]
+                    wake_event.set()
+            self.__condition.notify_all()
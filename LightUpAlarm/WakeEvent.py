@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Class for a thread to sleep until a timeout or until it is woken up.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import os
+import select
+import threading
+try:
+    import fcntl
+except ImportError:
+    # Not a POSIX system, the pipe is not used
+    fcntl = None
+
+
+class WakeEvent(object):
+    """
+    Similar to threading.Event, a thread can wait on a WakeEvent until another
+    thread sets it, or until the timeout elapses. The event is cleared every
+    time a wait returns, so each set() wakes up the waiting thread once.
+
+    In Python 2 a Condition or Event wait with a timeout polls in intervals of
+    up to 50 ms, so on POSIX systems the thread waits on a pipe with select,
+    which returns as soon as another thread writes into it. The pipe is only
+    opened on the first wait, and it must be closed with close() by the waiting
+    thread once it no longer needs it.
+    """
+
+    #
+    # metaclass methods
+    #
+    def __init__(self):
+        """ WakeEvent initialiser. The event starts cleared. """
+        self.__lock = threading.Lock()
+        self.__condition = threading.Condition(self.__lock)
+        self.__flag = False
+        self.__pipe = None
+        self.__closed = False
+
+    #
+    # member methods
+    #
+    def set(self):
+        """ Sets the event, waking up the thread waiting on it. """
+        with self.__lock:
+            self.__flag = True
+            if self.__pipe is not None:
+                try:
+                    os.write(self.__pipe[1], b'x')
+                except OSError:
+                    # The pipe is full, so the thread will wake up anyway
+                    pass
+            else:
+                self.__condition.notify()
+
+    def wait(self, timeout=None):
+        """
+        Sleeps until the event is set or the timeout elapses, and clears the
+        event.
+        :param timeout: Maximum time to sleep, in seconds. None to sleep until
+                        the event is set.
+        :return: Boolean indicating if the event was set.
+        """
+        with self.__lock:
+            read_fd = None
+            if self.__flag is False:
+                if fcntl is not None and self.__closed is False and \
+                        self.__pipe is None:
+                    self.__pipe = os.pipe()
+                    # Writes must not block if the pipe is full of wake ups
+                    fcntl.fcntl(self.__pipe[1], fcntl.F_SETFL, os.O_NONBLOCK)
+                if self.__pipe is None:
+                    self.__condition.wait(timeout)
+                else:
+                    read_fd = self.__pipe[0]
+
+        if read_fd is not None:
+            readable = select.select([read_fd], [], [], timeout)[0]
+            if readable:
+                os.read(read_fd, 4096)
+
+        with self.__lock:
+            flag = self.__flag
+            self.__flag = False
+            return flag
+
+    def close(self):
+        """
+        Releases the pipe used to wait on the event. Only to be called from the
+        waiting thread, once it will not wait any longer. Any later wait falls
+        back to the polling Condition.
+        """
+        with self.__lock:
+            self.__closed = True
+            if self.__pipe is not None:
+                os.close(self.__pipe[0])
+                os.close(self.__pipe[1])
+                self.__pipe = None
@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Benchmark for the AlarmDb class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Measures the per-call latency of retrieving an alarm from the database. The
+# 'fresh connection' figure reproduces the previous behaviour, where every call
+# connected to the database from scratch with dataset.connect().
+#
+# It also compares creating an AlarmDb instance for every call, as the
+# AlarmManager used to do, with the settings check its constructor used to run
+# each time, against reusing a single long-lived AlarmDb instance.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import timeit
+import dataset
+try:
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmItem import AlarmItem
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmItem import AlarmItem
+
+
+# Database name to be used for the benchmark
+db_name = 'AlarmDb_benchmark_db'
+
+
+def print_result(name, total_seconds, iterations):
+    print('%-40s %10.3f ms/call' % (name, total_seconds * 1000 / iterations))
+
+
+def benchmark_get_alarm(iterations=200):
+    """
+    Compares the latency of AlarmDb.get_alarm() against the same query done
+    over a freshly created database connection.
+    """
+    alarm_db = AlarmDb(db_name)
+    alarm_db.delete_all_alarms()
+    alarm_id = alarm_db.add_alarm(AlarmItem(
+        8, 30, days=(True, True, True, True, True, False, False)))
+
+    def fresh_connection():
+        alarms_table = dataset.connect(alarm_db.db_file)['alarms']
+        alarms_table.find_one(id=alarm_id)
+
+    def shared_connection():
+        alarm_db.get_alarm(alarm_id)
+
+    def new_instance():
+        AlarmDb(db_name).get_alarm(alarm_id)
+
+    print('AlarmDb get_alarm latency (%s iterations):' % iterations)
+    print_result('Fresh connection per call',
+                 timeit.timeit(fresh_connection, number=iterations),
+                 iterations)
+    print_result('Shared connection pool',
+                 timeit.timeit(shared_connection, number=iterations),
+                 iterations)
+    print_result('New AlarmDb instance + shared pool',
+                 timeit.timeit(new_instance, number=iterations),
+                 iterations)
+
+
+def benchmark_instances(iterations=200):
+    """
+    Compares the latency of AlarmDb.get_alarm() from a new AlarmDb instance
+    per call, with and without the constructor settings check, against a
+    single reused instance.
+    """
+    alarm_db = AlarmDb(db_name)
+    alarm_db.delete_all_alarms()
+    alarm_id = alarm_db.add_alarm(AlarmItem(
+        8, 30, days=(True, True, True, True, True, False, False)))
+
+    def settings_check_instance():
+        new_db = AlarmDb(db_name)
+        new_db.open()['settings'].all().count
+        new_db.get_alarm(alarm_id)
+
+    def new_instance():
+        AlarmDb(db_name).get_alarm(alarm_id)
+
+    def reused_instance():
+        alarm_db.get_alarm(alarm_id)
+
+    print('AlarmDb instance per call (%s iterations):' % iterations)
+    print_result('New instance + settings check',
+                 timeit.timeit(settings_check_instance, number=iterations),
+                 iterations)
+    print_result('New instance',
+                 timeit.timeit(new_instance, number=iterations),
+                 iterations)
+    print_result('Reused instance',
+                 timeit.timeit(reused_instance, number=iterations),
+                 iterations)
+
+
+if __name__ == '__main__':
+    benchmark_get_alarm()
+    benchmark_instances()
@@ -7,11 +7,14 @@
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
 from __future__ import unicode_literals, absolute_import
+import io
 import unittest
 import mock
 import time
 import json
 import os
+import sqlite3
+import threading
 try:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
@@ -63,7 +66,8 @@ class AlarmDbTestCase(unittest.TestCase):
         file has been created.
         """
         db_file = '%s.db' % self.db_name
-        # Ensure the file is not there
+        # Ensure the file is not there, closing any shared connection first
+        AlarmDb(self.db_name).close()
         if os.path.isfile(db_file):
             os.remove(db_file)
         self.assertFalse(os.path.isfile(db_file))
@@ -71,6 +75,55 @@ class AlarmDbTestCase(unittest.TestCase):
         adh._AlarmDb__connect_alarms()
         self.assertTrue(os.path.isfile(db_file))
 
+    def test_open_close(self):
+        """
+        Checks that AlarmDb instances for the same file share a single opened
+        database, and that it is reopened after being closed.
+        """
+        adh_one = AlarmDb(self.db_name)
+        adh_two = AlarmDb(self.db_name)
+        database = adh_one.open()
+        self.assertIs(database, adh_two.open())
+
+        self.assertTrue(adh_two.close())
+        self.assertFalse(adh_one.close())
+        new_database = adh_one.open()
+        self.assertIsNot(database, new_database)
+        self.assertIs(new_database, adh_two.open())
+        # The reopened database has to be fully functional
+        self.only_five_entries(adh_two)
+        self.assertEqual(adh_one.get_number_of_alarms(), 5)
+
+    def test_settings_check_once(self):
+        """
+        Checks the default settings are added when the database is opened,
+        and not checked again by the AlarmDb instances created afterwards.
+        """
+        adh = AlarmDb(self.db_name)
+        adh.close()
+        adh.open()['settings'].delete()
+        self.assertEqual(len(AlarmDb(self.db_name).open()['settings']), 0)
+        # Reopening the database adds the default settings
+        adh.close()
+        self.assertEqual(AlarmDb(self.db_name).get_snooze_time(), 3)
+        self.assertEqual(adh.get_offset_alert_time(), -15)
+
+    def test_threads_share_database(self):
+        """ Reads alarms from several threads using the same database. """
+        adh = AlarmDb(self.db_name)
+        self.only_five_entries(adh)
+        results = []
+
+        def read_alarms():
+            results.append(len(AlarmDb(self.db_name).get_all_alarms()))
+
+        threads = [threading.Thread(target=read_alarms) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [5] * 10)
+
     @mock.patch('time.time')
     def test_entry(self, mock_time):
         """ Adds an entry to the database and deletes it. """
@@ -179,6 +232,24 @@ class AlarmDbTestCase(unittest.TestCase):
         delete_success = adh.delete_all_alarms()
         self.assertTrue(delete_success)
 
+    def test_get_alarms(self):
+        """ Tests getting several alarms by ID with a single query. """
+        adh = AlarmDb(self.db_name)
+        self.only_five_entries(adh)
+        retrieved_alarms = adh.get_alarms([4, 2, 9, 2])
+        self.assertEqual([alarm.id_ for alarm in retrieved_alarms], [2, 4])
+        self.assertEqual(retrieved_alarms[0].hour, 14)
+        self.assertEqual(retrieved_alarms[1].minute, 38)
+        self.assertEqual(adh.get_alarms([]), [])
+
+        # More IDs than the number of parameters SQLite allows per query
+        alarm_ids = adh.add_alarms(
+            [AlarmItem(i % 24, i % 60, enabled=False) for i in range(1200)])
+        retrieved_alarms = adh.get_alarms(alarm_ids)
+        self.assertEqual([alarm.id_ for alarm in retrieved_alarms],
+                         sorted(alarm_ids))
+        adh.delete_all_alarms()
+
     def test_empty_table_zero_alarms(self):
         """ Check that an empty table returns a 0 length list of items """
         adh = AlarmDb(self.db_name)
@@ -210,6 +281,263 @@ class AlarmDbTestCase(unittest.TestCase):
         self.assertEqual(len(enabled_alarms), 3)
         self.assertEqual(len(disabled_alarms), 2)
 
+    def test_get_all_active_alarms(self):
+        """
+        Adds alarms with all combinations of enabled and repeat days, and
+        checks only the active ones are retrieved.
+        """
+        no_days = (False, False, False, False, False, False, False)
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        adh.add_alarm(
+            AlarmItem(13, 35, days=self.random_days, enabled=True))   # id 1
+        adh.add_alarm(
+            AlarmItem(14, 36, days=self.random_days, enabled=False))  # id 2
+        adh.add_alarm(AlarmItem(15, 37, days=no_days, enabled=True))  # id 3
+        adh.add_alarm(AlarmItem(16, 38, days=no_days, enabled=False))  # id 4
+        adh.add_alarm(
+            AlarmItem(17, 39, days=self.random_days, enabled=True))   # id 5
+        active_alarms = adh.get_all_active_alarms()
+        self.assertEqual([alarm.id_ for alarm in active_alarms], [1, 5])
+        for alarm in active_alarms:
+            self.assertEqual(alarm.repeat, self.random_days)
+
+    def test_schema_migration(self):
+        """
+        Creates a database with the previous schema, a boolean column per
+        weekday, and checks it is migrated into the repeat_mask column.
+        """
+        db_name = '%s_legacy' % self.db_name
+        db_file = '%s.db' % db_name
+        AlarmDb(db_name).close()
+        if os.path.isfile(db_file):
+            os.remove(db_file)
+        connection = sqlite3.connect(db_file)
+        connection.execute(
+            'CREATE TABLE alarms (id INTEGER NOT NULL PRIMARY KEY, '
+            'hour INTEGER, minute INTEGER, monday BOOLEAN, tuesday BOOLEAN, '
+            'wednesday BOOLEAN, thursday BOOLEAN, friday BOOLEAN, '
+            'saturday BOOLEAN, sunday BOOLEAN, enabled BOOLEAN, label TEXT, '
+            'timestamp INTEGER)')
+        connection.execute(
+            'INSERT INTO alarms VALUES (1, 7, 30, 1, 1, 1, 1, 1, 0, 0, 1, '
+            '"work", 12341234)')
+        connection.execute(
+            'INSERT INTO alarms VALUES (2, 10, 0, 0, 0, 0, 0, 0, 1, 1, 0, '
+            '"weekend", 12345678)')
+        connection.commit()
+        connection.close()
+
+        adh = AlarmDb(db_name)
+        alarm = adh.get_alarm(1)
+        self.assertEqual(alarm.repeat_mask, 0b0011111)
+        self.assertEqual(
+            (alarm.hour, alarm.minute, alarm.enabled), (7, 30, True))
+        self.assertEqual((alarm.label, alarm.timestamp), ('work', 12341234))
+        alarm = adh.get_alarm(2)
+        self.assertEqual(alarm.repeat_mask, 0b1100000)
+        self.assertEqual(
+            (alarm.hour, alarm.minute, alarm.enabled), (10, 0, False))
+        self.assertEqual((alarm.label, alarm.timestamp), ('weekend', 12345678))
+        self.assertEqual([a.id_ for a in adh.get_all_active_alarms()], [1])
+        # New alarms continue after the migrated IDs
+        self.assertEqual(adh.add_alarm(AlarmItem(8, 0)), 3)
+        adh.close()
+        os.remove(db_file)
+
+    def test_sync_schema_migration(self):
+        """
+        Creates a database without the synchronisation columns and checks the
+        alarms get an uid and are included in the changes since revision 0.
+        """
+        db_name = '%s_nosync' % self.db_name
+        db_file = '%s.db' % db_name
+        AlarmDb(db_name).close()
+        if os.path.isfile(db_file):
+            os.remove(db_file)
+        connection = sqlite3.connect(db_file)
+        connection.execute(
+            'CREATE TABLE alarms (id INTEGER NOT NULL PRIMARY KEY, '
+            'hour INTEGER, minute INTEGER, repeat_mask INTEGER, '
+            'enabled BOOLEAN, label TEXT, timestamp BIGINT)')
+        connection.execute(
+            'INSERT INTO alarms VALUES (1, 7, 30, 31, 1, "work", 12341234)')
+        connection.commit()
+        connection.close()
+
+        adh = AlarmDb(db_name)
+        self.assertEqual(adh.get_revision(), 1)
+        revision, alarms, deleted, _ = adh.get_changes(0)
+        self.assertEqual(revision, 1)
+        self.assertEqual(len(alarms), 1)
+        self.assertEqual(len(alarms[0][0]), 32)
+        self.assertEqual((alarms[0][1].id_, alarms[0][1].label), (1, 'work'))
+        self.assertEqual(deleted, [])
+        self.assertTrue(adh.delete_alarm(1))
+        self.assertEqual(adh.get_changes(revision)[2][0][0], alarms[0][0])
+        adh.close()
+        os.remove(db_file)
+
+    def test_get_changes(self):
+        """ Tests the revision and changes of the added, edited and deleted
+        alarms. """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        revision = adh.get_revision()
+        id_1 = adh.add_alarm(AlarmItem(7, 0, label='one'))
+        id_2 = adh.add_alarm(AlarmItem(8, 0, label='two'))
+        self.assertEqual(adh.get_revision(), revision + 2)
+        new_revision, alarms, deleted, _ = adh.get_changes(revision)
+        self.assertEqual(new_revision, revision + 2)
+        self.assertEqual([alarm.id_ for _, alarm in alarms], [id_1, id_2])
+        self.assertNotEqual(alarms[0][0], alarms[1][0])
+        self.assertEqual(deleted, [])
+        uid_2 = alarms[1][0]
+
+        # Reading or editing without changes does not change the revision
+        revision = new_revision
+        adh.get_all_alarms()
+        adh.edit_alarm(id_1, label='one')
+        self.assertFalse(adh.delete_alarm(99))
+        self.assertEqual(adh.get_revision(), revision)
+
+        adh.edit_alarm(id_1, hour=5)
+        self.assertTrue(adh.delete_alarm(id_2))
+        new_revision, alarms, deleted, _ = adh.get_changes(revision)
+        self.assertEqual(new_revision, revision + 2)
+        self.assertEqual([(alarm.id_, alarm.hour) for _, alarm in alarms],
+                         [(id_1, 5)])
+        self.assertEqual([uid for uid, _ in deleted], [uid_2])
+        self.assertEqual(adh.get_changes(new_revision),
+                         (new_revision, [], [], False))
+
+        # Deleting all the alarms leaves a tombstone for each one
+        self.assertTrue(adh.delete_all_alarms())
+        self.assertEqual(len(adh.get_changes(new_revision)[2]), 1)
+        self.assertEqual(len(adh.get_changes(revision)[2]), 2)
+
+    def test_tombstone_retention(self):
+        """ Tests the old tombstones are removed, and that synchronising from
+        a revision older than the kept tombstones is a full synchronisation,
+        which replaces all the alarms of the other system. """
+        def changes(since):
+            revision, alarms, deleted, full = adh.get_changes(since)
+            return (revision, [uid for uid, _ in alarms],
+                    [uid for uid, _ in deleted], full)
+
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        remote = AlarmDb('%s_remote' % self.db_name)
+        remote.delete_all_alarms()
+        with mock.patch.object(AlarmDb, 'tombstone_retention', 3):
+            ids = [adh.add_alarm(AlarmItem(7, minute)) for minute in range(3)]
+            revision = adh.get_revision()
+            uids = changes(revision - 3)[1]
+            kept_id = adh.add_alarm(AlarmItem(8, 0))
+            # The remote system is synchronised before the deletions
+            remote.apply_changes(*adh.get_changes(0)[1:])
+            remote.add_alarm(AlarmItem(9, 0))
+            self.assertTrue(adh.delete_alarm(ids[0]))
+            self.assertTrue(adh.delete_alarm(ids[1]))
+            self.assertEqual(adh.apply_changes(deleted=[('retention', 10)]),
+                             ([], [], []))
+            self.assertEqual(changes(revision + 1)[2:],
+                             ([uids[0], uids[1], 'retention'], False))
+
+            # The first deletion is 3 revisions old after the next change
+            self.assertTrue(adh.delete_alarm(ids[2]))
+            self.assertEqual(adh.get_revision(), revision + 5)
+            self.assertEqual(changes(0)[2], [uids[1], 'retention', uids[2]])
+
+            # Older revisions get all the alarms and the kept tombstones
+            self.assertEqual(changes(revision + 2),
+                             (revision + 5, [], changes(0)[2], False))
+            self.assertEqual(changes(revision + 1)[:3], changes(0)[:3])
+            self.assertEqual(changes(revision + 1)[3], True)
+            self.assertEqual(changes(0)[3], False)
+
+            # A full synchronisation removes the alarms not included, even
+            # without a tombstone, as the one of the first deletion
+            _, alarms, deleted, full = adh.get_changes(revision)
+            self.assertTrue(full)
+            self.assertEqual([alarm.id_ for _, alarm in alarms], [kept_id])
+            remote.apply_changes(alarms, deleted, full)
+            self.assertEqual(
+                [uid for uid, _ in remote.get_changes(0)[1]],
+                [uid for uid, _ in alarms])
+            self.assertEqual(remote.get_number_of_alarms(), 1)
+        adh.delete_all_alarms()
+        remote.close()
+        os.remove('%s_remote.db' % self.db_name)
+
+    @mock.patch('time.time')
+    def test_apply_changes(self, mock_time):
+        """ Tests synchronising the alarms between two databases. """
+        mock_time.return_value = 1000
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        remote = AlarmDb('%s_remote' % self.db_name)
+        remote.delete_all_alarms()
+        remote_id = remote.add_alarm(AlarmItem(7, 0, label='remote'))
+
+        _, alarms, deleted, _ = remote.get_changes(0)
+        uid = alarms[0][0]
+        added, edited, deleted_ids = adh.apply_changes(alarms, deleted)
+        self.assertEqual((len(added), edited, deleted_ids), (1, [], []))
+        local_id = added[0].id_
+        local_alarm = adh.get_alarm(local_id)
+        self.assertEqual((local_alarm.label, local_alarm.timestamp),
+                         ('remote', 1000))
+        self.assertEqual(adh.get_changes(0)[1][0][0], uid)
+
+        # Applying the same changes again does not change anything
+        revision = adh.get_revision()
+        self.assertEqual(adh.apply_changes(alarms, deleted), ([], [], []))
+        self.assertEqual(adh.get_revision(), revision)
+
+        # The newest change wins, in both directions
+        mock_time.return_value = 2000
+        adh.edit_alarm(local_id, label='local')
+        mock_time.return_value = 1500
+        remote.edit_alarm(remote_id, label='older')
+        self.assertEqual(adh.apply_changes(*remote.get_changes(0)[1:]),
+                         ([], [], []))
+        self.assertEqual(adh.get_alarm(local_id).label, 'local')
+        added, edited, deleted_ids = \
+            remote.apply_changes(*adh.get_changes(0)[1:])
+        self.assertEqual([alarm.id_ for alarm in edited], [remote_id])
+        remote_alarm = remote.get_alarm(remote_id)
+        self.assertEqual((remote_alarm.label, remote_alarm.timestamp),
+                         ('local', 2000))
+
+        # Deletions are applied, and win against changes as old as them
+        mock_time.return_value = 3000
+        remote.delete_alarm(remote_id)
+        self.assertEqual(adh.apply_changes(*remote.get_changes(0)[1:]),
+                         ([], [], [local_id]))
+        self.assertIsNone(adh.get_alarm(local_id))
+        self.assertEqual(
+            adh.apply_changes([(uid, AlarmItem(7, 0, timestamp=3000))]),
+            ([], [], []))
+        added, _, _ = adh.apply_changes(
+            [(uid, AlarmItem(9, 0, timestamp=3001))])
+        self.assertEqual(added[0].hour, 9)
+        self.assertNotIn(uid, [tomb_uid for tomb_uid, _ in
+                               adh.get_changes(0)[2]])
+
+        # Deletions of unknown alarms are kept, to be passed on
+        revision = adh.get_revision()
+        self.assertEqual(adh.apply_changes(deleted=[('unknown', 10)]),
+                         ([], [], []))
+        self.assertEqual(adh.get_changes(revision)[2], [('unknown', 10)])
+
+        # Invalid data is not applied
+        self.assertIsNone(adh.apply_changes([(uid, None)]))
+        self.assertIsNone(adh.apply_changes(deleted=[(uid, 'now')]))
+        remote_file = '%s_remote.db' % self.db_name
+        remote.close()
+        os.remove(remote_file)
+
     def test_edit_alarm(self):
         """ Creates an alarm and edits it. """
         adh = AlarmDb(self.db_name)
@@ -226,11 +554,15 @@ class AlarmDbTestCase(unittest.TestCase):
         # Edit alarm, check new data and different timestamp
         original_timestamp = alarm_test.timestamp
         time.sleep(1)
-        edit_success = adh.edit_alarm(
+        returned_alarm = adh.edit_alarm(
             alarm_test.id_, 11, 22, enabled=False, label='New label',
             days=(True, True, True, True, True, True, True))
-        self.assertEqual(edit_success, True)
+        self.assertIsInstance(returned_alarm, AlarmItem)
         edited_alarm = adh.get_alarm(alarm_test.id_)
+        # The returned alarm has to contain the same data as the db row
+        self.assertEqual(str(returned_alarm), str(edited_alarm))
+        self.assertEqual(returned_alarm.label, edited_alarm.label)
+        self.assertEqual(returned_alarm.timestamp, edited_alarm.timestamp)
         self.assertGreater(edited_alarm.timestamp, original_timestamp)
         self.assertEqual(edited_alarm.hour, 11)
         self.assertEqual(edited_alarm.minute, 22)
@@ -298,6 +630,50 @@ class AlarmDbTestCase(unittest.TestCase):
         self.assertFalse(edited_alarm.enabled)
         self.assertEqual(edited_alarm.label, 'no')
 
+    def test_edit_alarm_invalid(self):
+        """
+        Edits an alarm with a mix of valid and invalid data and checks that
+        nothing is written, and edits a non-existent alarm.
+        """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        alarm_test = AlarmItem(
+            13, 35, days=self.random_days, enabled=True, label='original')
+        alarm_test.id_ = adh.add_alarm(alarm_test)
+
+        with mock.patch('sys.stderr', new=io.StringIO()):
+            edit_result = adh.edit_alarm(
+                alarm_test.id_, hour=11, minute=75, label='New label')
+        self.assertIsNone(edit_result)
+        retrieved_alarm = adh.get_alarm(alarm_test.id_)
+        self.assertEqual(retrieved_alarm.hour, 13)
+        self.assertEqual(retrieved_alarm.minute, 35)
+        self.assertEqual(retrieved_alarm.label, 'original')
+        self.assertEqual(retrieved_alarm.timestamp, alarm_test.timestamp)
+
+        # The alarm with ID 99 does not exists
+        self.assertIsNone(adh.edit_alarm(99, hour=11))
+
+    @mock.patch('time.time')
+    def test_edit_alarm_no_changes(self, mock_time):
+        """ Edits an alarm with its current data, timestamp is unchanged. """
+        mock_time.return_value = 12341234
+        adh = AlarmDb(self.db_name)
+        alarm_test = AlarmItem(13, 35, days=self.random_days, label='same')
+        alarm_test.id_ = adh.add_alarm(alarm_test)
+
+        mock_time.return_value = 12349999
+        edited_alarm = adh.edit_alarm(
+            alarm_test.id_, hour=13, minute=35, days=self.random_days,
+            enabled=True, label='same')
+        self.assertEqual(edited_alarm.timestamp, 12341234)
+        self.assertEqual(adh.get_alarm(alarm_test.id_).timestamp, 12341234)
+
+        edited_alarm = adh.edit_alarm(alarm_test.id_, hour=14, minute=35)
+        self.assertEqual(edited_alarm.hour, 14)
+        self.assertEqual(edited_alarm.timestamp, 12349999)
+        self.assertEqual(adh.get_alarm(alarm_test.id_).timestamp, 12349999)
+
     def test_update_alarm(self):
         """ Creates an alarm and update it. """
         adh = AlarmDb(self.db_name)
@@ -338,6 +714,80 @@ class AlarmDbTestCase(unittest.TestCase):
         self.assertEqual(retrieved_alarm.timestamp, alarm_updated.timestamp)
         self.assertGreater(retrieved_alarm.timestamp, original_timestamp)
 
+    def test_bulk_alarms(self):
+        """ Adds, updates and deletes several alarms at once. """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        alarms = [AlarmItem(i, i, days=self.random_days, label='%s' % i)
+                  for i in range(10)]
+        alarm_ids = adh.add_alarms(alarms)
+        self.assertEqual(len(alarm_ids), 10)
+        self.assertEqual(adh.get_number_of_alarms(), 10)
+        for alarm, alarm_id in zip(alarms, alarm_ids):
+            self.assertIsNotNone(alarm.timestamp)
+            self.assertEqual(adh.get_alarm(alarm_id).label, alarm.label)
+            alarm.id_ = alarm_id
+
+        # Invalid items should not add anything
+        with mock.patch('sys.stderr', new=io.StringIO()):
+            self.assertIsNone(adh.add_alarms([AlarmItem(1, 1), 'alarm']))
+        self.assertEqual(adh.get_number_of_alarms(), 10)
+
+        # Update them all, with one of them not in the db
+        for alarm in alarms:
+            alarm.enabled = False
+        missing_alarm = AlarmItem(3, 3, alarm_id=99)
+        self.assertFalse(adh.update_alarms(alarms + [missing_alarm]))
+        self.assertEqual(len(adh.get_all_enabled_alarms()), 10)
+        self.assertTrue(adh.update_alarms(alarms))
+        self.assertEqual(len(adh.get_all_disabled_alarms()), 10)
+
+        # Delete half of them
+        self.assertTrue(adh.delete_alarms(alarm_ids[:5]))
+        self.assertEqual(adh.get_number_of_alarms(), 5)
+        self.assertIsNone(adh.get_alarm(alarm_ids[0]))
+        self.assertIsNotNone(adh.get_alarm(alarm_ids[5]))
+        self.assertFalse(adh.delete_alarms(alarm_ids[:5]))
+        self.assertFalse(adh.delete_alarms([]))
+
+    def test_apply_operations(self):
+        """ Adds, edits and deletes alarms in a single transaction. """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        id_1 = adh.add_alarm(AlarmItem(7, 0, label='one'))
+        id_2 = adh.add_alarm(AlarmItem(8, 0, label='two'))
+        revision = adh.get_revision()
+
+        # A failed operation leaves the database unchanged
+        results = adh.apply_operations([
+            ('add', AlarmItem(9, 0, label='three')),
+            ('edit', id_1, {'hour': 6}),
+            ('delete', 99)])
+        self.assertIsNone(results[2])
+        self.assertEqual(adh.get_number_of_alarms(), 2)
+        self.assertEqual(adh.get_alarm(id_1).hour, 7)
+        self.assertEqual(adh.get_revision(), revision)
+        self.assertIsNone(
+            adh.apply_operations([('edit', id_1, {'hour': 24})])[0])
+        with mock.patch('sys.stderr', new=io.StringIO()):
+            self.assertEqual(adh.apply_operations([('move', id_1)]), [None])
+
+        results = adh.apply_operations([
+            ('add', AlarmItem(9, 0, label='three')),
+            ('edit', id_1, {'hour': 6, 'label': 'edited'}),
+            ('delete', id_2)])
+        self.assertEqual(adh.get_alarm(results[0]).label, 'three')
+        self.assertEqual((results[1].id_, results[1].hour, results[1].label),
+                         (id_1, 6, 'edited'))
+        self.assertEqual(adh.get_alarm(id_1).label, 'edited')
+        self.assertTrue(results[2])
+        self.assertIsNone(adh.get_alarm(id_2))
+        # All the operations are saved with the same revision
+        self.assertEqual(adh.get_revision(), revision + 1)
+        _, alarms, deleted, _ = adh.get_changes(revision)
+        self.assertEqual(len(alarms), 2)
+        self.assertEqual(len(deleted), 1)
+
     def test_export_alarms_json(self):
         """
         Tests that the test_export_alarms_json creates a correct json string
@@ -420,6 +870,54 @@ class AlarmDbTestCase(unittest.TestCase):
         self.assertFalse(success)
         self.assertEquals(adh.get_offset_alert_time(), 5)
 
+    def test_snoozes(self):
+        """ Tests saving, replacing and deleting the alarm snoozes. """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_snoozes()
+        self.assertEqual(adh.get_snoozes(), {})
+        self.assertTrue(adh.set_snooze(3, 1000))
+        self.assertTrue(adh.set_snooze(5, 2000.4))
+        self.assertEqual(adh.get_snoozes(), {3: 1000, 5: 2000})
+
+        # Only one snooze per alarm
+        self.assertTrue(adh.set_snooze(3, 1500))
+        self.assertEqual(adh.get_snoozes(), {3: 1500, 5: 2000})
+
+        self.assertTrue(adh.delete_snooze(3))
+        self.assertEqual(adh.get_snoozes(), {5: 2000})
+        self.assertTrue(adh.delete_all_snoozes())
+        self.assertEqual(adh.get_snoozes(), {})
+
+    def test_snoozes_schema_migration(self):
+        """
+        Creates a database with the snoozes table created by dataset, with its
+        own ID column and duplicated snoozes, and checks it is migrated to a
+        single snooze per alarm.
+        """
+        db_name = '%s_legacy_snoozes' % self.db_name
+        db_file = '%s.db' % db_name
+        AlarmDb(db_name).close()
+        if os.path.isfile(db_file):
+            os.remove(db_file)
+        connection = sqlite3.connect(db_file)
+        connection.execute(
+            'CREATE TABLE snoozes (id INTEGER NOT NULL PRIMARY KEY, '
+            'alarm_id INTEGER, alert_time INTEGER)')
+        connection.executemany(
+            'INSERT INTO snoozes VALUES (?, ?, ?)',
+            [(1, 3, 1000), (2, 5, 2000), (3, 3, 1500)])
+        connection.commit()
+        connection.close()
+
+        adh = AlarmDb(db_name)
+        self.assertEqual(adh.get_snoozes(), {3: 1500, 5: 2000})
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_stderr:
+            self.assertTrue(adh.set_snooze(5, 2500))
+            self.assertEqual(test_stderr.getvalue(), '')
+        self.assertEqual(adh.get_snoozes(), {3: 1500, 5: 2500})
+        adh.close()
+        os.remove(db_file)
+
     def test_reset_settings(self):
         """ Test reset settings. """
         adh = AlarmDb(self.db_name)
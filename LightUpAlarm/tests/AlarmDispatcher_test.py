@@ -0,0 +1,223 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the AlarmDispatcher class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import io
+import os
+import time
+import signal
+import mock
+import unittest
+import threading
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+
+
+class AlarmDispatcherTestCase(unittest.TestCase):
+    """ Tests for AlarmDispatcher class. """
+
+    #
+    # Helper methods
+    #
+    def setUp(self):
+        self.alerts = []
+        self.alerts_lock = threading.Lock()
+
+    def record_callback(self, name):
+        """ :return: Callback that records the given name when executed. """
+        def callback():
+            with self.alerts_lock:
+                self.alerts.append(name)
+        return callback
+
+    def wait_for_alerts(self, number, seconds=2):
+        """ Waits until the given number of alerts have been executed. """
+        for _ in range(seconds * 100):
+            if len(self.alerts) >= number:
+                break
+            time.sleep(0.01)
+
+    #
+    # Tests
+    #
+    def test_fifo_order(self):
+        """ Tests the alerts are executed in the same order as dispatched. """
+        dispatcher = AlarmDispatcher(max_workers=1)
+        names = ['alert %s' % i for i in range(20)]
+        for i, name in enumerate(names):
+            self.assertTrue(dispatcher.dispatch(
+                AlarmItem(9, i, alarm_id=i), self.record_callback(name)))
+        self.wait_for_alerts(len(names))
+        self.assertEqual(self.alerts, names)
+        dispatcher.stop()
+
+    def test_duplicated_alerts(self):
+        """
+        Tests that the same alert dispatched more than once in the same minute
+        is only executed once.
+        """
+        dispatcher = AlarmDispatcher()
+        callback = self.record_callback('alert')
+        alarm = AlarmItem(9, 30, alarm_id=1)
+        alert_time = time.mktime((2015, 6, 1, 9, 30, 5, 0, 0, -1))
+        self.assertTrue(dispatcher.dispatch(alarm, callback, alert_time))
+        self.assertFalse(dispatcher.dispatch(alarm, callback, alert_time + 1))
+        # Different callback, alarm data or minute are not duplicated
+        self.assertTrue(dispatcher.dispatch(
+            alarm, self.record_callback('other'), alert_time))
+        self.assertTrue(dispatcher.dispatch(
+            AlarmItem(9, 15, alarm_id=1), callback, alert_time))
+        self.assertTrue(dispatcher.dispatch(alarm, callback, alert_time + 60))
+        self.wait_for_alerts(4)
+        time.sleep(0.05)
+        self.assertEqual(len(self.alerts), 4)
+        dispatcher.stop()
+
+    def test_timeout(self):
+        """ Tests a slow callback does not hold the following alerts. """
+        release = threading.Event()
+        dispatcher = AlarmDispatcher(max_workers=1, timeout=0.1)
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_stderr:
+            dispatcher.dispatch(AlarmItem(9, 30, alarm_id=1), release.wait)
+            start = time.time()
+            dispatcher.dispatch(AlarmItem(9, 31, alarm_id=2),
+                                self.record_callback('second'))
+            self.wait_for_alerts(1)
+            self.assertEqual(self.alerts, ['second'])
+            self.assertLess(time.time() - start, 0.5)
+            self.assertIn('WARNING', test_stderr.getvalue())
+        release.set()
+        dispatcher.stop()
+
+    def test_bounded_workers(self):
+        """
+        Tests that the number of worker threads does not exceed the maximum,
+        and that a callback exception does not stop the workers.
+        """
+        release = threading.Event()
+        dispatcher = AlarmDispatcher(max_workers=3, timeout=None)
+        for alarm_id in range(10):
+            dispatcher.dispatch(AlarmItem(9, alarm_id, alarm_id=alarm_id),
+                                release.wait)
+        self.assertEqual(len(dispatcher.get_workers()), 3)
+        self.assertGreaterEqual(dispatcher.pending_alerts(), 7)
+        release.set()
+
+        def bad_callback():
+            raise ValueError('Bad callback')
+
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_stderr:
+            dispatcher.dispatch(AlarmItem(10, 0, alarm_id=20), bad_callback)
+            dispatcher.dispatch(AlarmItem(10, 1, alarm_id=21),
+                                self.record_callback('after'))
+            self.wait_for_alerts(1)
+            self.assertIn('ValueError', test_stderr.getvalue())
+        self.assertEqual(self.alerts, ['after'])
+
+        # Once stopped no more alerts are accepted and the workers exit
+        dispatcher.stop()
+        self.assertFalse(dispatcher.dispatch(
+            AlarmItem(10, 2, alarm_id=22), self.record_callback('stopped')))
+        for worker in dispatcher.get_workers():
+            worker.join(1)
+        self.assertEqual(dispatcher.get_workers(), [])
+
+    def test_process_isolation(self):
+        """
+        Tests the callbacks executed in child processes, with a hung callback
+        terminated at the deadline, and the crash and timeout statistics.
+        """
+        dispatcher = AlarmDispatcher(
+            max_workers=1, timeout=0.5, isolation='process')
+        read_fd, write_fd = os.pipe()
+
+        def write_callback():
+            os.write(write_fd, b'x')
+
+        def hung_callback():
+            while True:
+                pass
+
+        def bad_callback():
+            raise ValueError('Bad callback')
+
+        def crash_callback():
+            os.kill(os.getpid(), signal.SIGKILL)
+
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_stderr:
+            start = time.time()
+            for alarm_id, callback in enumerate((
+                    hung_callback, bad_callback, crash_callback,
+                    write_callback)):
+                dispatcher.dispatch(
+                    AlarmItem(9, alarm_id, alarm_id=alarm_id), callback)
+            # The callback runs in another process, so it writes into a pipe
+            self.assertEqual(os.read(read_fd, 1), b'x')
+            self.assertLess(time.time() - start, 3)
+            for _ in range(100):
+                if dispatcher.get_stats()['completed'] == 1:
+                    break
+                time.sleep(0.01)
+            self.assertIn('terminated', test_stderr.getvalue())
+            self.assertIn('crashed', test_stderr.getvalue())
+        self.assertEqual(dispatcher.get_stats(), {
+            'executed': 4, 'completed': 1, 'failed': 1, 'crashed': 1,
+            'timed_out': 1})
+        os.close(read_fd)
+        os.close(write_fd)
+        dispatcher.stop()
+
+    def test_thread_stats(self):
+        """
+        Tests the alert statistics with the thread isolation, and the alert
+        listener.
+        """
+        dispatcher = AlarmDispatcher(max_workers=0, timeout=None)
+
+        def bad_callback():
+            raise ValueError('Bad callback')
+
+        with mock.patch('sys.stderr', new=io.StringIO()):
+            dispatcher.dispatch(AlarmItem(9, 0, alarm_id=1), bad_callback)
+            dispatcher.dispatch(AlarmItem(9, 1, alarm_id=2),
+                                self.record_callback('alert'))
+            dispatcher.dispatch(AlarmItem(9, 2, alarm_id=3), None)
+        self.assertEqual(dispatcher.get_stats(), {
+            'executed': 2, 'completed': 1, 'failed': 1, 'crashed': 0,
+            'timed_out': 0})
+
+        # The alert listener is called for each alert, even without callback
+        listened = []
+        dispatcher = AlarmDispatcher(
+            max_workers=0, alert_listener=lambda *alert: listened.append(alert))
+        alarm = AlarmItem(9, 3, alarm_id=4)
+        dispatcher.dispatch(alarm, None)
+        self.assertEqual(listened, [(alarm, 4, 0)])
+
+        # The offset alerts are identified by the alarm ID and alert index
+        offset_alarm = AlarmItem(9, 4)
+        dispatcher.dispatch(offset_alarm, None, alarm_id=4, alert_index=1)
+        self.assertEqual(listened[-1], (offset_alarm, 4, 1))
+
+        # An unknown isolation mode defaults to threads
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_stderr:
+            AlarmDispatcher(isolation='invalid')
+            self.assertIn('ERROR', test_stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Benchmark for the AlarmItem class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Measures the cost of materialising AlarmItems from 'alarms' table rows, both
+# in memory and from an AlarmDb database. The 'validated' figures reproduce the
+# previous behaviour, where every row went through the AlarmItem constructor
+# input sanitation.
+# It also measures the memory used by a list of AlarmItems with tracemalloc, for
+# which Python 3.4+ is required (the benchmark is skipped without it), and the
+# time to calculate the next alert of a list of alarms, with and without numpy.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    from LightUpAlarm import AlarmItem as AlarmItemModule
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmItem import AlarmItem, FrozenAlarmItem
+except ImportError:
+    import os
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm import AlarmItem as AlarmItemModule
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmItem import AlarmItem, FrozenAlarmItem
+
+
+# Database name to be used for the benchmark
+db_name = 'AlarmItem_benchmark_db'
+
+
+def validated_from_row(row):
+    """ Previous row to AlarmItem conversion, using the full constructor. """
+    alarm = AlarmItem(row['hour'], row['minute'], enabled=row['enabled'],
+                      label=row['label'], timestamp=row['timestamp'],
+                      alarm_id=row['id'])
+    alarm.repeat_mask = row['repeat_mask']
+    return alarm
+
+
+def create_rows(number):
+    return [{'id': i + 1, 'hour': i % 24, 'minute': i % 60,
+             'repeat_mask': i % 128, 'enabled': bool(i % 2),
+             'label': 'bench %s' % i, 'timestamp': 1440000000 + i}
+            for i in range(number)]
+
+
+def time_call(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def print_result(name, validated_time, trusted_time):
+    print('%-32s validated %8.3f s | trusted %8.3f s | x%.1f' %
+          (name, validated_time, trusted_time,
+           validated_time / max(trusted_time, 1e-9)))
+
+
+def benchmark_materialise(sizes=(1000, 10000)):
+    """
+    Compares converting rows into AlarmItems with the validating constructor
+    against the trusted AlarmItem.from_row() and AlarmItem.from_rows().
+    """
+    alarm_db = AlarmDb(db_name)
+    print('AlarmItem materialisation from rows:')
+    for size in sizes:
+        rows = create_rows(size)
+        validated_time = time_call(
+            lambda: [validated_from_row(row) for row in rows])
+        print_result('%6d in-memory rows, from_row' % size, validated_time,
+                     time_call(lambda: [AlarmItem.from_row(
+                         r['hour'], r['minute'], r['repeat_mask'],
+                         r['enabled'], r['label'], r['timestamp'], r['id'])
+                         for r in rows]))
+        print_result('%6d in-memory rows, from_rows' % size, validated_time,
+                     time_call(AlarmItem.from_rows, rows))
+
+        # Same comparison including the database read
+        alarm_db.delete_all_alarms()
+        alarm_db.add_alarms(AlarmItem.from_rows(rows))
+        alarms_table = alarm_db.open()['alarms']
+        print_result('%6d rows from AlarmDb' % size,
+                     time_call(lambda: [validated_from_row(row)
+                                        for row in alarms_table]),
+                     time_call(alarm_db.get_all_alarms))
+    alarm_db.delete_all_alarms()
+    alarm_db.close()
+
+
+class DictAlarmItem(AlarmItem):
+    """
+    AlarmItem with a per-instance __dict__, holding the next_alert attribute
+    that AlarmManager.get_next_alarm() used to add to every active alarm.
+    """
+
+    @classmethod
+    def from_rows(cls, rows):
+        alarms = super(DictAlarmItem, cls).from_rows(rows)
+        for alarm in alarms:
+            alarm.next_alert = 0
+        return alarms
+
+
+def traced_memory(function, *args):
+    """
+    Measures the memory still allocated after calling the function, while the
+    returned object is kept alive.
+    :return: Number of bytes allocated.
+    """
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    result = function(*args)
+    used_memory = tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+    del result
+    return used_memory
+
+
+def benchmark_memory(size=100000):
+    """
+    Compares the memory used by a list of alarms with a per-instance __dict__
+    against the slotted AlarmItem and FrozenAlarmItem classes.
+    """
+    if tracemalloc is None:
+        print('Memory benchmark skipped, tracemalloc is not available.')
+        return
+    rows = create_rows(size)
+    print('Memory used by %s alarms:' % size)
+    for alarm_class in (DictAlarmItem, AlarmItem, FrozenAlarmItem):
+        used_memory = traced_memory(alarm_class.from_rows, rows)
+        print('%-16s %8.2f MB | %6d bytes/alarm' %
+              (alarm_class.__name__, used_memory / 1e6, used_memory // size))
+
+
+def benchmark_minutes_to_alert(sizes=(1000, 10000, 100000)):
+    """
+    Compares calling AlarmItem.minutes_to_alert() for each alarm against
+    AlarmItem.minutes_to_alert_batch(), with numpy if it is installed.
+    """
+    print('AlarmItem minutes to next alert:')
+    numpy = AlarmItemModule.numpy
+    for size in sizes:
+        alarms = AlarmItem.from_rows(create_rows(size))
+        loop_time = time_call(lambda: [alarm.minutes_to_alert(13, 27, 3)
+                                       for alarm in alarms])
+        AlarmItemModule.numpy = None
+        python_time = time_call(
+            AlarmItem.minutes_to_alert_batch, alarms, 13, 27, 3)
+        AlarmItemModule.numpy = numpy
+        result = '%6d alarms: loop %8.4f s | batch %8.4f s' % \
+                 (size, loop_time, python_time)
+        if numpy is not None:
+            result += ' | numpy batch %8.4f s' % time_call(
+                AlarmItem.minutes_to_alert_batch, alarms, 13, 27, 3)
+        print(result)
+
+
+if __name__ == '__main__':
+    benchmark_minutes_to_alert()
+    benchmark_memory()
+    benchmark_materialise(tuple(int(arg) for arg in sys.argv[1:]) or
+                          (1000, 10000))
@@ -11,14 +11,14 @@ import unittest
 import mock
 import io
 try:
-    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmItem import AlarmItem, FrozenAlarmItem
 except ImportError:
     import os
     import sys
     file_dir = os.path.dirname(os.path.realpath(__file__))
     package_dir = os.path.dirname(os.path.dirname(file_dir))
     sys.path.insert(0, package_dir)
-    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmItem import AlarmItem, FrozenAlarmItem
 
 
 class AlarmItemTestCase(unittest.TestCase):
@@ -336,6 +336,127 @@ class AlarmItemTestCase(unittest.TestCase):
             alarm_test.sunday = 2.3
             self.assertEqual(alarm_test.sunday, days[6])
 
+    def test_repeat_mask(self):
+        """
+        Tests the repeat_mask accessor and that it is kept in sync with the
+        repeat list and the individual weekday accessors.
+        """
+        alarm_test = AlarmItem(
+            0, 0, days=(True, False, True, False, False, False, True))
+        self.assertEqual(alarm_test.repeat_mask, 0b1000101)
+
+        alarm_test.repeat_mask = 0b0110010
+        self.assertEqual(alarm_test.repeat,
+                         (False, True, False, False, True, True, False))
+        self.assert_repeat(
+            alarm_test, (False, True, False, False, True, True, False))
+
+        alarm_test.tuesday = False
+        alarm_test.sunday = True
+        self.assertEqual(alarm_test.repeat_mask, 0b1110000)
+        self.assertTrue(alarm_test.any_day_enabled())
+
+        alarm_test.repeat_mask = 0
+        self.assertFalse(alarm_test.any_day_enabled())
+        self.assertFalse(alarm_test.is_active())
+
+        # Invalid values should not change the mask
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            for invalid in (128, -1, 2.0, '5', True):
+                alarm_test.repeat_mask = invalid
+                self.assert_stderr(test_srderr)
+                self.assertEqual(alarm_test.repeat_mask, 0)
+
+    def test_from_row(self):
+        """
+        Tests the trusted constructors create the same alarm data as the
+        standard constructor.
+        """
+        days = (True, False, True, False, False, False, True)
+        expected = AlarmItem(
+            7, 45, days=days, enabled=False, label='row', timestamp=1234,
+            alarm_id=3)
+        row = {'id': 3, 'hour': 7, 'minute': 45, 'repeat_mask': 0b1000101,
+               'enabled': False, 'label': 'row', 'timestamp': 1234}
+
+        from_row = AlarmItem.from_row(
+            7, 45, repeat_mask=0b1000101, enabled=False, label='row',
+            timestamp=1234, alarm_id=3)
+        from_rows = AlarmItem.from_rows([row, row])
+        self.assertEqual(len(from_rows), 2)
+        for alarm_test in [from_row] + from_rows:
+            self.assertIsInstance(alarm_test, AlarmItem)
+            self.assertEqual(alarm_test.id_, expected.id_)
+            self.assertEqual(alarm_test.hour, expected.hour)
+            self.assertEqual(alarm_test.minute, expected.minute)
+            self.assertEqual(alarm_test.repeat, expected.repeat)
+            self.assertEqual(alarm_test.enabled, expected.enabled)
+            self.assertEqual(alarm_test.label, expected.label)
+            self.assertEqual(alarm_test.timestamp, expected.timestamp)
+
+        # Database NULL values take the standard constructor defaults
+        row.update(repeat_mask=None, label=None, timestamp=None)
+        alarm_test = AlarmItem.from_rows([row])[0]
+        self.assertEqual(alarm_test.repeat_mask, 0)
+        self.assertEqual(alarm_test.label, '')
+        self.assertIsNone(alarm_test.timestamp)
+        self.assertEqual(AlarmItem.from_rows([]), [])
+
+    def test_slots(self):
+        """ Tests that instances do not have a dictionary of attributes. """
+        alarm_test = AlarmItem(7, 45)
+        self.assertFalse(hasattr(alarm_test, '__dict__'))
+        self.assertRaises(AttributeError, setattr, alarm_test, 'extra', 1)
+        self.assertFalse(hasattr(alarm_test.frozen(), '__dict__'))
+
+    def test_frozen(self):
+        """
+        Tests the FrozenAlarmItem has the same data and validation as the
+        AlarmItem, but that its data cannot be modified.
+        """
+        days = (True, False, True, False, False, False, True)
+        alarm_test = AlarmItem(
+            7, 45, days=days, enabled=False, label='frozen', timestamp=1234,
+            alarm_id=3)
+        constructed = FrozenAlarmItem(
+            7, 45, days=days, enabled=False, label='frozen', timestamp=1234,
+            alarm_id=3)
+        for frozen in (alarm_test.frozen(), constructed,
+                       FrozenAlarmItem.from_row(
+                           7, 45, repeat_mask=0b1000101, enabled=False,
+                           label='frozen', timestamp=1234, alarm_id=3)):
+            self.assertIsInstance(frozen, FrozenAlarmItem)
+            self.assertIsInstance(frozen, AlarmItem)
+            self.assertEqual(str(frozen), str(alarm_test))
+            self.assertEqual(frozen.label, alarm_test.label)
+            self.assertEqual(frozen.timestamp, alarm_test.timestamp)
+            self.assertIs(frozen.frozen(), frozen)
+
+            with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+                frozen.hour = 10
+                self.assert_stderr(test_srderr)
+                frozen.monday = False
+                self.assert_stderr(test_srderr)
+                frozen.repeat_mask = 0
+                self.assert_stderr(test_srderr)
+                del frozen.label
+                self.assert_stderr(test_srderr)
+            self.assertEqual(frozen.hour, 7)
+            self.assertEqual(frozen.repeat, days)
+            self.assertEqual(frozen.label, 'frozen')
+
+            # The thawed copy can be modified again
+            thawed = frozen.thawed()
+            self.assertNotIsInstance(thawed, FrozenAlarmItem)
+            thawed.hour = 10
+            self.assertEqual(thawed.hour, 10)
+            self.assertEqual(frozen.hour, 7)
+
+        # Same constructor input validation
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            self.assertIsNone(FrozenAlarmItem(24, 0))
+            self.assert_stderr(test_srderr)
+
     def test_id(self):
         """ Tests the id member variable accessors filters non-integers. """
         alarm_test = AlarmItem(0, 0)
@@ -458,6 +579,39 @@ class AlarmItemTestCase(unittest.TestCase):
         time_diff = test_alarm.minutes_to_alert(4, 15, 2)
         self.assertEqual(time_diff, ((one_day * 5) + (60 * 5) + 15))
 
+        test_alarm.repeat_mask = 0
+        self.assertIsNone(test_alarm.minutes_to_alert(4, 15, 2))
+
+    def test_time_to_alarm_all_masks(self):
+        """
+        Compares minutes_to_alert and minutes_to_alert_batch against checking
+        each minute of the following week, for all the repeat masks.
+        """
+        def minutes_by_day(alarm, hour, minute, weekday):
+            for days in range(8):
+                minutes = (days * 1440) + (alarm.hour * 60) + alarm.minute - \
+                    (hour * 60) - minute
+                if alarm.repeat[(weekday + days) % 7] is True and minutes >= 0:
+                    return minutes
+            return None
+
+        alarms = [AlarmItem.from_row(7, 30, repeat_mask=mask)
+                  for mask in range(128)]
+        for hour, minute in ((0, 0), (7, 29), (7, 30), (7, 31), (23, 59)):
+            for weekday in range(7):
+                expected = [minutes_by_day(alarm, hour, minute, weekday)
+                            for alarm in alarms]
+                self.assertEqual(
+                    [alarm.minutes_to_alert(hour, minute, weekday)
+                     for alarm in alarms], expected)
+                self.assertEqual(AlarmItem.minutes_to_alert_batch(
+                    alarms, hour, minute, weekday), expected)
+                # Batch without numpy
+                with mock.patch('LightUpAlarm.AlarmItem.numpy', new=None):
+                    self.assertEqual(AlarmItem.minutes_to_alert_batch(
+                        alarms, hour, minute, weekday), expected)
+        self.assertEqual(AlarmItem.minutes_to_alert_batch([], 1, 1, 1), [])
+
     def test_string_alarm(self):
         """ Checks the __str__ output is correct. """
         test_alarm = AlarmItem(
@@ -604,15 +758,12 @@ class AlarmItemTestCase(unittest.TestCase):
             test_alarm.diff_alarm(time_diff)
             self.assertEqual(test_srderr.getvalue(), '')
 
-            # Lower boundary
-            time_diff = -60
-            test_alarm.diff_alarm(time_diff)
-            self.assert_stderr(test_srderr)
-
-            # Upper boundary
-            time_diff = 60
-            test_alarm.diff_alarm(time_diff)
-            self.assert_stderr(test_srderr)
+            # There are no range boundaries
+            test_alarm.diff_alarm(-60)
+            test_alarm.diff_alarm(60)
+            test_alarm.diff_alarm(-100000)
+            test_alarm.diff_alarm(100000)
+            self.assertEqual(test_srderr.getvalue(), '')
 
             # other types instead of integer
             time_diff = 0.1
@@ -622,6 +773,51 @@ class AlarmItemTestCase(unittest.TestCase):
             test_alarm.diff_alarm(time_diff)
             self.assert_stderr(test_srderr)
 
+    def test_diff_alarm_any_offset(self):
+        """
+        Tests the diff_alarm method with offsets of multiple hours and days,
+        comparing the alerts with the original alarm at all weekdays.
+        """
+        test_alarm = AlarmItem(
+            6, 45, days=(True, False, False, True, True, False, True),
+            label='warmup', alarm_id=4)
+
+        # 90 minute pre-alert, same day
+        diff_alarm = test_alarm.diff_alarm(-90)
+        self.assertEqual((diff_alarm.hour, diff_alarm.minute), (5, 15))
+        self.assertEqual(diff_alarm.repeat, test_alarm.repeat)
+        self.assertEqual(diff_alarm.label, 'warmup (Alarm 4 -90min)')
+
+        # 8 hour pre-alert, previous day
+        diff_alarm = test_alarm.diff_alarm(-480)
+        self.assertEqual((diff_alarm.hour, diff_alarm.minute), (22, 45))
+        self.assertEqual(diff_alarm.repeat,
+                         (False, False, True, True, False, True, True))
+
+        # Full weeks do not change the repeat days
+        for weeks in (-2, -1, 1, 3):
+            diff_alarm = test_alarm.diff_alarm(weeks * 7 * 1440)
+            self.assertEqual((diff_alarm.hour, diff_alarm.minute), (6, 45))
+            self.assertEqual(diff_alarm.repeat, test_alarm.repeat)
+
+        # Each alert of the offset alarm is the offset away from an alert of
+        # the original alarm
+        for offset in (-7 * 1440 - 1, -2 * 1440 - 30, -1441, -90, 1, 59, 720,
+                       3 * 1440 + 17, 10 * 1440 + 600):
+            diff_alarm = test_alarm.diff_alarm(offset)
+            for weekday in range(7):
+                minutes = diff_alarm.minutes_to_alert(0, 0, weekday)
+                # Time from the reference to the original alarm alert
+                alarm_minutes = minutes - offset
+                hour_in_week = alarm_minutes % (7 * 1440)
+                self.assertEqual(test_alarm.minutes_to_alert(
+                    (hour_in_week % 1440) // 60, hour_in_week % 60,
+                    (weekday + hour_in_week // 1440) % 7), 0)
+
+        # No repeat days
+        test_alarm.repeat_mask = 0
+        self.assertEqual(test_alarm.diff_alarm(-3000).repeat_mask, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Benchmark for the AlarmManager class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# The AlarmManager uses the default database file from the current working
+# directory, so the benchmarks run from a temporary directory to not modify any
+# existing alarms.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmManager import AlarmManager
+except ImportError:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmManager import AlarmManager
+
+
+def create_alarms(number, enabled=False):
+    """
+    Creates a list of alarms, disabled by default so that no alarms are
+    registered into the scheduler and only the storage cost is measured.
+    """
+    return [AlarmItem(i % 24, i % 60, enabled=enabled, label='bench %s' % i,
+                      days=(True, False, True, False, True, False, True))
+            for i in range(number)]
+
+
+def benchmark_bulk_add(sizes=(1000, 10000)):
+    """
+    Compares adding alarms one by one with AlarmManager.add_alarm() against
+    adding them all at once with AlarmManager.add_alarms().
+    """
+    alarm_mgr = AlarmManager()
+    print('AlarmManager adding alarms:')
+    for size in sizes:
+        alarms = create_alarms(size)
+
+        alarm_mgr.delete_all_alarms()
+        start = time.time()
+        for alarm in alarms:
+            alarm_mgr.add_alarm(
+                alarm.hour, alarm.minute, days=alarm.repeat,
+                enabled=alarm.enabled, label=alarm.label)
+        per_item_time = time.time() - start
+
+        alarm_mgr.delete_all_alarms()
+        start = time.time()
+        alarm_mgr.add_alarms(alarms)
+        bulk_time = time.time() - start
+
+        print('%6d alarms: add_alarm loop %8.3f s | add_alarms %8.3f s' %
+              (size, per_item_time, bulk_time))
+    alarm_mgr.delete_all_alarms()
+
+
+def benchmark_check_threads_state(sizes=(1000, 10000)):
+    """
+    Measures AlarmManager.check_threads_state() with all the alarms active,
+    when the scheduler is in sync with the database, when all the alarms are
+    missing from the scheduler, and when the scheduler has an extra alarm.
+    """
+    alarm_mgr = AlarmManager()
+    scheduler = alarm_mgr._AlarmManager__scheduler
+    print('AlarmManager check_threads_state with active alarms:')
+    for size in sizes:
+        alarm_mgr.delete_all_alarms()
+        alarm_mgr.add_alarms(create_alarms(size, enabled=True))
+
+        start = time.time()
+        alarm_mgr.check_threads_state()
+        in_sync_time = time.time() - start
+
+        scheduler.remove_all_alarms()
+        start = time.time()
+        alarm_mgr.check_threads_state()
+        missing_time = time.time() - start
+
+        scheduler.set_alarm(AlarmItem(
+            9, 30, alarm_id=size * 10,
+            days=(True, True, True, True, True, True, True)))
+        start = time.time()
+        alarm_mgr.check_threads_state()
+        extra_time = time.time() - start
+
+        print('%6d alarms: in sync %8.3f s | all missing %8.3f s | '
+              'one extra %8.3f s' % (size, in_sync_time, missing_time,
+                                     extra_time))
+    alarm_mgr.delete_all_alarms()
+
+
+def benchmark_get_running_alarms(sizes=(1000, 10000)):
+    """
+    Measures AlarmManager.get_running_alarms() with all the alarms active.
+    """
+    alarm_mgr = AlarmManager()
+    print('AlarmManager get_running_alarms with active alarms:')
+    for size in sizes:
+        alarm_mgr.delete_all_alarms()
+        alarm_mgr.add_alarms(create_alarms(size, enabled=True))
+        start = time.time()
+        running_alarms = alarm_mgr.get_running_alarms()
+        print('%6d alarms: %8.3f s' % (len(running_alarms),
+                                       time.time() - start))
+    alarm_mgr.delete_all_alarms()
+
+
+def benchmark_get_next_alarm(sizes=(1000, 10000), repetitions=100):
+    """
+    Measures AlarmManager.get_next_alarm() and get_upcoming_alarms() with all
+    the alarms active.
+    """
+    alarm_mgr = AlarmManager()
+    print('AlarmManager get_next_alarm with active alarms:')
+    for size in sizes:
+        alarm_mgr.delete_all_alarms()
+        alarm_mgr.add_alarms(create_alarms(size, enabled=True))
+        start = time.time()
+        for _ in range(repetitions):
+            alarm_mgr.get_next_alarm()
+        next_time = (time.time() - start) / repetitions
+        start = time.time()
+        for _ in range(repetitions):
+            alarm_mgr.get_upcoming_alarms(10)
+        upcoming_time = (time.time() - start) / repetitions
+        print('%6d alarms: get_next_alarm %9.6f s | '
+              'get_upcoming_alarms(10) %9.6f s' %
+              (size, next_time, upcoming_time))
+    alarm_mgr.delete_all_alarms()
+
+
+def main():
+    original_dir = os.getcwd()
+    temp_dir = tempfile.mkdtemp()
+    os.chdir(temp_dir)
+    try:
+        sizes = tuple(int(arg) for arg in sys.argv[1:]) or (1000, 10000)
+        benchmark_bulk_add(sizes)
+        benchmark_check_threads_state(sizes)
+        benchmark_get_running_alarms(sizes)
+        benchmark_get_next_alarm(sizes)
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@
 #
 from __future__ import unicode_literals, absolute_import
 import io
+import os
 import mock
 import time
 import types
@@ -23,6 +24,8 @@ try:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.Clock import SimulatedClock
 except ImportError:
     import os
     import sys
@@ -32,6 +35,8 @@ except ImportError:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.Clock import SimulatedClock
 
 
 class AlarmManagerTestCase(unittest.TestCase):
@@ -78,12 +83,16 @@ class AlarmManagerTestCase(unittest.TestCase):
     def setUp(self):
         """
         Sets the member variable hour to be far away enough so that we can
-        easily set up alarms without them triggering during test.
+        easily set up alarms without them triggering during test, and removes
+        the snoozes left in the test databases.
         """
         time_now = time.localtime(time.time())
         self.hour = time_now.tm_hour - 1
         if self.hour < 0:
             self.hour = 0
+        # Snoozes left by other tests would be restored by new AlarmManagers
+        for alarm_db in (AlarmDb(), AlarmDb('AlarmManager_test_db')):
+            alarm_db.delete_all_snoozes()
 
     #
     # Test methods
@@ -95,7 +104,7 @@ class AlarmManagerTestCase(unittest.TestCase):
         add_success = alarm_mgr.add_alarm(  # id 1
             8, 30, (False, True, False, True, False, True, False), True, 'test')
         self.assertIsInstance(add_success, types.IntType)
-        all_alarms = AlarmManager.get_all_alarms()
+        all_alarms = alarm_mgr.get_all_alarms()
         latest = len(all_alarms) - 1
         self.assert_alarm(
             all_alarms[latest], 1, 8, 30,
@@ -166,7 +175,7 @@ class AlarmManagerTestCase(unittest.TestCase):
         """
         Tests that if the database is empty it will populate it with the dummy
         alarms.
-        This also accesses the static methods from a AlarmManager() instacne.
+        This also accesses the database through the AlarmManager() instance.
         """
         alarm_mgr = AlarmManager()
         alarm_mgr.delete_all_alarms()
@@ -174,6 +183,134 @@ class AlarmManagerTestCase(unittest.TestCase):
         alarm_mgr = AlarmManager()
         self.assertNotEqual(alarm_mgr.get_number_of_alarms(), 0)
 
+    def test_injected_alarm_db(self):
+        """
+        Tests that an AlarmManager uses the AlarmDb instance it is given for
+        all its database access, without creating new AlarmDb instances.
+        """
+        alarm_db = AlarmDb('AlarmManager_test_db')
+        alarm_mgr = AlarmManager(alarm_db=alarm_db)
+        alarm_mgr.delete_all_alarms()
+        with mock.patch('LightUpAlarm.AlarmManager.AlarmDb') as mock_db:
+            alarm_id = alarm_mgr.add_alarm(
+                self.hour, 10, (True, False, False, False, False, False, False),
+                True, 'injected')
+            self.assertEqual(alarm_mgr.get_alarm(alarm_id).label, 'injected')
+            self.assertEqual(alarm_mgr.get_number_of_alarms(), 1)
+            alarm_mgr.set_snooze_time(alarm_mgr.get_snooze_time())
+            alarm_mgr.check_threads_state()
+            self.assertFalse(mock_db.called)
+        self.assertEqual(alarm_db.get_alarm(alarm_id).label, 'injected')
+        alarm_db.close()
+
+    def test_revision(self):
+        """ Tests the alarms revision increases on every alarms change. """
+        alarm_mgr = AlarmManager()
+        alarm_mgr.delete_all_alarms()
+        revisions = [alarm_mgr.get_revision()]
+        alarm_id = alarm_mgr.add_alarm(
+            self.hour, 10, (True, False, False, False, False, False, False))
+        revisions.append(alarm_mgr.get_revision())
+        # Reading the alarms does not change the revision
+        alarm_mgr.get_all_alarms()
+        alarm_mgr.check_threads_state()
+        self.assertEqual(alarm_mgr.get_revision(), revisions[-1])
+        alarm_mgr.edit_alarm(alarm_id, minute=20)
+        revisions.append(alarm_mgr.get_revision())
+        alarm_mgr.update_alarm(alarm_mgr.get_alarm(alarm_id))
+        revisions.append(alarm_mgr.get_revision())
+        alarm_mgr.add_alarms([AlarmItem(self.hour, 30)])
+        revisions.append(alarm_mgr.get_revision())
+        alarm_mgr.delete_alarm(alarm_id)
+        revisions.append(alarm_mgr.get_revision())
+        for i in range(1, len(revisions)):
+            self.assertGreater(revisions[i], revisions[i - 1])
+
+    def test_sync(self):
+        """
+        Tests synchronising the alarms between two AlarmManagers, with the
+        applied changes launched into the alarm threads and sent as events.
+        """
+        alarm_db = AlarmDb('AlarmManager_test_db')
+        remote_db = AlarmDb('AlarmManager_test_remote_db')
+        alarm_mgr = AlarmManager(alarm_db=alarm_db)
+        remote_mgr = AlarmManager(alarm_db=remote_db)
+        alarm_mgr.delete_all_alarms()
+        remote_mgr.delete_all_alarms()
+        events = []
+        alarm_mgr.add_event_listener(
+            lambda event_type, data: events.append(event_type))
+        remote_id = remote_mgr.add_alarm(
+            self.hour, 10, (True, True, True, True, True, True, True))
+
+        revision, alarms, deleted, _ = remote_mgr.get_changes(0)
+        self.assertEqual(alarm_mgr.apply_changes(alarms, deleted), 1)
+        local_alarms = alarm_mgr.get_all_alarms()
+        self.assertEqual(len(local_alarms), 1)
+        self.assertTrue(alarm_mgr.is_alarm_running(local_alarms[0].id_))
+
+        remote_mgr.delete_alarm(remote_id)
+        self.assertEqual(
+            alarm_mgr.apply_changes(*remote_mgr.get_changes(revision)[1:]), 1)
+        self.assertEqual(alarm_mgr.get_all_alarms(), [])
+        self.assertFalse(alarm_mgr.is_alarm_running(local_alarms[0].id_))
+        self.assertEqual(events, ['add', 'delete'])
+        self.assertIsNone(alarm_mgr.apply_changes([(1, None)]))
+        remote_db.close()
+        os.remove('AlarmManager_test_remote_db.db')
+
+    def test_event_listener(self):
+        """
+        Tests the alarm change, snooze, alert and offset alert events, using a
+        simulated clock to reach the offset alert.
+        """
+        events = []
+        alert_events = {'alert': threading.Event(),
+                        'offset_alert': threading.Event()}
+
+        def listener(event_type, data):
+            events.append((event_type, data))
+            if event_type in alert_events:
+                alert_events[event_type].set()
+
+        # The 1st of June 2015 was a Monday
+        clock = SimulatedClock(time.mktime((2015, 6, 1, 7, 0, 0, 0, 0, -1)))
+        alarm_mgr = AlarmManager(clock=clock)
+        alarm_mgr.delete_all_alarms()
+        alarm_mgr.add_event_listener(listener)
+        alarm_id = alarm_mgr.add_alarm(
+            7, 10, (True, False, False, False, False, False, False))
+        alarm_mgr.set_alarm_offset_alerts(alarm_id, [(-15, None)])
+        alarm_mgr.edit_alarm(alarm_id, minute=20)
+        snooze_time = alarm_mgr.get_snooze_time()
+        alarm_mgr.set_snooze_time(0)
+        try:
+            alarm_mgr.snooze(alarm_id)
+            self.assertTrue(alert_events['alert'].wait(1))
+        finally:
+            alarm_mgr.set_snooze_time(snooze_time)
+        # The offset alert of the 7:20 alarm is 15 minutes earlier
+        clock.advance(5 * 60)
+        self.assertTrue(alert_events['offset_alert'].wait(1))
+        alarm_mgr.delete_alarm(alarm_id)
+        revision = alarm_mgr.get_revision()
+        self.assertTrue(alarm_mgr.remove_event_listener(listener))
+        self.assertFalse(alarm_mgr.remove_event_listener(listener))
+        alarm_mgr.delete_all_alarms()
+
+        self.assertEqual(
+            [event_type for event_type, _ in events],
+            ['add', 'edit', 'snooze', 'alert', 'offset_alert', 'delete'])
+        self.assertEqual(events[0][1]['alarm'].id_, alarm_id)
+        self.assertEqual(events[1][1]['alarm'].minute, 20)
+        self.assertEqual(events[3][1]['alarm'].id_, alarm_id)
+        self.assertEqual(events[3][1]['id'], alarm_id)
+        self.assertEqual(events[4][1]['id'], alarm_id)
+        self.assertEqual((events[4][1]['alarm'].hour,
+                          events[4][1]['alarm'].minute), (7, 5))
+        self.assertEqual(events[5][1]['id'], alarm_id)
+        self.assertEqual(events[5][1]['revision'], revision)
+
     def test_delete_alarm(self):
         """
         Adds 5 alarms to the database, checks it is able to retrieve one of
@@ -181,15 +318,15 @@ class AlarmManagerTestCase(unittest.TestCase):
         """
         alarm_mgr = AlarmManager()
         self.create_alarms(alarm_mgr)
-        numb_alarms = AlarmManager.get_number_of_alarms()
+        numb_alarms = alarm_mgr.get_number_of_alarms()
         self.assertGreater(numb_alarms, 0)
-        all_alarms = AlarmManager.get_all_alarms()
-        alarm_retrieved = AlarmManager.get_alarm(all_alarms[0].id_)
+        all_alarms = alarm_mgr.get_all_alarms()
+        alarm_retrieved = alarm_mgr.get_alarm(all_alarms[0].id_)
         self.assertIsNotNone(alarm_retrieved)
         delete_success = alarm_mgr.delete_alarm(1)
         self.assertTrue(delete_success)
-        self.assertLess(AlarmManager.get_number_of_alarms(), numb_alarms)
-        alarm_retrieved = AlarmManager.get_alarm(alarm_retrieved.id_)
+        self.assertLess(alarm_mgr.get_number_of_alarms(), numb_alarms)
+        alarm_retrieved = alarm_mgr.get_alarm(alarm_retrieved.id_)
         self.assertIsNone(alarm_retrieved)
 
     def test_delete_all_alarms(self):
@@ -199,18 +336,102 @@ class AlarmManagerTestCase(unittest.TestCase):
         """
         alarm_mgr = AlarmManager()
         self.create_alarms(alarm_mgr)
-        numb_alarms = AlarmManager.get_number_of_alarms()
+        numb_alarms = alarm_mgr.get_number_of_alarms()
         self.assertGreater(numb_alarms, 0)
         delete_success = alarm_mgr.delete_all_alarms()
         self.assertTrue(delete_success)
-        self.assertEqual(AlarmManager.get_number_of_alarms(), 0)
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 0)
+
+        # The 'delete_all' event is only sent if the database was cleared
+        events = []
+        alarm_mgr.add_event_listener(
+            lambda event_type, data: events.append(event_type))
+        with mock.patch.object(AlarmDb, 'delete_all_alarms',
+                               return_value=False):
+            self.assertFalse(alarm_mgr.delete_all_alarms())
+        self.assertEqual(events, [])
+        self.create_alarms(alarm_mgr)
+        del events[:]
+        self.assertTrue(alarm_mgr.delete_all_alarms())
+        self.assertEqual(events, ['delete_all'])
+
+    def test_bulk_alarms(self):
+        """
+        Adds, updates and deletes several alarms at once, checking the alarm
+        threads follow the changes.
+        """
+        alarm_mgr = AlarmManager()
+        alarm_mgr.delete_all_alarms()
+        alarms = [
+            AlarmItem(self.hour, 10, enabled=True, label='one',
+                      days=(True, True, True, True, True, True, True)),
+            AlarmItem(self.hour, 20, enabled=False, label='two',
+                      days=(True, True, True, True, True, True, True)),
+            AlarmItem(self.hour, 30, enabled=True, label='three',
+                      days=(False, False, False, False, False, False, False))]
+        alarm_ids = alarm_mgr.add_alarms(alarms)
+        self.assertEqual(len(alarm_ids), 3)
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 3)
+        self.assertEqual([a.id_ for a in alarms], alarm_ids)
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_ids[0]))
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_ids[1]))
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_ids[2]))
+
+        # Deactivate the first one and activate the others
+        alarms[0].enabled = False
+        alarms[1].enabled = True
+        alarms[2].friday = True
+        self.assertTrue(alarm_mgr.update_alarms(alarms))
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_ids[0]))
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_ids[1]))
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_ids[2]))
+
+        self.assertTrue(alarm_mgr.delete_alarms(alarm_ids[1:]))
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 1)
+        self.assertEqual(len(alarm_mgr.get_running_alarms()), 0)
+
+    def test_apply_operations(self):
+        """
+        Adds, edits and deletes alarms in a single transaction, checking the
+        alarm threads follow the changes only if all the operations succeed.
+        """
+        alarm_mgr = AlarmManager()
+        alarm_mgr.delete_all_alarms()
+        all_days = (True, True, True, True, True, True, True)
+        id_1 = alarm_mgr.add_alarm(self.hour, 10, all_days, True, 'one')
+        id_2 = alarm_mgr.add_alarm(self.hour, 20, all_days, True, 'two')
+        new_alarm = AlarmItem(self.hour, 30, days=all_days, label='three')
+
+        results = alarm_mgr.apply_operations([
+            ('add', new_alarm),
+            ('edit', id_1, {'enabled': False}),
+            ('delete', 99)])
+        self.assertIsNone(results[2])
+        self.assertIsNone(new_alarm.id_)
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 2)
+        self.assertTrue(alarm_mgr.is_alarm_running(id_1))
+
+        events = []
+        alarm_mgr.add_event_listener(
+            lambda event_type, data: events.append(event_type))
+        results = alarm_mgr.apply_operations([
+            ('add', new_alarm),
+            ('edit', id_1, {'enabled': False}),
+            ('delete', id_2)])
+        self.assertEqual(new_alarm.id_, results[0])
+        self.assertEqual(results[1].enabled, False)
+        self.assertEqual(events, ['add', 'edit', 'delete'])
+        self.assertTrue(alarm_mgr.is_alarm_running(new_alarm.id_))
+        self.assertFalse(alarm_mgr.is_alarm_running(id_1))
+        self.assertFalse(alarm_mgr.is_alarm_running(id_2))
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 2)
 
     def test_get_all_active_alarms(self):
         """ Test the get_all_active_alarms method. """
         alarm_mgr = AlarmManager()
         # First test with 5 active alarms
         self.create_alarms(alarm_mgr)
-        active_alarms = AlarmManager.get_all_active_alarms()
+        active_alarms = alarm_mgr.get_all_active_alarms()
         self.assertEquals(len(active_alarms), 5)
         # Deactivate a couple of alarms and try again
         edit_success = alarm_mgr.edit_alarm(1, enabled=False)
@@ -218,63 +439,252 @@ class AlarmManagerTestCase(unittest.TestCase):
         edit_success = alarm_mgr.edit_alarm(
             3, days=(False, False, False, False, False, False, False))
         self.assertTrue(edit_success)
-        active_alarms = AlarmManager.get_all_active_alarms()
+        active_alarms = alarm_mgr.get_all_active_alarms()
         self.assertEquals(len(active_alarms), 3)
         # Check it returns an empty list if no ative alarms
         alarm_mgr.delete_all_alarms()
-        active_alarms = AlarmManager.get_all_active_alarms()
+        active_alarms = alarm_mgr.get_all_active_alarms()
         self.assertEqual(len(active_alarms), 0)
 
-    @mock.patch('LightUpAlarm.AlarmManager.time.localtime')
-    def test_get_next_alarm(self, mock_time):
+    def test_get_next_alarm(self):
         """
-        Creates 5 alarms with different settings. It then mocks the current time
+        Creates 5 alarms with different settings. It then uses a simulated clock
         to get calculate the next alarm at different reference points.
+        The next alarm comes from the alarm scheduler queue, which is calculated
+        when the alarms are registered, so a new AlarmManager is created for
+        each reference point to register the alarms again.
         """
+        def next_alarm_at(hour, minute, weekday):
+            # The 1st of June 2015 was a Monday
+            clock = SimulatedClock(time.mktime(
+                (2015, 6, 1 + weekday, hour, minute, 0, 0, 0, -1)))
+            return AlarmManager(clock=clock).get_next_alarm()
+
         alarm_mgr = AlarmManager()
         alarm_mgr.delete_all_alarms()
+        self.assertIsNone(alarm_mgr.get_next_alarm())
         alarm_mgr.add_alarm(
             11, 20, (True, False, False, False, False, False, False), True)
         alarm_mgr.add_alarm(
             11, 15, (True, False, False, False, False, False, False), True)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   12,  30,  00,   0,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
-        self.assertEqual(next_alarm.id_, 2)
-
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   11,  17,  00,   0,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
-        self.assertEqual(next_alarm.id_, 1)
+        self.assertEqual(next_alarm_at(12, 30, 0).id_, 2)
+        self.assertEqual(next_alarm_at(11, 17, 0).id_, 1)
 
         self.create_alarms(alarm_mgr)
+        self.assertEqual(next_alarm_at(19, 30, 1).id_, 2)
+        self.assertEqual(next_alarm_at(13, 00, 4).id_, 4)
+        self.assertEqual(next_alarm_at(21, 45, 5).id_, 3)
+        self.assertEqual(next_alarm_at(11, 15, 6).id_, 3)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   19,  30,  00,   1,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
-        self.assertEqual(next_alarm.id_, 2)
-
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   13,  00,  00,   4,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
-        self.assertEqual(next_alarm.id_, 4)
-
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   21,  45,  00,   5,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
-        self.assertEqual(next_alarm.id_, 3)
-
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   11,  15,  00,   6,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
-        self.assertEqual(next_alarm.id_, 3)
+    def test_get_upcoming_alarms(self):
+        """
+        Tests the upcoming alarms are returned in chronological order, limited
+        by number and time window, and kept up to date with the alarm edits.
+        """
+        alarm_mgr = AlarmManager()
+        alarm_mgr.delete_all_alarms()
+        self.assertEqual(alarm_mgr.get_upcoming_alarms(), [])
+        time_now = time.localtime(time.time())
+        all_days = (True, True, True, True, True, True, True)
+        # Alarms in 3, 1, 5 and 2 hours, and a disabled alarm in 4 hours
+        for hours, enabled in ((3, True), (1, True), (5, True), (2, True),
+                               (4, False)):
+            alarm_mgr.add_alarm((time_now.tm_hour + hours) % 24,
+                                time_now.tm_min, all_days, enabled)
+
+        upcoming = alarm_mgr.get_upcoming_alarms()
+        self.assertEqual([alarm.id_ for _, alarm in upcoming], [2, 4, 1, 3])
+        alert_times = [alert_time for alert_time, _ in upcoming]
+        self.assertEqual(alert_times, sorted(alert_times))
+        self.assertEqual(alert_times[1] - alert_times[0], 3600)
+        self.assertEqual(
+            [alarm.id_ for _, alarm in alarm_mgr.get_upcoming_alarms(2)],
+            [2, 4])
+        self.assertEqual(
+            [alarm.id_ for _, alarm in
+             alarm_mgr.get_upcoming_alarms(window=(2 * 60 + 30) * 60)],
+            [2, 4])
+        self.assertEqual(alarm_mgr.get_next_alarm().id_, 2)
+
+        # The returned alarms are copies, and edits update the queue
+        alarm_mgr.get_next_alarm().enabled = False
+        self.assertEqual(alarm_mgr.get_next_alarm().id_, 2)
+        alarm_mgr.edit_alarm(2, enabled=False)
+        alarm_mgr.delete_alarm(4)
+        alarm_mgr.edit_alarm(5, enabled=True)
+        self.assertEqual(
+            [alarm.id_ for _, alarm in alarm_mgr.get_upcoming_alarms()],
+            [1, 5, 3])
+        alarm_mgr.delete_all_alarms()
+        self.assertIsNone(alarm_mgr.get_next_alarm())
+
+    def test_offset_alerts(self):
+        """
+        Tests the default offset alerts, from the settings or the constructor,
+        and the offset alerts override for an alarm.
+        """
+        def callback():
+            pass
+
+        alarm_mgr = AlarmManager(offset_alert_callback=callback)
+        alarm_mgr.delete_all_alarms()
+        alarm_id = alarm_mgr.add_alarm(
+            8, 30, (True, True, True, True, True, True, True), True)
+        self.assertEqual(alarm_mgr.get_alarm_offset_alerts(alarm_id),
+                         ((alarm_mgr.get_offset_alert_time(), callback),))
+
+        default_alerts = [(-30, callback), (-5, callback)]
+        alarm_mgr = AlarmManager(offset_alerts=default_alerts)
+        self.assertEqual(alarm_mgr.get_alarm_offset_alerts(alarm_id),
+                         tuple(default_alerts))
+
+        # Override the offset alerts of the running alarm
+        self.assertTrue(
+            alarm_mgr.set_alarm_offset_alerts(alarm_id, [(10, callback)]))
+        self.assertEqual(alarm_mgr.get_alarm_offset_alerts(alarm_id),
+                         ((10, callback),))
+        self.assertTrue(alarm_mgr.check_threads_state())
+        self.assertTrue(alarm_mgr.set_alarm_offset_alerts(alarm_id, None))
+        self.assertEqual(alarm_mgr.get_alarm_offset_alerts(alarm_id),
+                         tuple(default_alerts))
+
+        # The override is removed with the alarm
+        alarm_mgr.set_alarm_offset_alerts(alarm_id, [(10, callback)])
+        alarm_mgr.delete_alarm(alarm_id)
+        self.assertFalse(alarm_mgr.set_alarm_offset_alerts(alarm_id, None))
+        self.assertEqual(alarm_mgr.get_alarm_offset_alerts(alarm_id),
+                         tuple(default_alerts))
+
+    def test_snooze(self):
+        """
+        Tests snoozing an alarm, measuring the time from the request until the
+        snooze timer is set and until the snoozed alert is triggered, and that
+        the snooze is restored after a restart and cancelled when dismissed.
+        """
+        alerts = []
+        alert_event = threading.Event()
+
+        def callback():
+            alerts.append(time.time())
+            alert_event.set()
+
+        alarm_mgr = AlarmManager(alert_callback=callback)
+        alarm_mgr.delete_all_alarms()
+        alarm_id = alarm_mgr.add_alarm(
+            self.hour, 0, (False, False, False, False, False, False, False),
+            False)
+        self.assertIsNone(alarm_mgr.snooze(alarm_id + 1))
+
+        snooze_time = alarm_mgr.get_snooze_time()
+        start = time.time()
+        alert_time = alarm_mgr.snooze(alarm_id)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(alarm_mgr.get_snooze(alarm_id), alert_time)
+        self.assertAlmostEqual(alert_time, start + snooze_time * 60, delta=1)
+
+        # The snooze is restored by a new AlarmManager and cancelled on dismiss
+        alarm_mgr = AlarmManager(alert_callback=callback)
+        self.assertEqual(alarm_mgr.get_snooze(alarm_id), alert_time)
+        self.assertTrue(alarm_mgr.dismiss(alarm_id))
+        self.assertFalse(alarm_mgr.dismiss(alarm_id))
+        self.assertIsNone(alarm_mgr.get_snooze(alarm_id))
+        self.assertIsNone(AlarmManager().get_snooze(alarm_id))
+
+        # With a 0 minutes snooze time the alert is triggered straight away
+        alarm_mgr.set_snooze_time(0)
+        try:
+            start = time.time()
+            alarm_mgr.snooze(alarm_id)
+            self.assertTrue(alert_event.wait(1))
+            self.assertLess(alerts[0] - start, 0.5)
+        finally:
+            alarm_mgr.set_snooze_time(snooze_time)
+        time.sleep(0.1)
+        self.assertIsNone(alarm_mgr.get_snooze(alarm_id))
+        self.assertIsNone(AlarmManager().get_snooze(alarm_id))
+        self.assertEqual(len(alerts), 1)
+
+        # The snoozes later than the scheduler grace period are not restored
+        late_alert_time = int(time.time()) - 300
+        alarm_db = AlarmDb()
+        for grace_period, restored in ((60, False), (600, True), (None, True)):
+            alarm_db.set_snooze(alarm_id, late_alert_time)
+            with mock.patch.object(AlarmScheduler, 'get_grace_period',
+                                   return_value=grace_period), \
+                    mock.patch.object(AlarmScheduler, 'set_timer') as timer:
+                AlarmManager()
+            self.assertEqual(timer.called, restored)
+            self.assertEqual(alarm_id in alarm_db.get_snoozes(), restored)
+        alarm_db.delete_snooze(alarm_id)
+
+    def test_alert_isolation(self):
+        """
+        Tests the alert callbacks executed in a child process, with their
+        statistics reported to the AlarmManager.
+        """
+        read_fd, write_fd = os.pipe()
+
+        def callback():
+            os.write(write_fd, b'x')
+
+        alarm_mgr = AlarmManager(
+            alert_callback=callback, alert_isolation='process',
+            alert_timeout=5)
+        alarm_mgr.delete_all_alarms()
+        alarm_id = alarm_mgr.add_alarm(
+            self.hour, 0, (False, False, False, False, False, False, False),
+            False)
+        snooze_time = alarm_mgr.get_snooze_time()
+        alarm_mgr.set_snooze_time(0)
+        try:
+            alarm_mgr.snooze(alarm_id)
+            self.assertEqual(os.read(read_fd, 1), b'x')
+        finally:
+            alarm_mgr.set_snooze_time(snooze_time)
+            os.close(read_fd)
+            os.close(write_fd)
+        for _ in range(100):
+            if alarm_mgr.get_alert_stats()['completed'] == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(alarm_mgr.get_alert_stats(), {
+            'executed': 1, 'completed': 1, 'failed': 0, 'crashed': 0,
+            'timed_out': 0})
+
+    def test_snooze_alert_isolation(self):
+        """
+        Tests the snooze of an alarm is removed by the AlarmManager process,
+        even if the alert child process is killed.
+        """
+        def callback():
+            os._exit(3)
+
+        alarm_db = AlarmDb('AlarmManager_test_db')
+        alarm_mgr = AlarmManager(
+            alarm_db=alarm_db, alert_callback=callback,
+            alert_isolation='process', alert_timeout=5)
+        alarm_mgr.delete_all_alarms()
+        alarm_id = alarm_mgr.add_alarm(
+            self.hour, 0, (False, False, False, False, False, False, False),
+            False)
+        snooze_time = alarm_mgr.get_snooze_time()
+        alarm_mgr.set_snooze_time(0)
+        try:
+            with mock.patch.object(alarm_db, 'delete_snooze',
+                                   wraps=alarm_db.delete_snooze) as mock_delete:
+                with mock.patch('sys.stderr', new=io.StringIO()):
+                    alarm_mgr.snooze(alarm_id)
+                    for _ in range(200):
+                        if alarm_mgr.get_alert_stats()['crashed'] == 1:
+                            break
+                        time.sleep(0.01)
+                mock_delete.assert_called_once_with(alarm_id)
+        finally:
+            alarm_mgr.set_snooze_time(snooze_time)
+        self.assertEqual(alarm_mgr.get_alert_stats()['crashed'], 1)
+        self.assertNotIn(alarm_id, alarm_db.get_snoozes())
+        alarm_mgr.delete_all_alarms()
 
     def test_edit_alarm(self):
         """
@@ -286,7 +696,7 @@ class AlarmManagerTestCase(unittest.TestCase):
         self.create_alarms(alarm_mgr)
 
         # Check the alarm has the expected data before editing it
-        retrieved_alarm = AlarmManager.get_alarm(3)
+        retrieved_alarm = alarm_mgr.get_alarm(3)
         self.assert_alarm(
             retrieved_alarm, 3, 11, 15,
             (True, False, False, True, False, False, True), True, '')
@@ -296,7 +706,7 @@ class AlarmManagerTestCase(unittest.TestCase):
             retrieved_alarm.id_, 23, 34,
             (False, True, False, True, False, True, False), False, 'edited')
         self.assertTrue(edit_success)
-        retrieved_alarm = AlarmManager.get_alarm(retrieved_alarm.id_)
+        retrieved_alarm = alarm_mgr.get_alarm(retrieved_alarm.id_)
         self.assert_alarm(
             retrieved_alarm, 3, 23, 34,
             (False, True, False, True, False, True, False), False, 'edited')
@@ -304,7 +714,7 @@ class AlarmManagerTestCase(unittest.TestCase):
         # Ensure nothing changes if no edit arguments are added
         edit_success = alarm_mgr.edit_alarm(retrieved_alarm.id_)
         self.assertTrue(edit_success)
-        retrieved_alarm = AlarmManager.get_alarm(retrieved_alarm.id_)
+        retrieved_alarm = alarm_mgr.get_alarm(retrieved_alarm.id_)
         self.assert_alarm(
             retrieved_alarm, 3, 23, 34,
             (False, True, False, True, False, True, False), False, 'edited')
@@ -319,7 +729,7 @@ class AlarmManagerTestCase(unittest.TestCase):
         self.create_alarms(alarm_mgr)
 
         # Check the alarm has the expected data before editing it
-        retrieved_alarm = AlarmManager.get_alarm(3)
+        retrieved_alarm = alarm_mgr.get_alarm(3)
         self.assert_alarm(
             retrieved_alarm, 3, 11, 15,
             (True, False, False, True, False, False, True), True, '')
@@ -337,7 +747,7 @@ class AlarmManagerTestCase(unittest.TestCase):
         update_success = alarm_mgr.update_alarm(retrieved_alarm)
         self.assertTrue(update_success)
         self.assertGreater(retrieved_alarm.timestamp, original_timestamp)
-        retrieved_alarm = AlarmManager.get_alarm(retrieved_alarm.id_)
+        retrieved_alarm = alarm_mgr.get_alarm(retrieved_alarm.id_)
         self.assertGreater(retrieved_alarm.timestamp, original_timestamp)
         self.assert_alarm(
             retrieved_alarm, 3, 23, 34,
@@ -369,11 +779,20 @@ class AlarmManagerTestCase(unittest.TestCase):
         self.assertFalse(launch_success)
         self.assertEqual(threading.activeCount(), numb_threads)
 
-        # Test fully active alarm
+        # Test fully active alarm, runs in the scheduler thread
         alarm.wednesday = True
         launch_success = alarm_mgr._AlarmManager__set_alarm_thread(alarm)
         self.assertTrue(launch_success)
-        self.assertGreater(threading.activeCount(), numb_threads)
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm.id_))
+        self.assertEqual(threading.activeCount(), numb_threads)
+
+        # More active alarms do not launch any more threads
+        for alarm_id in range(100, 150):
+            launch_success = alarm_mgr._AlarmManager__set_alarm_thread(
+                AlarmItem(self.hour, 34, enabled=True, alarm_id=alarm_id,
+                          days=(True, True, True, True, True, True, True)))
+            self.assertTrue(launch_success)
+        self.assertEqual(threading.activeCount(), numb_threads)
 
     def test_set_alarm_thread_edit(self):
         """
@@ -393,31 +812,32 @@ class AlarmManagerTestCase(unittest.TestCase):
         numb_threads = threading.activeCount()
         launch_success = alarm_mgr._AlarmManager__set_alarm_thread(first_alarm)
         self.assertTrue(launch_success)
-        self.assertGreater(threading.activeCount(), numb_threads)
+        self.assertTrue(alarm_mgr.is_alarm_running(first_alarm.id_))
 
-        # Editing to the new alarm data should stop the thread as it is inactive
+        # Editing to the new alarm data should stop the alarm as it is inactive
         launch_success = alarm_mgr._AlarmManager__set_alarm_thread(new_alarm)
         self.assertFalse(launch_success)
+        self.assertFalse(alarm_mgr.is_alarm_running(first_alarm.id_))
         self.assertEqual(threading.activeCount(), numb_threads)
 
     def test_stop_alarm_thread(self):
         """
         Test that the __stop_alarm_thread private method will stop a running
-        Alarm Thread, which due to the nature of the thread code can take up to
-        10 seconds.
+        alarm in the scheduler thread.
         This test accesses private methods.
         """
         alarm = AlarmItem(self.hour, 34, enabled=True, label='t', alarm_id=96,
                           days=(False, True, True, True, True, True, True))
         alarm_mgr = AlarmManager()
         alarm_mgr.delete_all_alarms()
-        numb_threads = threading.activeCount()
         launch_success = alarm_mgr._AlarmManager__set_alarm_thread(alarm)
         self.assertTrue(launch_success)
-        self.assertGreater(threading.activeCount(), numb_threads)
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm.id_))
         stop_success = alarm_mgr._AlarmManager__stop_alarm_thread(alarm.id_)
         self.assertTrue(stop_success)
-        self.assertEqual(threading.activeCount(), numb_threads)
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm.id_))
+        stop_success = alarm_mgr._AlarmManager__stop_alarm_thread(alarm.id_)
+        self.assertFalse(stop_success)
 
     def test_stop_all_alarm_threads(self):
         """
@@ -438,11 +858,12 @@ class AlarmManagerTestCase(unittest.TestCase):
         self.assertTrue(launch_success)
         launch_success = alarm_mgr._AlarmManager__set_alarm_thread(alarm_two)
         self.assertTrue(launch_success)
-        numb_threads = threading.activeCount()
-        self.assertGreaterEqual(numb_threads, 2)
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_one.id_))
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_two.id_))
         delete_success = alarm_mgr._AlarmManager__stop_all_alarm_threads()
         self.assertTrue(delete_success)
-        self.assertEqual(threading.activeCount(), numb_threads - 2)
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_one.id_))
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_two.id_))
 
     def test_get_running_alarms(self):
         """
@@ -458,6 +879,13 @@ class AlarmManagerTestCase(unittest.TestCase):
         alarm_mgr.edit_alarm(3, enabled=False)
         self.assertEqual(
             len(running_alarms) - 2, len(alarm_mgr.get_running_alarms()))
+        # The running alarms are loaded in a single query, not one per alarm
+        with mock.patch.object(AlarmDb, 'get_alarm') as mock_get_alarm:
+            running_alarms = alarm_mgr.get_running_alarms()
+            self.assertFalse(mock_get_alarm.called)
+        self.assertEqual(
+            [alarm.id_ for alarm in running_alarms],
+            [alarm.id_ for alarm in alarm_mgr.get_all_active_alarms()])
         alarm_mgr.delete_all_alarms()
         running_alarms = alarm_mgr.get_running_alarms()
         self.assertEqual(len(running_alarms), 0)
@@ -516,12 +944,12 @@ class AlarmManagerTestCase(unittest.TestCase):
         self.assertTrue(check_result)
 
         # Now that everything is working correctly, sneak around AlarmManager
-        # and edit a running thread by editing an AlarmItem using the
-        # AlarmThread internal reference to the AlarmItem instance (which does
-        # not do the extra checks for tracking like AlarmManager does).
+        # and edit a running alarm by editing an AlarmItem using the
+        # AlarmScheduler internal reference to the AlarmItem instance (which
+        # does not do the extra checks for tracking like AlarmManager does).
         # Also edit the database entry for that alarm bypassing AlarmManager.
-        alarm_bypass = \
-            alarm_mgr._AlarmManager__alarm_threads[0]._AlarmThread__alarm
+        scheduler = alarm_mgr._AlarmManager__scheduler
+        alarm_bypass = scheduler.get_alarm(scheduler.get_alarm_ids()[0])
         alarm_bypass.enabled = False
         alarm_id = alarm_bypass.id_
         AlarmDb().edit_alarm(alarm_id, enabled=False)
@@ -552,12 +980,14 @@ class AlarmManagerTestCase(unittest.TestCase):
         check_result = alarm_mgr.check_threads_state()
         self.assertTrue(check_result)
 
-        # Now we stop a running thread bypassing AlarmManager public methods
-        alarm_mgr._AlarmManager__alarm_threads[0].stop()
-        while alarm_mgr._AlarmManager__alarm_threads[0].isAlive():
-            time.sleep(0.1)
+        # Now we stop the scheduler thread bypassing AlarmManager public methods
+        scheduler = alarm_mgr._AlarmManager__scheduler
+        scheduler.stop()
+        scheduler.join()
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_test.id_))
         check_result = alarm_mgr.check_threads_state()
         self.assertFalse(check_result)
+        self.assertTrue(alarm_mgr._AlarmManager__scheduler.is_alive())
         check_result = alarm_mgr.check_threads_state()
         self.assertTrue(check_result)
 
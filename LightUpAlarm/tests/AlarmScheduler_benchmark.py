@@ -0,0 +1,135 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Benchmark for the AlarmScheduler class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Compares running the alarms with one AlarmThread per alarm, as the
+# AlarmManager used to do, against a single AlarmScheduler thread. It measures
+# the number of threads, the CPU time used while no alarm is triggering, and
+# the delay from the start of the alarm minute to the alert callback.
+# The alert delay benchmark waits for the next minute for each case, so it can
+# take up to two minutes to run.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import sys
+import time
+import threading
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+except ImportError:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+
+
+def cpu_time():
+    """ :return: User + system CPU time used by this process, in seconds. """
+    times = os.times()
+    return times[0] + times[1]
+
+
+class ThreadPerAlarm(object):
+    """ Launches an AlarmThread per alarm, the previous AlarmManager model. """
+
+    def __init__(self, alarms, callback):
+        self.threads = [AlarmThread(alarm, alarm_callback=callback,
+                                    offset_alarm_time=-15)
+                        for alarm in alarms]
+        for alarm_thread in self.threads:
+            alarm_thread.start()
+
+    def stop(self):
+        for alarm_thread in self.threads:
+            alarm_thread.stop()
+        for alarm_thread in self.threads:
+            alarm_thread.join()
+
+
+class SingleScheduler(object):
+    """ Registers all the alarms into a single AlarmScheduler. """
+
+    def __init__(self, alarms, callback):
+        self.scheduler = AlarmScheduler()
+        self.scheduler.start()
+        for alarm in alarms:
+            self.scheduler.set_alarm(alarm, alarm_callback=callback,
+                                     offset_alarm_time=-15)
+
+    def stop(self):
+        self.scheduler.stop()
+        self.scheduler.join()
+
+
+def create_alarms(number, hour, minute):
+    return [AlarmItem(hour, minute, alarm_id=alarm_id + 1,
+                      days=(True, True, True, True, True, True, True))
+            for alarm_id in range(number)]
+
+
+def benchmark_idle(number_alarms=50, seconds=10):
+    """
+    Measures the threads and CPU time used by each model while the alarms are
+    not triggering.
+    """
+    time_now = time.localtime(time.time())
+    alarms = create_alarms(
+        number_alarms, (time_now.tm_hour + 12) % 24, time_now.tm_min)
+    print('Idle with %s alarms for %s seconds:' % (number_alarms, seconds))
+    for model in (ThreadPerAlarm, SingleScheduler):
+        threads_before = threading.activeCount()
+        start_cpu = cpu_time()
+        engine = model(alarms, None)
+        threads_used = threading.activeCount() - threads_before
+        time.sleep(seconds)
+        cpu_used = cpu_time() - start_cpu
+        engine.stop()
+        print('%-16s threads %4d | CPU time %7.3f s' %
+              (model.__name__, threads_used, cpu_used))
+
+
+def benchmark_alert_delay(number_alarms=50):
+    """
+    Measures the delay between the start of the alarm minute and the alert
+    callback being executed.
+    """
+    print('Alert delay with %s alarms:' % number_alarms)
+    for model in (ThreadPerAlarm, SingleScheduler):
+        # Set the alarms for the start of the next minute
+        now = time.time()
+        next_minute = int(now) - time.localtime(now).tm_sec + 60
+        next_time = time.localtime(next_minute)
+        alarms = create_alarms(
+            number_alarms, next_time.tm_hour, next_time.tm_min)
+        delays = []
+        lock = threading.Lock()
+
+        def callback():
+            with lock:
+                delays.append(time.time() - next_minute)
+
+        engine = model(alarms, callback)
+        while len(delays) < number_alarms and \
+                time.time() < next_minute + 50:
+            time.sleep(0.1)
+        engine.stop()
+        if delays:
+            print('%-16s alerts %4d | mean delay %7.3f s | max %7.3f s' %
+                  (model.__name__, len(delays), sum(delays) / len(delays),
+                   max(delays)))
+        else:
+            print('%-16s no alerts triggered' % model.__name__)
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    benchmark_idle(number)
+    benchmark_alert_delay(number)
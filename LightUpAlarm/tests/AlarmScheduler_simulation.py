@@ -0,0 +1,152 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Simulation of a week of alarms for the AlarmScheduler class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Replays a full week of randomly generated alarms, each with a -15 minutes
+# offset alert, using a SimulatedClock instead of waiting for the real time.
+# The clock jumps to each alert time plus a random wake up delay, the due
+# alerts are triggered, and the alerts received are compared against the ones
+# expected from checking every minute of the week. It reports the missed,
+# duplicated, late (more than 1 second after the alert minute start) and
+# unexpected alerts.
+#
+# Usage: AlarmScheduler_simulation.py [number_alarms] [max_wake_delay]
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import sys
+import time
+import random
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.Clock import SimulatedClock
+except ImportError:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.Clock import SimulatedClock
+
+WEEK_SECONDS = 7 * 24 * 60 * 60
+OFFSET_MINUTES = -15
+
+
+def create_alarms(number_alarms):
+    """
+    :param number_alarms: Number of alarms to create.
+    :return: List of AlarmItems with random times and repeat days.
+    """
+    alarms = []
+    for alarm_id in range(1, number_alarms + 1):
+        days = tuple(random.random() < 0.5 for _ in range(7))
+        alarms.append(AlarmItem(
+            random.randint(0, 23), random.randint(0, 59), days=days,
+            enabled=random.random() < 0.9, alarm_id=alarm_id))
+    return alarms
+
+
+def expected_alerts(alarms, start):
+    """
+    Finds the alerts for each minute of the week by checking the alarms data,
+    independently of the scheduler.
+    :param alarms: List of AlarmItems.
+    :param start: Start of the week, in seconds since 1970.
+    :return: Set of (alert kind, alarm ID, minute start) tuples.
+    """
+    index = {}
+    for alarm in alarms:
+        if alarm.is_active() is False:
+            continue
+        offset_alarm = alarm.diff_alarm(OFFSET_MINUTES)
+        for kind, item in (('alarm', alarm), ('offset', offset_alarm)):
+            for wday in range(7):
+                if item.repeat[wday] is True:
+                    index.setdefault((wday, item.hour, item.minute), []).append(
+                        (kind, alarm.id_))
+    expected = set()
+    for minute_start in range(int(start), int(start) + WEEK_SECONDS, 60):
+        local_time = time.localtime(minute_start)
+        key = (local_time.tm_wday, local_time.tm_hour, local_time.tm_min)
+        for kind, alarm_id in index.get(key, []):
+            expected.add((kind, alarm_id, minute_start))
+    return expected
+
+
+def simulate_week(number_alarms, max_wake_delay):
+    """
+    Replays a week of alarms and prints the results.
+    :param number_alarms: Number of alarms to simulate.
+    :param max_wake_delay: Maximum random delay, in seconds, for the scheduler
+                           to wake up after each alert time.
+    """
+    # Monday 1st of June 2015, at 00:00 local time
+    start = time.mktime((2015, 6, 1, 0, 0, 0, 0, 0, -1))
+    clock = SimulatedClock(start)
+    dispatcher = AlarmDispatcher(max_workers=0, timeout=None, clock=clock)
+    scheduler = AlarmScheduler(dispatcher, clock)
+    alarms = create_alarms(number_alarms)
+    alerts = []
+
+    def alert_callback(kind, alarm_id):
+        def callback():
+            alerts.append((kind, alarm_id, clock.time()))
+        return callback
+
+    # Silence the alert messages printed for each alert
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        wall_start = time.time()
+        for alarm in alarms:
+            scheduler.set_alarm(
+                alarm, alarm_callback=alert_callback('alarm', alarm.id_),
+                offset_alarm_time=OFFSET_MINUTES,
+                offset_callback=alert_callback('offset', alarm.id_))
+        scheduler.run_pending()
+        while True:
+            next_alert = scheduler.get_next_alert_time()
+            if next_alert is None or next_alert >= start + WEEK_SECONDS:
+                break
+            clock.set_time(max(next_alert, clock.time()) +
+                           random.uniform(0, max_wake_delay))
+            scheduler.run_pending()
+        wall_time = time.time() - wall_start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    dispatcher.stop()
+
+    expected = expected_alerts(alarms, start)
+    received = {}
+    late = 0
+    for kind, alarm_id, alert_time in alerts:
+        minute_start = \
+            int(alert_time) - time.localtime(alert_time).tm_sec
+        key = (kind, alarm_id, minute_start)
+        received[key] = received.get(key, 0) + 1
+        if alert_time - minute_start > 1:
+            late += 1
+    print('Alarms: %d, with a %d minutes offset alert, max wake delay %.2f s' %
+          (number_alarms, OFFSET_MINUTES, max_wake_delay))
+    print('Expected alerts:   %6d' % len(expected))
+    print('Received alerts:   %6d' % len(alerts))
+    print('Missed alerts:     %6d' % len(expected - set(received)))
+    print('Duplicated alerts: %6d' %
+          sum(count - 1 for count in received.values()))
+    print('Late alerts:       %6d' % late)
+    print('Unexpected alerts: %6d' % len(set(received) - expected))
+    print('Simulated a week in %.3f s' % wall_time)
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    simulate_week(number, delay)
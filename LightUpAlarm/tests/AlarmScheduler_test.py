@@ -0,0 +1,525 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the AlarmScheduler class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import io
+import os
+import time
+import mock
+import unittest
+import threading
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+    from LightUpAlarm.Clock import SimulatedClock
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlarmDispatcher import AlarmDispatcher
+    from LightUpAlarm.Clock import SimulatedClock
+
+
+class AlarmSchedulerTestCase(unittest.TestCase):
+    """ Tests for AlarmScheduler class. """
+
+    #
+    # Helper methods
+    #
+    @staticmethod
+    def wait_for_minute_start():
+        """
+        Ensures there are at least 10 seconds left in the current minute.
+        :return: The current local time.
+        """
+        time_now = time.localtime(time.time())
+        while time_now.tm_sec > 50:
+            time.sleep(1)
+            time_now = time.localtime(time.time())
+        return time_now
+
+    def setUp(self):
+        self.scheduler = AlarmScheduler()
+        self.scheduler.start()
+        self.alerts = []
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.scheduler.join()
+
+    def alert_callback(self):
+        self.alerts.append('alert')
+
+    def offset_callback(self):
+        self.alerts.append('offset')
+
+    @staticmethod
+    def simulated_scheduler(start, grace_period=60):
+        """
+        :param start: Initial time of the simulated clock.
+        :param grace_period: Grace period for the scheduler.
+        :return: Tuple with a SimulatedClock and an AlarmScheduler using it,
+                 which executes the alerts inline.
+        """
+        clock = SimulatedClock(start)
+        scheduler = AlarmScheduler(
+            AlarmDispatcher(max_workers=0, timeout=None, clock=clock), clock,
+            grace_period=grace_period)
+        return clock, scheduler
+
+    @staticmethod
+    def replay(clock, scheduler, until):
+        """ Moves the clock to each alert time, until the given time. """
+        scheduler.run_pending()
+        while True:
+            next_alert = scheduler.get_next_alert_time()
+            if next_alert is None or next_alert >= until:
+                break
+            clock.set_time(next_alert + 0.5)
+            scheduler.run_pending()
+
+    def wait_for_alerts(self, number, seconds=3):
+        """ Waits until the given number of alerts have been triggered. """
+        for _ in range(seconds * 100):
+            if len(self.alerts) >= number:
+                break
+            time.sleep(0.01)
+        # Give time for any unexpected additional alert
+        time.sleep(0.1)
+
+    #
+    # Tests
+    #
+    def test_set_remove_alarm(self):
+        """ Tests registering, editing and removing alarms. """
+        alarm = AlarmItem(
+            10, 30, days=(True, True, True, True, True, True, True),
+            alarm_id=5)
+        self.assertFalse(self.scheduler.is_alarm_set(5))
+        self.assertIsNone(self.scheduler.get_next_alert_time())
+
+        self.scheduler.set_alarm(alarm)
+        self.assertTrue(self.scheduler.is_alarm_set(5))
+        self.assertIs(self.scheduler.get_alarm(5), alarm)
+        self.assertEqual(self.scheduler.get_alarm_ids(), [5])
+        self.assertIsNotNone(self.scheduler.get_next_alert_time())
+
+        # Inactive alarms are registered, but not queued
+        inactive_alarm = AlarmItem(10, 30, enabled=False, alarm_id=6)
+        self.scheduler.set_alarm(inactive_alarm)
+        self.assertTrue(self.scheduler.is_alarm_set(6))
+
+        self.assertTrue(self.scheduler.remove_alarm(5))
+        self.assertFalse(self.scheduler.remove_alarm(5))
+        self.assertFalse(self.scheduler.is_alarm_set(5))
+        self.assertIsNone(self.scheduler.get_alarm(5))
+        self.assertEqual(self.scheduler.get_alarm_ids(), [6])
+
+        self.scheduler.remove_all_alarms()
+        self.assertEqual(self.scheduler.get_alarm_ids(), [])
+        self.assertIsNone(self.scheduler.get_next_alert_time())
+
+    def test_set_remove_alarms(self):
+        """ Tests registering and removing several alarms at once. """
+        all_days = (True, True, True, True, True, True, True)
+        alarms = [AlarmItem(alarm_id % 24, alarm_id % 60, days=all_days,
+                            alarm_id=alarm_id) for alarm_id in range(1, 11)]
+        self.scheduler.set_alarms(alarms, alarm_callback=self.alert_callback)
+        self.assertEqual(sorted(self.scheduler.get_alarm_ids()),
+                         list(range(1, 11)))
+        self.assertIs(self.scheduler.get_alarm(3), alarms[2])
+
+        # Updating registered alarms keeps a single entry per alarm ID
+        edited_alarm = AlarmItem(5, 5, days=all_days, alarm_id=3)
+        self.scheduler.set_alarms([edited_alarm, alarms[0]])
+        self.assertEqual(len(self.scheduler.get_alarm_ids()), 10)
+        self.assertIs(self.scheduler.get_alarm(3), edited_alarm)
+
+        self.assertEqual(self.scheduler.remove_alarms([1, 2, 3, 20]), 3)
+        self.assertEqual(sorted(self.scheduler.get_alarm_ids()),
+                         list(range(4, 11)))
+        self.assertEqual(self.scheduler.remove_alarms(range(4, 11)), 7)
+        self.assertEqual(self.scheduler.get_alarm_ids(), [])
+        self.assertIsNone(self.scheduler.get_next_alert_time())
+
+    def test_next_alert_time(self):
+        """
+        Tests the queued alert time is the start of the alarm minute, and that
+        the earliest alert is at the front of the queue.
+        """
+        time_now = AlarmSchedulerTestCase.wait_for_minute_start()
+        start_of_minute = int(time.mktime(time_now)) - time_now.tm_sec
+        all_days = (True, True, True, True, True, True, True)
+        alarm_two_hours = AlarmItem(
+            (time_now.tm_hour + 2) % 24, time_now.tm_min, days=all_days,
+            alarm_id=1)
+        alarm_one_hour = AlarmItem(
+            (time_now.tm_hour + 1) % 24, time_now.tm_min, days=all_days,
+            alarm_id=2)
+
+        self.scheduler.set_alarm(alarm_two_hours)
+        self.assertEqual(self.scheduler.get_next_alert_time(),
+                         start_of_minute + 7200)
+        self.scheduler.set_alarm(alarm_one_hour)
+        self.assertEqual(self.scheduler.get_next_alert_time(),
+                         start_of_minute + 3600)
+
+        # An offset alert 90 minutes before the alarm goes first
+        self.scheduler.set_alarm(alarm_two_hours, offset_alarm_time=-90)
+        self.assertEqual(self.scheduler.get_next_alert_time(),
+                         start_of_minute + 1800)
+
+    def test_get_upcoming_alarms(self):
+        """
+        Tests the upcoming alarms do not include offset alerts or removed and
+        edited alarms entries still in the queue.
+        """
+        time_now = AlarmSchedulerTestCase.wait_for_minute_start()
+        all_days = (True, True, True, True, True, True, True)
+        alarms = [AlarmItem((time_now.tm_hour + hours) % 24, time_now.tm_min,
+                            days=all_days, alarm_id=hours)
+                  for hours in range(1, 6)]
+        self.scheduler.set_alarms(alarms, offset_alarm_time=-30)
+        upcoming = self.scheduler.get_upcoming_alarms()
+        self.assertEqual([alarm.id_ for _, alarm in upcoming], [1, 2, 3, 4, 5])
+
+        # Move alarm 1 to the end and remove alarm 2
+        self.scheduler.set_alarm(AlarmItem(
+            (time_now.tm_hour + 6) % 24, time_now.tm_min, days=all_days,
+            alarm_id=1))
+        self.scheduler.remove_alarm(2)
+        upcoming = self.scheduler.get_upcoming_alarms(3)
+        self.assertEqual([alarm.id_ for _, alarm in upcoming], [3, 4, 5])
+        upcoming = self.scheduler.get_upcoming_alarms(
+            until=upcoming[1][0])
+        self.assertEqual([alarm.id_ for _, alarm in upcoming], [3, 4])
+
+    def test_alert_current_minute(self):
+        """
+        Tests an alarm and offset alarm for the current minute are triggered
+        straight away, and only once even if the alarm is registered again.
+        """
+        time_now = AlarmSchedulerTestCase.wait_for_minute_start()
+        alarm = AlarmItem(
+            time_now.tm_hour, time_now.tm_min, alarm_id=3,
+            days=(True, True, True, True, True, True, True))
+        self.scheduler.set_alarm(
+            alarm, alarm_callback=self.alert_callback, offset_alarm_time=0,
+            offset_callback=self.offset_callback)
+        self.wait_for_alerts(2)
+        self.assertEqual(sorted(self.alerts), ['alert', 'offset'])
+
+        # Registering the same, or edited data, does not repeat the alert
+        self.scheduler.set_alarm(
+            alarm, alarm_callback=self.alert_callback, offset_alarm_time=0,
+            offset_callback=self.offset_callback)
+        edited_alarm = AlarmItem(
+            (time_now.tm_hour + 1) % 24, time_now.tm_min, alarm_id=3,
+            days=(True, True, True, True, True, True, True))
+        self.scheduler.set_alarm(
+            edited_alarm, alarm_callback=self.alert_callback)
+        self.scheduler.set_alarm(
+            alarm, alarm_callback=self.alert_callback, offset_alarm_time=0,
+            offset_callback=self.offset_callback)
+        self.wait_for_alerts(3, seconds=1)
+        self.assertEqual(len(self.alerts), 2)
+
+    def test_removed_alarm_no_alert(self):
+        """ Tests that a removed or deactivated alarm is not triggered. """
+        time_now = AlarmSchedulerTestCase.wait_for_minute_start()
+        alarm = AlarmItem(
+            time_now.tm_hour, time_now.tm_min, enabled=False, alarm_id=4,
+            days=(True, True, True, True, True, True, True))
+        self.scheduler.set_alarm(alarm, alarm_callback=self.alert_callback)
+        self.wait_for_alerts(1, seconds=1)
+        self.assertEqual(self.alerts, [])
+
+        # Queued for the next minute, moved to this minute and then removed
+        alarm.enabled = True
+        alarm.minute = (time_now.tm_min + 1) % 60
+        self.scheduler.set_alarm(alarm, alarm_callback=self.alert_callback)
+        alarm.minute = time_now.tm_min
+        self.scheduler.remove_alarm(alarm.id_)
+        self.wait_for_alerts(1, seconds=1)
+        self.assertEqual(self.alerts, [])
+
+    def test_single_thread(self):
+        """
+        Tests that registering many alarms does not launch any more threads and
+        that the scheduler stops promptly while waiting for the next alert.
+        """
+        numb_threads = threading.activeCount()
+        for alarm_id in range(1, 101):
+            self.scheduler.set_alarm(AlarmItem(
+                alarm_id % 24, alarm_id % 60, alarm_id=alarm_id,
+                days=(False, False, False, False, False, True, False)))
+        self.assertEqual(len(self.scheduler.get_alarm_ids()), 100)
+        self.assertEqual(threading.activeCount(), numb_threads)
+
+        start = time.time()
+        self.scheduler.stop()
+        self.scheduler.join(1)
+        self.assertFalse(self.scheduler.is_alive())
+        self.assertLess(time.time() - start, 1)
+
+    def test_simulated_clock(self):
+        """
+        Replays a week of alarms with a simulated clock, checking each alert is
+        triggered once, at its time, without running the scheduler thread.
+        """
+        # Monday 1st of June 2015, at 00:00 local time
+        start = time.mktime((2015, 6, 1, 0, 0, 0, 0, 0, -1))
+        clock = SimulatedClock(start)
+        scheduler = AlarmScheduler(
+            AlarmDispatcher(max_workers=0, timeout=None, clock=clock), clock)
+        alerts = []
+        scheduler.set_alarm(
+            AlarmItem(7, 10, alarm_id=1,
+                      days=(True, True, True, True, True, False, False)),
+            alarm_callback=lambda: alerts.append(('alert', clock.time())),
+            offset_alarm_time=-15,
+            offset_callback=lambda: alerts.append(('offset', clock.time())))
+        scheduler.set_alarm(
+            AlarmItem(23, 59, alarm_id=2,
+                      days=(False, False, False, False, False, False, True)),
+            alarm_callback=lambda: alerts.append(('sunday', clock.time())))
+
+        self.assertEqual(scheduler.run_pending(), 0)
+        while True:
+            next_alert = scheduler.get_next_alert_time()
+            if next_alert >= start + 7 * 24 * 60 * 60:
+                break
+            clock.set_time(next_alert + 0.5)
+            self.assertGreater(scheduler.run_pending(), 0)
+            self.assertEqual(scheduler.run_pending(), 0)
+
+        self.assertEqual(len(alerts), 11)
+        for alert, alert_time in alerts:
+            local_time = time.localtime(alert_time)
+            if alert == 'alert':
+                self.assertEqual((local_time.tm_hour, local_time.tm_min),
+                                 (7, 10))
+            elif alert == 'offset':
+                self.assertEqual((local_time.tm_hour, local_time.tm_min),
+                                 (6, 55))
+            else:
+                self.assertEqual(
+                    (local_time.tm_wday, local_time.tm_hour,
+                     local_time.tm_min), (6, 23, 59))
+        self.assertEqual([a for a, _ in alerts].count('alert'), 5)
+        self.assertEqual([a for a, _ in alerts].count('offset'), 5)
+
+    def test_multiple_offset_alerts(self):
+        """
+        Tests an alarm with several offset alerts, each with its own callback,
+        and editing the offset alerts of a registered alarm.
+        """
+        # Monday 1st of June 2015, at 06:00 local time
+        start = time.mktime((2015, 6, 1, 6, 0, 0, 0, 0, -1))
+        clock, scheduler = AlarmSchedulerTestCase.simulated_scheduler(start)
+        alerts = []
+
+        def callback(name):
+            return lambda: alerts.append(
+                (name, clock.localtime().tm_hour, clock.localtime().tm_min))
+
+        alarm = AlarmItem(7, 0, alarm_id=1,
+                          days=(True, False, False, False, False, False, False))
+        scheduler.set_alarm(
+            alarm, alarm_callback=callback('alarm'),
+            offset_alerts=[(-30, callback('heater')),
+                           (-15, callback('lights')),
+                           (-5, callback('coffee'))])
+        AlarmSchedulerTestCase.replay(clock, scheduler, start + 2 * 60 * 60)
+        self.assertEqual(alerts, [('heater', 6, 30), ('lights', 6, 45),
+                                  ('coffee', 6, 55), ('alarm', 7, 0)])
+
+        # Changing only the callbacks keeps the queued alerts
+        del alerts[:]
+        next_alert = scheduler.get_next_alert_time()
+        scheduler.set_alarm(
+            alarm, alarm_callback=callback('alarm'),
+            offset_alerts=[(-30, callback('radio')),
+                           (-15, callback('lights')),
+                           (-5, callback('coffee'))])
+        self.assertEqual(scheduler.get_next_alert_time(), next_alert)
+
+        # Changing the offset times reschedules them, the single offset alert
+        # goes before the list of offset alerts
+        scheduler.set_alarm(
+            alarm, alarm_callback=callback('alarm'), offset_alarm_time=60,
+            offset_callback=callback('after'),
+            offset_alerts=[(-10, callback('radio'))])
+        AlarmSchedulerTestCase.replay(
+            clock, scheduler, start + 8 * 24 * 60 * 60)
+        self.assertEqual(alerts, [('after', 8, 0), ('radio', 6, 50),
+                                  ('alarm', 7, 0), ('after', 8, 0)])
+
+    def test_timers(self):
+        """
+        Tests the one-shot timers are triggered once, and that they can be
+        replaced and cancelled.
+        """
+        start = time.mktime((2015, 6, 1, 7, 0, 0, 0, 0, -1))
+        clock, scheduler = AlarmSchedulerTestCase.simulated_scheduler(start)
+        alarm = AlarmItem(7, 0, alarm_id=1,
+                          days=(True, True, True, True, True, True, True))
+        scheduler.set_alarm(alarm, alarm_callback=self.alert_callback)
+        self.assertEqual(scheduler.run_pending(), 1)
+        scheduler.set_timer(1, start + 300, alarm, self.offset_callback)
+        self.assertEqual(scheduler.get_timer(1), start + 300)
+
+        # Replacing the timer discards the old one
+        scheduler.set_timer(1, start + 600, alarm, self.offset_callback)
+        clock.set_time(start + 300)
+        self.assertEqual(scheduler.run_pending(), 0)
+        self.assertEqual(self.alerts, ['alert'])
+        clock.set_time(start + 600)
+        self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual(self.alerts, ['alert', 'offset'])
+        self.assertIsNone(scheduler.get_timer(1))
+
+        # A cancelled timer, and a timer set again with the same ID
+        scheduler.set_timer(1, start + 900, alarm, self.offset_callback)
+        self.assertTrue(scheduler.cancel_timer(1))
+        self.assertFalse(scheduler.cancel_timer(1))
+        scheduler.set_timer(1, start + 1200, alarm, self.offset_callback)
+        clock.set_time(start + 900)
+        self.assertEqual(scheduler.run_pending(), 0)
+        clock.set_time(start + 1200)
+        self.assertEqual(scheduler.run_pending(), 1)
+
+        # Removing the alarms does not remove the timers
+        scheduler.set_timer(2, start + 1500, alarm, self.offset_callback)
+        scheduler.remove_alarm(1)
+        self.assertEqual(scheduler.get_next_alert_time(), start + 1500)
+        scheduler.remove_all_alarms()
+        self.assertIsNone(scheduler.get_timer(2))
+
+    def test_late_and_missed_alerts(self):
+        """
+        Tests that an alert delayed by a stall or suspend is triggered within
+        the grace period, and reported as missed after it.
+        """
+        # Monday 1st of June 2015, at 06:59 local time
+        start = time.mktime((2015, 6, 1, 6, 59, 0, 0, 0, -1))
+        clock, scheduler = AlarmSchedulerTestCase.simulated_scheduler(
+            start, grace_period=120)
+        self.assertEqual(scheduler.get_grace_period(), 120)
+        all_days = (True, True, True, True, True, True, True)
+        scheduler.set_alarm(AlarmItem(7, 0, days=all_days, alarm_id=1),
+                            alarm_callback=self.alert_callback)
+
+        # The process stalls past the alarm minute, but within the grace period
+        clock.set_time(start + 60 + 90)
+        self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual(self.alerts, ['alert'])
+
+        # The system is suspended past the next day alarm
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            clock.set_time(start + 24 * 60 * 60 + 60 + 300)
+            self.assertEqual(scheduler.run_pending(), 0)
+            self.assertIn('Missed', test_srderr.getvalue())
+        self.assertEqual(self.alerts, ['alert'])
+        self.assertEqual(scheduler.get_next_alert_time(),
+                         start + 2 * 24 * 60 * 60 + 60)
+
+        # Without a grace period late alerts are always triggered
+        clock, scheduler = AlarmSchedulerTestCase.simulated_scheduler(
+            start, grace_period=None)
+        self.assertIsNone(scheduler.get_grace_period())
+        scheduler.set_alarm(AlarmItem(7, 0, days=all_days, alarm_id=1),
+                            alarm_callback=self.alert_callback)
+        clock.set_time(start + 3 * 60 * 60)
+        self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual(self.alerts, ['alert', 'alert'])
+
+    def test_clock_set_back(self):
+        """
+        Tests that setting the clock back reschedules the alarms from the new
+        time, without repeating an alert within the same minute.
+        """
+        # Monday 1st of June 2015, at 07:00 local time
+        start = time.mktime((2015, 6, 1, 7, 0, 0, 0, 0, -1))
+        clock, scheduler = AlarmSchedulerTestCase.simulated_scheduler(start)
+        all_days = (True, True, True, True, True, True, True)
+        scheduler.set_alarm(AlarmItem(7, 0, days=all_days, alarm_id=1),
+                            alarm_callback=self.alert_callback)
+        scheduler.set_alarm(AlarmItem(6, 30, days=all_days, alarm_id=2),
+                            alarm_callback=self.offset_callback)
+        clock.set_time(start + 40)
+        self.assertEqual(scheduler.run_pending(), 1)
+
+        # Set back within the alarm minute
+        clock.set_time(start + 20)
+        self.assertEqual(scheduler.run_pending(), 0)
+        self.assertEqual(self.alerts, ['alert'])
+
+        # Set back a day and an hour, the alarms of the day are alerted again
+        clock.set_time(start - 25 * 60 * 60)
+        self.assertEqual(scheduler.run_pending(), 0)
+        self.assertEqual(scheduler.get_next_alert_time(),
+                         start - 24 * 60 * 60 - 30 * 60)
+        AlarmSchedulerTestCase.replay(clock, scheduler, start + 60)
+        self.assertEqual(self.alerts,
+                         ['alert', 'offset', 'alert', 'offset', 'alert'])
+
+    def test_daylight_saving_time(self):
+        """
+        Tests that the alarms keep their local time across the daylight saving
+        time changes, and that the alarms in the repeated or skipped hour are
+        alerted once.
+        """
+        if not hasattr(time, 'tzset'):
+            self.skipTest('Time zone cannot be changed in this system')
+        original_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/London'
+        time.tzset()
+        try:
+            # Clock goes forward on 29/03/2015 and back on 25/10/2015
+            for month, day in ((3, 28), (10, 24)):
+                start = time.mktime((2015, month, day, 12, 0, 0, 0, 0, -1))
+                clock, scheduler = \
+                    AlarmSchedulerTestCase.simulated_scheduler(start)
+                all_days = (True, True, True, True, True, True, True)
+                alerts = []
+                for alarm_id, hour, minute in ((1, 1, 30), (2, 7, 0)):
+                    scheduler.set_alarm(
+                        AlarmItem(hour, minute, days=all_days,
+                                  alarm_id=alarm_id),
+                        alarm_callback=lambda alarm_id=alarm_id:
+                            alerts.append((alarm_id, clock.localtime())))
+                AlarmSchedulerTestCase.replay(
+                    clock, scheduler, start + 2 * 24 * 60 * 60)
+
+                local_times = [(alarm_id, local_time.tm_mday,
+                                local_time.tm_hour, local_time.tm_min)
+                               for alarm_id, local_time in alerts]
+                if month == 3:
+                    # 01:30 does not exist, alerted when it skips to 02:00
+                    expected = [(1, 29, 2, 0), (2, 29, 7, 0),
+                                (1, 30, 1, 30), (2, 30, 7, 0)]
+                else:
+                    expected = [(1, 25, 1, 30), (2, 25, 7, 0),
+                                (1, 26, 1, 30), (2, 26, 7, 0)]
+                self.assertEqual(local_times, expected)
+        finally:
+            if original_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = original_tz
+            time.tzset()
+
+
+if __name__ == '__main__':
+    unittest.main()
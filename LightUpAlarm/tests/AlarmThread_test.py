@@ -6,15 +6,15 @@
 # Copyright (c) 2015 carlosperate https://github.com/carlosperate/
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
-# This only tests the class methods in the current main thread. The Threading
-# aspect is tested in the AlarmManager Unit test when the methods responsible
-# to launch, stop and track the threads are tested.
+# Most tests run the class methods in the current main thread, only stopping
+# and editing running threads is tested with the threads running.
 #
 from __future__ import unicode_literals, absolute_import
 import io
 import time
 import mock
 import unittest
+import threading
 from datetime import datetime, timedelta
 try:
     from LightUpAlarm.AlarmItem import AlarmItem
@@ -189,6 +189,74 @@ class AlarmThreadTestCase(unittest.TestCase):
             offset_callback=bad_callback)
         self.assertRaises(TypeError, alarm_thread.run)
 
+    def test_stop(self):
+        """
+        Tests that stopping 100 running threads takes effect without waiting for
+        the threads next time check.
+        """
+        alarm_threads = []
+        for alarm_id in range(100):
+            alarm_thread = AlarmThread(AlarmItem(
+                alarm_id % 24, alarm_id % 60, enabled=True, alarm_id=alarm_id,
+                days=(False, False, False, False, False, False, False)),
+                alarm_callback=AlarmThreadTestCase.empty_callback,
+                offset_alarm_time=-15)
+            alarm_thread.start()
+            alarm_threads.append(alarm_thread)
+        # Ensure all threads are waiting for their next check
+        time.sleep(0.1)
+
+        start = time.time()
+        for alarm_thread in alarm_threads:
+            alarm_thread.stop()
+        for alarm_thread in alarm_threads:
+            alarm_thread.join(1)
+        self.assertLess(time.time() - start, 0.05)
+        for alarm_thread in alarm_threads:
+            self.assertFalse(alarm_thread.is_alive())
+
+    def test_edit_alarm_running(self):
+        """
+        Tests that editing the alarm of a running thread to the current minute
+        triggers the alert straight away, and only once.
+        """
+        alerts = []
+        alert_event = threading.Event()
+
+        def callback():
+            alerts.append(time.time())
+            alert_event.set()
+
+        time_now = time.localtime(time.time())
+        while time_now.tm_sec > 50:
+            time.sleep(1)
+            time_now = time.localtime(time.time())
+
+        all_days = (True, True, True, True, True, True, True)
+        alarm_thread = AlarmThread(
+            AlarmItem((time_now.tm_hour + 1) % 24, time_now.tm_min,
+                      enabled=True, alarm_id=98, days=all_days),
+            alarm_callback=callback)
+        alarm_thread.start()
+        time.sleep(0.1)
+        self.assertEqual(alerts, [])
+
+        edit_time = time.time()
+        alarm_thread.edit_alarm(AlarmItem(
+            time_now.tm_hour, time_now.tm_min, enabled=True, alarm_id=98,
+            days=all_days))
+        self.assertTrue(alert_event.wait(1))
+        self.assertLess(alerts[0] - edit_time, 0.5)
+
+        # Editing again during the same minute does not repeat the alert
+        alarm_thread.edit_alarm(AlarmItem(
+            time_now.tm_hour, time_now.tm_min, enabled=True, alarm_id=98,
+            days=all_days))
+        time.sleep(0.1)
+        self.assertEqual(len(alerts), 1)
+        alarm_thread.stop()
+        alarm_thread.join()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the SystemClock and SimulatedClock classes.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import time
+import unittest
+import threading
+try:
+    from LightUpAlarm.Clock import SystemClock, SimulatedClock
+    from LightUpAlarm.WakeEvent import WakeEvent
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.Clock import SystemClock, SimulatedClock
+    from LightUpAlarm.WakeEvent import WakeEvent
+
+
+class ClockTestCase(unittest.TestCase):
+    """ Tests for the SystemClock and SimulatedClock classes. """
+
+    def test_system_clock(self):
+        """ Tests the SystemClock follows the system time. """
+        clock = SystemClock()
+        self.assertLess(abs(clock.time() - time.time()), 1)
+        self.assertEqual(clock.localtime(1000000), time.localtime(1000000))
+        wake_event = WakeEvent()
+        start = time.time()
+        clock.wait(wake_event, 0.05)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        wake_event.close()
+
+    def test_simulated_time(self):
+        """ Tests the simulated time only changes when advanced or set. """
+        clock = SimulatedClock(1000)
+        self.assertEqual(clock.time(), 1000)
+        time.sleep(0.01)
+        self.assertEqual(clock.time(), 1000)
+        clock.advance(60.5)
+        self.assertEqual(clock.time(), 1060.5)
+        self.assertEqual(clock.localtime(), time.localtime(1060.5))
+        # The time can go backwards
+        clock.set_time(500)
+        self.assertEqual(clock.time(), 500)
+
+    def test_simulated_sleep(self):
+        """ Tests a sleeping thread is woken up once the time is reached. """
+        clock = SimulatedClock(1000)
+        results = []
+        sleep_thread = threading.Thread(
+            target=lambda: results.append(clock.sleep(10) or clock.time()))
+        sleep_thread.daemon = True
+        sleep_thread.start()
+        time.sleep(0.05)
+        clock.advance(5)
+        sleep_thread.join(0.1)
+        self.assertTrue(sleep_thread.is_alive())
+        clock.advance(5)
+        sleep_thread.join(1)
+        self.assertFalse(sleep_thread.is_alive())
+        self.assertEqual(results, [1010])
+
+    def test_simulated_wait(self):
+        """ Tests waiting on a WakeEvent with a simulated timeout. """
+        clock = SimulatedClock(1000)
+        wake_event = WakeEvent()
+        results = []
+
+        def waiter(timeout):
+            clock.wait(wake_event, timeout)
+            results.append(clock.time())
+
+        # Woken up by the time advancing past the timeout
+        wait_thread = threading.Thread(target=waiter, args=(30, ))
+        wait_thread.daemon = True
+        wait_thread.start()
+        time.sleep(0.05)
+        clock.advance(20)
+        wait_thread.join(0.1)
+        self.assertTrue(wait_thread.is_alive())
+        clock.advance(20)
+        wait_thread.join(1)
+        self.assertFalse(wait_thread.is_alive())
+        self.assertEqual(results, [1040])
+
+        # Woken up by the event, without the time changing
+        wait_thread = threading.Thread(target=waiter, args=(30, ))
+        wait_thread.daemon = True
+        wait_thread.start()
+        time.sleep(0.05)
+        wake_event.set()
+        wait_thread.join(1)
+        self.assertFalse(wait_thread.is_alive())
+        self.assertEqual(results, [1040, 1040])
+
+        # An expired timeout returns straight away
+        clock.wait(wake_event, 0)
+        wake_event.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
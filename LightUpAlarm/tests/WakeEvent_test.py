@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the WakeEvent class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import time
+import unittest
+import threading
+try:
+    from LightUpAlarm.WakeEvent import WakeEvent
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.WakeEvent import WakeEvent
+
+
+class WakeEventTestCase(unittest.TestCase):
+    """ Tests for WakeEvent class. """
+
+    def test_wait_timeout(self):
+        """ Tests waiting on the event without it being set. """
+        wake_event = WakeEvent()
+        start = time.time()
+        self.assertFalse(wake_event.wait(0.1))
+        self.assertGreaterEqual(time.time() - start, 0.09)
+        wake_event.close()
+
+    def test_set_before_wait(self):
+        """ Tests the event is cleared by each wait. """
+        wake_event = WakeEvent()
+        wake_event.set()
+        wake_event.set()
+        self.assertTrue(wake_event.wait(1))
+        self.assertFalse(wake_event.wait(0))
+        # After the first wait opens the pipe
+        wake_event.set()
+        self.assertTrue(wake_event.wait(1))
+        self.assertFalse(wake_event.wait(0))
+        wake_event.close()
+        # Once closed it still works
+        wake_event.set()
+        self.assertTrue(wake_event.wait(1))
+        self.assertFalse(wake_event.wait(0.01))
+
+    def test_set_from_thread(self):
+        """ Tests a waiting thread is woken up as soon as the event is set. """
+        wake_event = WakeEvent()
+        results = []
+
+        def waiter():
+            results.append(wake_event.wait(10))
+            results.append(time.time())
+            wake_event.close()
+
+        wait_thread = threading.Thread(target=waiter)
+        wait_thread.start()
+        time.sleep(0.1)
+        set_time = time.time()
+        wake_event.set()
+        wait_thread.join(1)
+        self.assertFalse(wait_thread.is_alive())
+        self.assertTrue(results[0])
+        self.assertLess(results[1] - set_time, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,8 +11,8 @@ from __future__ import (unicode_literals, absolute_import, print_function,
 import sys
 import time
 import types
-import random
 import threading
+import traceback
 try:
     from LightUpHardware import HardwareLightBulb
     from LightUpHardware import HardwareSwitch
@@ -43,6 +43,9 @@ class HardwareThread(object):
     __coffee_time = None
     __total_time = None
     __running = False
+    __running_condition = threading.Condition()
+    __clock = time
+    __progress_callback = None
     __thread = None
     __threads = []
 
@@ -85,7 +88,7 @@ class HardwareThread(object):
     __metaclass__ = __HardwareThreadMetaclass
 
     def __new__(cls, lamp=None, room_light=None, coffee_time=None,
-                total_time=None):
+                total_time=None, clock=None, progress_callback=None):
         """
         The new constructor is edited directly to be able to control this class
         instance creation and apply a singleton pattern. Set strict control of
@@ -98,6 +101,13 @@ class HardwareThread(object):
                             to start.
         :param total_time: Integer, total time for the entire entire hardware
                            control process to take.
+        :param clock: Object with time() and sleep() methods used to time the
+                      hardware launches, like the time module (used by
+                      default) or a LightUpAlarm SimulatedClock.
+        :param progress_callback: Function called with the stage name ('start',
+                                  'lamp', 'room_light', 'coffee' or 'finish')
+                                  and the seconds elapsed since the start, as
+                                  the hardware sequence progresses.
         :return: HardwareThread singleton instance.
         """
         # Create singleton instance if __singleton is None
@@ -148,6 +158,11 @@ class HardwareThread(object):
             cls.coffee_time = coffee_time
         if total_time is not None:
             cls.total_time = total_time
+        if clock is not None:
+            cls.__clock = clock
+        if progress_callback is not None:
+            # As a staticmethod, so the function is not bound to the class
+            cls.__progress_callback = staticmethod(progress_callback)
 
         return cls.__singleton
 
@@ -174,7 +189,11 @@ class HardwareThread(object):
         cls.__room_light_duration = None
         cls.__coffee_time = None
         cls.__total_time = None
-        cls.__running = False
+        cls.__clock = time
+        cls.__progress_callback = None
+        with cls.__running_condition:
+            cls.__running = False
+            cls.__running_condition.notify_all()
         cls.__thread = None
         cls.__threads = []
 
@@ -379,6 +398,21 @@ class HardwareThread(object):
         cls.__threads.append(t)
         t.start()
 
+    @classmethod
+    def __progress(cls, stage, start_time):
+        """
+        Calls the progress callback, if set, printing any exception it raises.
+        :param stage: String with the name of the stage reached.
+        :param start_time: Time, in seconds, the sequence started.
+        """
+        if cls.__progress_callback is None:
+            return
+        try:
+            cls.__progress_callback(stage, cls.__clock.time() - start_time)
+        except Exception:
+            print('ERROR: The HardwareThread progress callback raised an '
+                  'exception:\n%s' % traceback.format_exc(), file=sys.stderr)
+
     @classmethod
     def __run(cls):
         """
@@ -386,7 +420,7 @@ class HardwareThread(object):
         It launches the individual hardware threads at the times indicated by
         their variables.
         """
-        start_time = time.time()
+        start_time = cls.__clock.time()
         time_lamp = start_time + cls.lamp_time
         time_room = start_time + cls.room_light_time
         time_coffee = start_time + cls.coffee_time
@@ -394,26 +428,33 @@ class HardwareThread(object):
         lamp_launched = False
         room_launched = False
         coffee_launched = False
+        cls.__progress('start', start_time)
 
         # Time controlled loop to launch the required hardware functions
-        current_time = time.time()
+        current_time = cls.__clock.time()
         while current_time < end_time:
             if time_lamp < current_time and lamp_launched is False:
                 lamp_launched = True
                 cls._launch_lamp()
+                cls.__progress('lamp', start_time)
             if time_room < current_time and room_launched is False:
                 room_launched = True
                 cls._launch_room_light()
+                cls.__progress('room_light', start_time)
             if time_coffee < current_time and coffee_launched is False:
                 coffee_launched = True
                 cls._launch_coffee()
-            time.sleep(0.01)
-            current_time = time.time()
+                cls.__progress('coffee', start_time)
+            cls.__clock.sleep(0.01)
+            current_time = cls.__clock.time()
 
         # Don't wait for the threads to join, as it would overrun the requested
         # runtime. Ending this thread will kill its children (daemon=True).
         print('HardwareThread run finished.')
-        cls.__running = False
+        cls.__progress('finish', start_time)
+        with cls.__running_condition:
+            cls.__running = False
+            cls.__running_condition.notify()
 
     @classmethod
     def start(cls):
@@ -428,14 +469,15 @@ class HardwareThread(object):
         if variables_ok is False:
             return
 
-        # Setting a lock for safe reentry, not unlocked here, as it will exit as
-        # soon as the thread is launched, so unlocked at the end of cls.__run()
-        if cls.__running is True:
-            print("WARNING: LightUp Hardware already running, thread waiting.",
-                  file=sys.stderr)
-            while cls.__running is True:
-                time.sleep(float(random.randint(1, 100)) / 1000.0)
-        cls.__running = True
+        # Setting a flag for safe reentry, not cleared here, as it will exit as
+        # soon as the thread is launched, so cleared at the end of cls.__run()
+        with cls.__running_condition:
+            if cls.__running is True:
+                print("WARNING: LightUp Hardware already running, thread "
+                      "waiting.", file=sys.stderr)
+                while cls.__running is True:
+                    cls.__running_condition.wait()
+            cls.__running = True
 
         # Launch thread
         print('Running the Hardware Thread:\n\t'
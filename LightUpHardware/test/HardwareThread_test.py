@@ -16,6 +16,7 @@ import unittest
 import threading
 try:
     from LightUpHardware.HardwareThread import HardwareThread
+    from LightUpAlarm.Clock import SimulatedClock
 except ImportError:
     import os
     import sys
@@ -24,6 +25,7 @@ except ImportError:
     sys.path.insert(0, package_dir)
     print("path added: %s" % package_dir)
     from LightUpHardware.HardwareThread import HardwareThread
+    from LightUpAlarm.Clock import SimulatedClock
 
 
 class HardwareThreadTestCase(unittest.TestCase):
@@ -616,6 +618,64 @@ class HardwareThreadTestCase(unittest.TestCase):
         end_time = time.time()
         self.assertAlmostEqual(2*2, end_time - start_time, delta=0.1*2)
 
+    def test_simulated_clock(self):
+        """
+        Tests that the hardware launches follow the time of the clock provided
+        to the constructor, using a simulated clock that is advanced by the
+        test instead of waiting for the real time, and the progress callback.
+        """
+        if HardwareThread._HardwareThread__singleton is not None:
+            HardwareThread._drop()
+
+        def wait_for_call(launch_mock):
+            for _ in range(100):
+                if launch_mock.called:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(launch_mock.called)
+
+        progress = []
+        clock = SimulatedClock(1000)
+        hw_thread_instance = HardwareThread(
+            lamp=(0, 2), room_light=(1, 2), coffee_time=3, total_time=5,
+            clock=clock,
+            progress_callback=lambda stage, elapsed: progress.append(
+                (stage, elapsed)))
+        with mock.patch.object(HardwareThread, '_launch_lamp') as lamp, \
+                mock.patch.object(HardwareThread, '_launch_room_light') as \
+                room_light, \
+                mock.patch.object(HardwareThread, '_launch_coffee') as coffee:
+            hw_thread_instance.start()
+            time.sleep(0.1)
+            self.assertFalse(lamp.called)
+
+            clock.advance(0.5)
+            wait_for_call(lamp)
+            time.sleep(0.05)
+            self.assertFalse(room_light.called)
+
+            clock.advance(1)
+            wait_for_call(room_light)
+            time.sleep(0.05)
+            self.assertFalse(coffee.called)
+            self.assertTrue(hw_thread_instance.isAlive())
+
+            clock.advance(2)
+            wait_for_call(coffee)
+            clock.advance(2)
+            for _ in range(100):
+                if not hw_thread_instance.isAlive():
+                    break
+                time.sleep(0.01)
+            self.assertFalse(hw_thread_instance.isAlive())
+            self.assertEqual(lamp.call_count, 1)
+            self.assertEqual(room_light.call_count, 1)
+            self.assertEqual(coffee.call_count, 1)
+        self.assertEqual(progress, [('start', 0), ('lamp', 0.5),
+                                    ('room_light', 1.5), ('coffee', 3.5),
+                                    ('finish', 5.5)])
+        HardwareThread._drop()
+
 
 if __name__ == '__main__':
     unittest.main()
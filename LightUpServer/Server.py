@@ -9,18 +9,26 @@
 #
 # Longer description.
 #
-from __future__ import unicode_literals, absolute_import
+from __future__ import unicode_literals, absolute_import, print_function
 import os
+import sys
 import datetime
 import logging
 from flask import Flask
 from flask import Response
 from flask import request, redirect, jsonify, render_template, \
-    send_from_directory
+    send_from_directory, has_request_context
 try:
     from LightUpServer.ServerAlarmAdapter import ServerAlarmAdapter
+    from LightUpServer.ServerEventBroadcaster import ServerEventBroadcaster
 except ImportError:
     from ServerAlarmAdapter import ServerAlarmAdapter
+    from ServerEventBroadcaster import ServerEventBroadcaster
+try:
+    import waitress
+except ImportError:
+    # Only required for the production server mode
+    waitress = None
 
 
 # Creating flask instance
@@ -32,12 +40,42 @@ alarm_adapt = None
 # Callback function to be executed every time there is an alarm change
 callback_func = None
 
+# Broadcaster of the events for the /LightUpPi/events stream clients
+event_broadcaster = ServerEventBroadcaster()
+
 
 def callback():
     if callback_func is not None:
         callback_func()
 
 
+def publish_alarm_event(event_type, data):
+    """
+    AlarmManager event listener, publishes the alarm events to the events
+    stream. The alarm changes requested to this server also run the callback.
+    :param event_type: String with the event type.
+    :param data: Dictionary with the event data.
+    """
+    data = dict(data)
+    if 'alarm' in data:
+        data['alarm'] = ServerAlarmAdapter.alarm_to_dict(data['alarm'])
+    event_broadcaster.publish(event_type, data)
+    if event_type in ('add', 'edit', 'delete', 'delete_all') and \
+            has_request_context():
+        callback()
+
+
+def publish_hardware_progress(stage, elapsed):
+    """
+    HardwareThread progress callback, publishes the hardware sequence
+    progress to the events stream.
+    :param stage: String with the name of the stage reached.
+    :param elapsed: Seconds elapsed since the start of the sequence.
+    """
+    event_broadcaster.publish(
+        'hardware', {'stage': stage, 'elapsed': round(elapsed, 1)})
+
+
 @flask_server.route('/')
 def root_index_redirect():
     """ Redirects the LightUpPi dir directly to /LightUpPi/ """
@@ -75,23 +113,53 @@ def template_test():
     return render_template('main.html', **templateData)
 
 
+def tagged_response(json_response, etag):
+    """
+    Creates a json response with an entity tag, to be revalidated by the
+    clients on every request.
+    :param json_response: String with the json data, or None for a 304 Not
+                          Modified response.
+    :param etag: String with the entity tag, without quotes.
+    :return: Flask Response.
+    """
+    if json_response is None:
+        response = Response(status=304)
+    else:
+        response = Response(json_response, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @flask_server.route('/LightUpPi/getAlarm', methods=['GET'])
 def get_alarm():
-    callback()
+    """
+    Gets the data of an alarm, or of all the alarms.
+    The responses carry an ETag of the alarms data revision, so a request with
+    a matching If-None-Match header gets a 304 Not Modified response without
+    the alarms being read.
+    The full request is: /LightUpPi/getAlarm?id=<alarm_id or all>
+    """
     global alarm_adapt
     message = {'error': 'The \'id\' argument is required for \'getAlarm\''}
     alarm_id = request.args.get('id')
     if alarm_id is not None:
+        # The tag is read before the alarms, so it is never newer than them
+        etag = alarm_adapt.get_alarms_etag()
         if alarm_id == 'all':
             # /LightUpPi/getAlarm?id=all
+            if request.if_none_match.contains(etag):
+                return tagged_response(None, etag)
             json_response = alarm_adapt.json_get_all_alarms()
-            return Response(json_response,  mimetype='application/json')
+            return tagged_response(json_response, etag)
         else:
             # /LightUpPi/getAlarm?id=<alarm_id>
             try:
                 alarm_id = int(alarm_id)
+                if request.if_none_match.contains(etag):
+                    return tagged_response(None, etag)
                 json_response = alarm_adapt.json_get_alarm(int(alarm_id))
-                return Response(json_response,  mimetype='application/json')
+                return tagged_response(json_response, etag)
             except ValueError:
                 message['error'] = 'The \'id\' argument has to be an integer'
 
@@ -343,15 +411,127 @@ def delete_alarm():
     return jsonify(message)
 
 
-def run(alarm_mgr_arg, silent=False, callback_arg=None):
+@flask_server.route('/LightUpPi/snooze', methods=['GET'])
+def snooze_alarm():
+    """
+    Snoozes an alarm, so that it alerts again after the snooze time.
+    The full request is: /LightUpPi/snooze?id=<alarm_id>
+    """
+    global alarm_adapt
+    message = {'error': 'The \'id\' argument is required for \'snooze\''}
+    alarm_id = request.args.get('id')
+    if alarm_id is not None:
+        try:
+            alarm_id = int(alarm_id)
+            json_response = alarm_adapt.json_snooze_alarm(alarm_id)
+            return Response(json_response,  mimetype='application/json')
+        except ValueError:
+            message['error'] = 'The \'id\' argument has to be an integer'
+
+    # At this point credentials were invalid or request method was not GET
+    return jsonify(message)
+
+
+@flask_server.route('/LightUpPi/dismiss', methods=['GET'])
+def dismiss_alarm():
+    """
+    Dismisses an alarm, cancelling its snooze.
+    The full request is: /LightUpPi/dismiss?id=<alarm_id>
+    """
+    global alarm_adapt
+    message = {'error': 'The \'id\' argument is required for \'dismiss\''}
+    alarm_id = request.args.get('id')
+    if alarm_id is not None:
+        try:
+            alarm_id = int(alarm_id)
+            json_response = alarm_adapt.json_dismiss_alarm(alarm_id)
+            return Response(json_response,  mimetype='application/json')
+        except ValueError:
+            message['error'] = 'The \'id\' argument has to be an integer'
+
+    # At this point credentials were invalid or request method was not GET
+    return jsonify(message)
+
+
+@flask_server.route('/LightUpPi/batch', methods=['POST'])
+def batch_operations():
+    """
+    Applies several alarm operations in a single request and database
+    transaction, with the alarm threads updated a single time. The json body
+    is a list of operations, each one with an 'op' ('add', 'edit' or 'delete')
+    and the same arguments as the addAlarm, editAlarm and deleteAlarm requests:
+    [{"op": "add", "hour": 7, "minute": 30, "sunday": false},
+     {"op": "edit", "id": 2, "enabled": false},
+     {"op": "delete", "id": 3}]
+    All the operations are validated first, and they are only saved if all of
+    them succeed. The response contains the result of each operation.
+    The full request is: POST /LightUpPi/batch
+    """
+    global alarm_adapt
+    operations = request.get_json(force=True, silent=True)
+    if not isinstance(operations, list):
+        message = {'error': 'The request body must be a json list of '
+                            'operations'}
+        return jsonify(message)
+    json_response = alarm_adapt.json_apply_operations(operations)
+    return Response(json_response, mimetype='application/json')
+
+
+@flask_server.route('/LightUpPi/sync', methods=['GET', 'POST'])
+def sync_alarms():
+    """
+    Synchronises the alarms with other systems, identifying each alarm by its
+    'uid', as the alarm IDs are local to each system.
+    A GET request returns the alarms changed, and the alarms deleted, after an
+    alarms revision, with the current 'revision' to be used as 'since' in the
+    next request. A revision older than the kept deletions gets all the alarms
+    with 'full' set to true, and the client has to replace its alarms with
+    them. The full request is: /LightUpPi/sync?since=<revision>
+    A POST request applies the changes from another system, with a json body
+    in the same format as the GET response. The newest timestamp wins, so the
+    changes older than the local alarms are ignored.
+    """
+    global alarm_adapt
+    if request.method == 'POST':
+        changes = request.get_json(force=True, silent=True)
+        if not isinstance(changes, dict):
+            message = {'error': 'The request body must be a json object'}
+            return jsonify(message)
+        json_response = alarm_adapt.json_apply_changes(changes)
+        return Response(json_response, mimetype='application/json')
+
+    since = request.args.get('since', 0)
+    try:
+        since = int(since)
+    except ValueError:
+        message = {'error': 'The \'since\' argument must be an integer'}
+        return jsonify(message)
+    json_response = alarm_adapt.json_get_changes(since)
+    return Response(json_response, mimetype='application/json')
+
+
+def setup(alarm_mgr_arg, silent=False, callback_arg=None):
+    """
+    Attaches the AlarmManager to the server and sets the static folder. All
+    the requests share this AlarmManager, so there is a single alarm scheduler
+    however many server threads are used.
+    :param alarm_mgr_arg: AlarmManager instance for the server to use.
+    :param silent: Boolean to only log the server errors.
+    :param callback_arg: Function to execute every time there is an alarm
+                         change.
+    """
     global alarm_adapt, callback_func
+    if alarm_adapt is not None:
+        alarm_adapt.alarm_mgr.remove_event_listener(publish_alarm_event)
     alarm_adapt = ServerAlarmAdapter(alarm_mgr_arg)
+    alarm_mgr_arg.add_event_listener(publish_alarm_event)
     callback_func = callback_arg
 
     # Set up logging
     if silent is True:
-        log = logging.getLogger('werkzeug')
-        log.setLevel(logging.ERROR)
+        for logger_name in ('werkzeug', 'waitress'):
+            log = logging.getLogger(logger_name)
+            log.setLevel(logging.ERROR)
 
     # Setting the static folder
     static_dir = os.path.join(
@@ -360,5 +540,93 @@ def run(alarm_mgr_arg, silent=False, callback_arg=None):
     global flask_server
     flask_server.static_folder = static_dir
 
-    # Run flask
-    flask_server.run(host='0.0.0.0', port=80, debug=False)
+
+def create_production_server(host='0.0.0.0', port=80, threads=8,
+                             keep_alive=60):
+    """
+    Creates a waitress WSGI server for the flask application. It serves the
+    requests from a pool of threads in this process, as separate worker
+    processes would each run their own alarm scheduler. Each connected events
+    stream client keeps a thread busy, so the events streams are limited to
+    half of the threads, and the clients over that limit poll the alarms.
+    :param host: String with the address to bind the server to.
+    :param port: Integer with the port to listen to.
+    :param threads: Integer with the number of threads serving requests.
+    :param keep_alive: Time, in seconds, an idle keep-alive connection is kept
+                       open.
+    :return: The waitress server, to be started with its run() method, or None
+             if waitress is not installed.
+    """
+    if waitress is None:
+        print('ERROR: The waitress package needs to be installed for the '
+              'production server.', file=sys.stderr)
+        return None
+    # The other half of the threads is kept for the rest of the requests
+    event_broadcaster.set_max_subscribers(threads // 2)
+    # Without a minimum size to send data the small event stream messages are
+    # sent straight away. Each events stream keeps a connection and a thread,
+    # so the connections limit allows for those and other 100 connections.
+    return waitress.create_server(
+        flask_server, host=host, port=port, threads=threads,
+        channel_timeout=keep_alive, send_bytes=1,
+        connection_limit=threads + 100)
+
+
+@flask_server.route('/LightUpPi/events', methods=['GET'])
+def events():
+    """
+    Server-Sent Events stream with the alarm changes ('add', 'edit', 'delete'
+    and 'delete_all'), alerts ('alert' and 'offset_alert'), snoozes ('snooze'
+    and 'dismiss') and the hardware sequence progress ('hardware'). The data of
+    each event is json, and the alarm changes include the alarms 'revision'.
+    A client that falls too far behind receives a 'dropped' event and the
+    stream ends, so it has to reload the alarms before connecting again.
+    Every stream keeps a server thread busy while it is connected, so when the
+    maximum number of streams is reached the request fails with a 503 status
+    and the client has to poll the alarms instead.
+    The full request is: /LightUpPi/events
+    """
+    subscriber_id = event_broadcaster.subscribe()
+    if subscriber_id is None:
+        message = {'error': 'Too many events streams, poll the alarms instead'}
+        response = jsonify(message)
+        response.status_code = 503
+        return response
+    response = Response(event_broadcaster.stream(subscriber_id),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def run(alarm_mgr_arg, silent=False, callback_arg=None, host='0.0.0.0',
+        port=80, production=False, threads=8, keep_alive=60):
+    """
+    Launches the server, blocking until it is stopped.
+    :param alarm_mgr_arg: AlarmManager instance for the server to use.
+    :param silent: Boolean to only log the server errors.
+    :param callback_arg: Function to execute every time there is an alarm
+                         change.
+    :param host: String with the address to bind the server to.
+    :param port: Integer with the port to listen to.
+    :param production: Boolean to run the flask application with the waitress
+                       WSGI server instead of the flask development server,
+                       which serves a single request at a time.
+    :param threads: Integer with the number of threads serving requests in
+                    the production server, half of them available for the
+                    events streams.
+    :param keep_alive: Time, in seconds, the production server keeps an idle
+                       keep-alive connection open.
+    """
+    setup(alarm_mgr_arg, silent=silent, callback_arg=callback_arg)
+
+    if production is True:
+        server = create_production_server(
+            host=host, port=port, threads=threads, keep_alive=keep_alive)
+        if server is not None:
+            server.run()
+            return
+        print('Falling back to the flask development server.',
+              file=sys.stderr)
+
+    # Run flask, threaded so that the events streams do not block the server
+    flask_server.run(host=host, port=port, debug=False, threaded=True)
@@ -12,6 +12,8 @@
 #
 from __future__ import unicode_literals, absolute_import
 import json
+import uuid
+from LightUpAlarm.AlarmItem import AlarmItem
 #try:
 #    from LightUpAlarm.AlarmManager import AlarmManager
 #except ImportError:
@@ -38,6 +40,11 @@ class ServerAlarmAdapter(object):
         :return:
         """
         self.alarm_mgr = alarm_mgr
+        # The ETags combine the AlarmManager alarms revision with a prefix
+        # unique to this instance, as the revision restarts with the manager
+        self.__etag_prefix = uuid.uuid4().hex[:8]
+        # Tuple with the revision and json data of the last 'all alarms' data
+        self.__all_alarms_cache = (None, None)
 
     #
     # Alarm operations with normal python data
@@ -83,6 +90,11 @@ class ServerAlarmAdapter(object):
         return json.dump(ServerAlarmAdapter.alarm_to_dict(alarm))
 
     def json_get_all_alarms(self):
+        # The revision is read first, so the cached data is never newer
+        revision = self.alarm_mgr.get_revision()
+        cached_revision, cached_json = self.__all_alarms_cache
+        if cached_revision == revision:
+            return cached_json
         all_alarms = self.alarm_mgr.get_all_alarms()
         alarms_dicts = []
         for alarm in all_alarms:
@@ -90,7 +102,18 @@ class ServerAlarmAdapter(object):
         alarms_dicts = {'dataType': 'All alarms',
                         'size': len(alarms_dicts),
                         'alarms': alarms_dicts}
-        return json.dumps(alarms_dicts, indent=4, separators=(',', ': '))
+        alarms_json = json.dumps(
+            alarms_dicts, indent=4, separators=(',', ': '))
+        self.__all_alarms_cache = (revision, alarms_json)
+        return alarms_json
+
+    def get_alarms_etag(self):
+        """
+        Gets an entity tag for the alarms data, which changes every time the
+        alarms are changed. To be read before the alarms data it tags.
+        :return: String with the entity tag, without quotes.
+        """
+        return '%s-%d' % (self.__etag_prefix, self.alarm_mgr.get_revision())
 
     #
     # Perform operations to the alarms (add, edit, delete) returning json data
@@ -177,3 +200,214 @@ class ServerAlarmAdapter(object):
         return_dict = {'dataType': 'Deleted all alarms',
                        'success': success}
         return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    #
+    # Snooze and dismiss the alarms returning json data
+    #
+    def json_snooze_alarm(self, alarm_id):
+        """
+        Snoozes the alarm with the given ID.
+        :param alarm_id: Integer to indicate ID of the Alarm to snooze.
+        :return: JSON string containing the data type, snoozed alarm ID,
+                 success information and the snoozed alert time.
+        """
+        alert_time = self.alarm_mgr.snooze(alarm_id)
+        return_dict = {'dataType': 'Snooze alarm',
+                       'id': alarm_id,
+                       'success': alert_time is not None}
+        if alert_time is None:
+            return_dict['error'] = 'This alarm does not exists'
+        else:
+            return_dict['alertTime'] = alert_time
+        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    def json_dismiss_alarm(self, alarm_id):
+        """
+        Dismisses the alarm with the given ID, cancelling its snooze.
+        :param alarm_id: Integer to indicate ID of the Alarm to dismiss.
+        :return: JSON string containing the data type, dismissed alarm ID, and
+                 if a snooze has been cancelled.
+        """
+        cancelled = self.alarm_mgr.dismiss(alarm_id)
+        return_dict = {'dataType': 'Dismiss alarm',
+                       'id': alarm_id,
+                       'success': True,
+                       'snoozeCancelled': cancelled}
+        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    #
+    # Apply several operations to the alarms returning json data
+    #
+    def json_apply_operations(self, operations):
+        """
+        Applies several add, edit and delete operations to the alarms in a
+        single transaction. All the operations are validated before any of
+        them is applied, and they are only saved if all of them succeed.
+        :param operations: List of dictionaries with the operation 'op' ('add',
+                           'edit' or 'delete') and the same arguments as the
+                           addAlarm, editAlarm and deleteAlarm requests, with
+                           json types.
+        :return: JSON string containing the data type, success information and
+                 the 'results' list with the result of each operation.
+        """
+        parsed = [self.__parse_operation(operation)
+                  for operation in operations]
+        results = [{'op': operation.get('op'), 'success': False}
+                   if isinstance(operation, dict) else {'success': False}
+                   for operation in operations]
+        success = all(alarm_operation is not None
+                      for alarm_operation, _ in parsed)
+        if success is True:
+            alarm_operations = [operation for operation, _ in parsed]
+            applied = self.alarm_mgr.apply_operations(alarm_operations)
+            success = all(result is not None for result in applied)
+            for i, alarm_operation in enumerate(alarm_operations):
+                result = applied[i]
+                results[i]['success'] = success
+                if alarm_operation[0] != 'add':
+                    results[i]['id'] = alarm_operation[1]
+                if result is None:
+                    results[i]['error'] = 'This alarm does not exists'
+                elif success is True and alarm_operation[0] == 'add':
+                    results[i]['id'] = result
+                    results[i]['timestamp'] = alarm_operation[1].timestamp
+                elif success is True and alarm_operation[0] == 'edit':
+                    results[i]['timestamp'] = result.timestamp
+        else:
+            for i, (_, error) in enumerate(parsed):
+                if error is not None:
+                    results[i]['error'] = error
+        if success is False:
+            for result in results:
+                if 'error' not in result:
+                    result['error'] = 'Not applied, as another operation ' \
+                                      'failed'
+        return_dict = {'dataType': 'Batch operations',
+                       'success': success,
+                       'results': results}
+        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    def __parse_operation(self, operation):
+        """
+        Converts a batch operation into an AlarmManager operation, validating
+        its arguments. The repeat days not given default to True when adding,
+        as in the addAlarm request, and are kept when editing.
+        :param operation: Dictionary with the operation data.
+        :return: Tuple with the AlarmManager operation tuple, or None if the
+                 operation is invalid, and a string with the error message.
+        """
+        if not isinstance(operation, dict):
+            return None, 'The operation must be a json object'
+        op = operation.get('op')
+        day_keys = [day_name.lower() for day_name in AlarmItem.day_names]
+        if op == 'add':
+            if operation.get('hour') is None or \
+                    operation.get('minute') is None:
+                return None, 'The \'hour\' and \'minute\' arguments are ' \
+                             'required to add alarm'
+            alarm = AlarmItem(
+                operation['hour'], operation['minute'],
+                days=tuple(operation.get(day, True) for day in day_keys),
+                enabled=operation.get('enabled', True),
+                label=operation.get('label', ''),
+                timestamp=operation.get('timestamp'))
+            if alarm is None:
+                return None, 'The alarm data is invalid'
+            return ('add', alarm), None
+
+        if op not in ('edit', 'delete'):
+            return None, 'The \'op\' argument must be add, edit or delete'
+        alarm_id = operation.get('id')
+        if not isinstance(alarm_id, int) or isinstance(alarm_id, bool):
+            return None, 'The \'id\' argument has to be an integer'
+        if op == 'delete':
+            return ('delete', alarm_id), None
+
+        edit = dict((key, operation[key]) for key in
+                    ('hour', 'minute', 'enabled', 'label') if key in operation)
+        if any(day in operation for day in day_keys):
+            alarm = self.alarm_mgr.get_alarm(alarm_id)
+            if alarm is None:
+                return None, 'This alarm does not exists'
+            edit['days'] = tuple(
+                operation.get(day, repeat)
+                for day, repeat in zip(day_keys, alarm.repeat))
+        # Validate the arguments, the ones not being edited get defaults
+        if AlarmItem(edit.get('hour', 0), edit.get('minute', 0),
+                     days=edit.get('days', (False,) * 7),
+                     enabled=edit.get('enabled', True),
+                     label=edit.get('label', '')) is None:
+            return None, 'The alarm data is invalid'
+        return ('edit', alarm_id, edit), None
+
+    #
+    # Synchronise the alarms with other systems returning json data
+    #
+    def json_get_changes(self, since=0):
+        """
+        Gets the alarms changed and deleted after an alarms revision.
+        :param since: Integer with the alarms revision of the last
+                      synchronisation, 0 to get all the alarms and deletions.
+        :return: JSON string containing the data type, the current alarms
+                 'revision', the 'full' flag of a full synchronisation (when
+                 the deletions since that revision are no longer kept), the
+                 changed 'alarms' with their 'uid', and the 'deleted' alarms
+                 'uid' and 'timestamp'.
+        """
+        revision, alarms, deleted, full = self.alarm_mgr.get_changes(since)
+        alarms_dicts = []
+        for uid, alarm in alarms:
+            alarm_dict = ServerAlarmAdapter.alarm_to_dict(alarm)
+            alarm_dict['uid'] = uid
+            alarms_dicts.append(alarm_dict)
+        return_dict = {'dataType': 'Alarm changes',
+                       'revision': revision,
+                       'full': full,
+                       'alarms': alarms_dicts,
+                       'deleted': [{'uid': uid, 'timestamp': timestamp}
+                                   for uid, timestamp in deleted]}
+        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    def json_apply_changes(self, changes):
+        """
+        Applies the alarm changes from another system, nothing is applied if
+        any of the data is invalid.
+        :param changes: Dictionary with the 'alarms' and 'deleted' lists, and
+                        the optional 'full' flag, in the same format as the
+                        json_get_changes() data. A full synchronisation
+                        replaces all the local alarms.
+        :return: JSON string containing the data type, success information,
+                 the number of 'applied' changes and the alarms 'revision'.
+        """
+        return_dict = {'dataType': 'Apply changes'}
+        alarms = []
+        deleted = []
+        full = False
+        try:
+            full = changes.get('full', False)
+            for alarm_dict in changes.get('alarms', []):
+                alarm = AlarmItem(
+                    alarm_dict['hour'], alarm_dict['minute'],
+                    days=tuple(alarm_dict.get(day.lower(), False)
+                               for day in AlarmItem.day_names),
+                    enabled=alarm_dict.get('enabled', True),
+                    label=alarm_dict.get('label', ''),
+                    timestamp=alarm_dict['timestamp'])
+                alarms.append((alarm_dict['uid'], alarm))
+            for deleted_dict in changes.get('deleted', []):
+                deleted.append(
+                    (deleted_dict['uid'], deleted_dict['timestamp']))
+        except (AttributeError, KeyError, TypeError):
+            alarms = None
+
+        applied = None
+        if alarms is not None and isinstance(full, bool) and \
+                all(alarm is not None for _, alarm in alarms):
+            applied = self.alarm_mgr.apply_changes(alarms, deleted, full)
+        return_dict['success'] = applied is not None
+        if applied is None:
+            return_dict['error'] = 'The alarm changes data is invalid'
+        else:
+            return_dict['applied'] = applied
+        return_dict['revision'] = self.alarm_mgr.get_revision()
+        return json.dumps(return_dict, indent=4, separators=(',', ': '))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Class to broadcast the server events to the Server-Sent Events clients.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import json
+import threading
+import collections
+from LightUpAlarm.WakeEvent import WakeEvent
+
+
+class ServerEventBroadcaster(object):
+    """
+    Fans out the published events to all the subscribed clients, formatted as
+    Server-Sent Events (SSE) messages. Each event is serialised a single time
+    and placed into the bounded queue of every subscriber, so publishing does
+    not wait for any client.
+
+    A subscriber that falls so far behind that its queue is full is dropped:
+    its stream sends a final 'dropped' event and ends, so the client knows it
+    has missed events and has to reload the alarms data before subscribing
+    again.
+
+    Each subscriber stream waits for its events on a WakeEvent, and sends a
+    comment line as a heartbeat when there are no events for a while, so that
+    disconnected clients are detected by the server.
+
+    As every stream keeps a server thread busy, the number of subscribers can
+    be limited, so that the new subscriptions are rejected instead of taking
+    all the threads needed for the other requests.
+    """
+
+    #
+    # metaclass methods
+    #
+    def __init__(self, max_queue=64, heartbeat=15, max_subscribers=None):
+        """
+        ServerEventBroadcaster initialiser.
+        :param max_queue: Maximum number of events queued for a subscriber
+                          before it is dropped.
+        :param heartbeat: Time, in seconds, without events after which a
+                          subscriber stream sends a heartbeat.
+        :param max_subscribers: Maximum number of subscribers at once, or None
+                                for no limit.
+        """
+        self.__max_queue = max_queue
+        self.__heartbeat = heartbeat
+        self.__max_subscribers = max_subscribers
+        self.__rejected = 0
+        self.__lock = threading.Lock()
+        # Dictionary with a (queue, WakeEvent) tuple for each subscriber ID
+        self.__subscribers = {}
+        self.__next_subscriber = 1
+        self.__event_id = 0
+        self.__dropped = 0
+        self.__open = True
+
+    #
+    # member methods
+    #
+    def set_max_subscribers(self, max_subscribers):
+        """
+        Sets the maximum number of subscribers at once. The subscribers already
+        connected are kept even if they exceed the new limit.
+        :param max_subscribers: Integer with the maximum number of subscribers,
+                                or None for no limit.
+        """
+        with self.__lock:
+            self.__max_subscribers = max_subscribers
+
+    def publish(self, event_type, data):
+        """
+        Sends an event to all the subscribers.
+        :param event_type: String with the event type.
+        :param data: Data of the event, which must be serializable to json.
+        :return: Integer with the number of subscribers the event was sent to.
+        """
+        with self.__lock:
+            self.__event_id += 1
+            message = 'id: %d\nevent: %s\ndata: %s\n\n' % (
+                self.__event_id, event_type,
+                json.dumps(data, separators=(',', ':')))
+            sent = 0
+            for subscriber_id, (queue, wake_event) in \
+                    list(self.__subscribers.items()):
+                if len(queue) >= self.__max_queue:
+                    # Slow consumer, the stream ends after the queued events
+                    del self.__subscribers[subscriber_id]
+                    self.__dropped += 1
+                    queue.append(None)
+                else:
+                    queue.append(message)
+                    sent += 1
+                wake_event.set()
+            return sent
+
+    def subscribe(self):
+        """
+        Adds a subscriber, which receives the events published from now on.
+        :return: Integer with the ID of the new subscriber, to be used with
+                 stream(), or None if the broadcaster has been closed or has
+                 reached the maximum number of subscribers.
+        """
+        with self.__lock:
+            if self.__open is False:
+                return None
+            if self.__max_subscribers is not None and \
+                    len(self.__subscribers) >= self.__max_subscribers:
+                self.__rejected += 1
+                return None
+            subscriber_id = self.__next_subscriber
+            self.__next_subscriber += 1
+            self.__subscribers[subscriber_id] = \
+                (collections.deque(), WakeEvent())
+            return subscriber_id
+
+    def unsubscribe(self, subscriber_id):
+        """
+        Removes a subscriber, ending its stream.
+        :param subscriber_id: Integer with the ID of the subscriber.
+        :return: Boolean indicating if the subscriber was found.
+        """
+        with self.__lock:
+            subscriber = self.__subscribers.pop(subscriber_id, None)
+            if subscriber is None:
+                return False
+            subscriber[0].append(None)
+            subscriber[1].set()
+            return True
+
+    def stream(self, subscriber_id=None):
+        """
+        Generator of the SSE messages for a subscriber. It ends when the
+        subscriber is dropped or unsubscribed, and unsubscribes it if the
+        generator is closed, as done by the server when the client disconnects.
+        :param subscriber_id: Integer with the ID of a subscriber, or None to
+                              subscribe a new one.
+        :return: Generator of strings with the SSE messages.
+        """
+        if subscriber_id is None:
+            subscriber_id = self.subscribe()
+        with self.__lock:
+            subscriber = self.__subscribers.get(subscriber_id)
+        if subscriber is None:
+            yield 'event: dropped\ndata: {}\n\n'
+            return
+        queue, wake_event = subscriber
+        try:
+            # Clients wait 3 seconds before reconnecting
+            yield 'retry: 3000\n\n'
+            while True:
+                with self.__lock:
+                    messages = list(queue)
+                    queue.clear()
+                if not messages:
+                    if wake_event.wait(self.__heartbeat) is False:
+                        yield ': heartbeat\n\n'
+                    continue
+                for message in messages:
+                    if message is None:
+                        yield 'event: dropped\ndata: {}\n\n'
+                        return
+                    yield message
+        finally:
+            self.unsubscribe(subscriber_id)
+            wake_event.close()
+
+    def close(self):
+        """ Ends the streams of all the subscribers and rejects new ones. """
+        with self.__lock:
+            self.__open = False
+            subscriber_ids = list(self.__subscribers.keys())
+        for subscriber_id in subscriber_ids:
+            self.unsubscribe(subscriber_id)
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the number of 'subscribers', the number of
+                 events 'published', the number of subscribers 'dropped' for
+                 being too slow and the number of subscriptions 'rejected' for
+                 exceeding the maximum number of subscribers.
+        """
+        with self.__lock:
+            return {'subscribers': len(self.__subscribers),
+                    'published': self.__event_id,
+                    'dropped': self.__dropped,
+                    'rejected': self.__rejected}
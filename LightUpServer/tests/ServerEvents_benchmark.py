@@ -0,0 +1,152 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Benchmark for the LightUpServer events stream.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Connects a number of concurrent subscribers to the /LightUpPi/events stream
+# of the waitress production server, edits an alarm repeatedly through the
+# AlarmManager, and measures the time from each edit until every subscriber has
+# received its event. The subscribers are read from a single thread with
+# select, so the clients do not compete with the server threads.
+#
+# Usage: ServerEvents_benchmark.py [number_subscribers] [number_events]
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import sys
+import time
+import select
+import resource
+import socket
+import threading
+try:
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpServer import Server
+except ImportError:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpServer import Server
+
+
+# Database name to be used for the benchmark
+db_name = 'ServerEvents_benchmark_db'
+
+HOST = '127.0.0.1'
+
+
+def connect_subscribers(port, number_subscribers):
+    """
+    Opens the events stream connections and waits for their first message.
+    :param port: Integer with the port the server listens to.
+    :param number_subscribers: Number of connections to open.
+    :return: List of connected sockets.
+    """
+    subscribers = []
+    for _ in range(number_subscribers):
+        subscriber = socket.create_connection((HOST, port))
+        subscriber.sendall(b'GET /LightUpPi/events HTTP/1.1\r\n'
+                           b'Host: localhost\r\n\r\n')
+        subscribers.append(subscriber)
+    # The stream starts with the retry message
+    for subscriber in subscribers:
+        data = b''
+        while b'retry' not in data:
+            data += subscriber.recv(4096)
+    return subscribers
+
+
+def receive_event(subscribers, timeout=10):
+    """
+    Waits until every subscriber has received an alarm 'edit' event.
+    :param subscribers: List of connected sockets.
+    :param timeout: Maximum time to wait, in seconds.
+    :return: List with the time each subscriber received the event.
+    """
+    pending = dict((subscriber, b'') for subscriber in subscribers)
+    received = []
+    end_time = time.time() + timeout
+    while pending and time.time() < end_time:
+        readable = select.select(list(pending), [], [], 1)[0]
+        for subscriber in readable:
+            pending[subscriber] += subscriber.recv(4096)
+            # The event is complete once the blank line after it has arrived
+            data = pending[subscriber]
+            event_start = data.find(b'event: edit')
+            if event_start != -1 and data.find(b'\n\n', event_start) != -1:
+                received.append(time.time())
+                del pending[subscriber]
+    return received
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: List of values sorted in ascending order.
+    :param fraction: Float from 0 to 1 with the percentile to get.
+    :return: The value at the given percentile.
+    """
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def benchmark_events(number_subscribers=100, number_events=50):
+    """
+    Measures the events delivery latency to the subscribers.
+    :param number_subscribers: Number of subscribers connected at once.
+    :param number_events: Number of events to publish.
+    """
+    alarm_mgr = AlarmManager(alarm_db=AlarmDb(db_name))
+    alarm_mgr.delete_all_alarms()
+    alarm_id = alarm_mgr.add_alarm(
+        7, 0, (True, False, False, False, False, False, False), False)
+    Server.setup(alarm_mgr, silent=True)
+    wsgi_server = Server.create_production_server(
+        host=HOST, port=0, threads=number_subscribers * 2)
+    if wsgi_server is None:
+        return
+    wsgi_thread = threading.Thread(target=wsgi_server.run)
+    wsgi_thread.daemon = True
+    wsgi_thread.start()
+
+    subscribers = connect_subscribers(
+        wsgi_server.effective_port, number_subscribers)
+    latencies = []
+    missed = 0
+    start = time.time()
+    for i in range(number_events):
+        publish_time = time.time()
+        alarm_mgr.edit_alarm(alarm_id, minute=i % 60)
+        received = receive_event(subscribers)
+        missed += number_subscribers - len(received)
+        latencies.extend(t - publish_time for t in received)
+    total_time = time.time() - start
+    latencies.sort()
+
+    print('%d subscribers, %d events:' % (number_subscribers, number_events))
+    print('Events delivered:  %8d' % len(latencies))
+    print('Events missed:     %8d' % missed)
+    print('Deliveries/s:      %8.1f' % (len(latencies) / total_time))
+    print('Latency p50:       %8.2f ms' % (percentile(latencies, 0.5) * 1000))
+    print('Latency p99:       %8.2f ms' % (percentile(latencies, 0.99) * 1000))
+    print('Broadcaster stats: %s' % Server.event_broadcaster.get_stats())
+    # Includes the subscribers side, as they run in the same process
+    print('Max memory RSS:    %8.1f MB' %
+          (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    for subscriber in subscribers:
+        subscriber.close()
+    Server.event_broadcaster.close()
+    # The server thread is a daemon, so it ends with the benchmark
+    alarm_mgr.delete_all_alarms()
+
+
+if __name__ == '__main__':
+    subscribers_arg = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    events_arg = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    benchmark_events(subscribers_arg, events_arg)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Load test for the LightUpServer Server.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Measures the requests per second and the latency percentiles of the
+# 'getAlarm?id=all' request, with several clients polling the server at the
+# same time over keep-alive connections, like a dashboard and a few phones.
+# It compares the flask development server against the waitress production
+# server, both serving the same AlarmManager in this process, and the
+# production server with clients revalidating their data with If-None-Match.
+#
+# Usage: Server_benchmark.py [number_clients] [requests_per_client] [threads]
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import sys
+import time
+import threading
+from werkzeug.serving import make_server
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+try:
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpServer import Server
+except ImportError:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpServer import Server
+
+
+# Database name to be used for the benchmark
+db_name = 'Server_benchmark_db'
+
+HOST = '127.0.0.1'
+PATH = '/LightUpPi/getAlarm?id=all'
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: List of values sorted in ascending order.
+    :param fraction: Float from 0 to 1 with the percentile to get.
+    :return: The value at the given percentile.
+    """
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def load_test(port, number_clients, requests_per_client, conditional=False):
+    """
+    Sends the requests from several client threads, each one reusing its
+    connection if the server keeps it alive.
+    :param port: Integer with the port the server listens to.
+    :param number_clients: Number of clients sending requests at once.
+    :param requests_per_client: Number of requests sent by each client.
+    :param conditional: Boolean to send the ETag from the last response in
+                        the If-None-Match header.
+    :return: Tuple with the requests per second, and the list of request
+             latencies in seconds, sorted.
+    """
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def client():
+        client_latencies = []
+        headers = {}
+        connection = httplib.HTTPConnection(HOST, port)
+        for _ in range(requests_per_client):
+            start = time.time()
+            try:
+                connection.request('GET', PATH, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (httplib.HTTPException, IOError):
+                # The server closed the connection, so open a new one
+                connection.close()
+                connection = httplib.HTTPConnection(HOST, port)
+                connection.request('GET', PATH, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            if conditional is True:
+                headers['If-None-Match'] = response.getheader('etag')
+            if response.getheader('connection', '').lower() == 'close':
+                connection.close()
+            client_latencies.append(time.time() - start)
+        connection.close()
+        with latencies_lock:
+            latencies.extend(client_latencies)
+
+    clients = [threading.Thread(target=client) for _ in range(number_clients)]
+    start = time.time()
+    for client_thread in clients:
+        client_thread.start()
+    for client_thread in clients:
+        client_thread.join()
+    total_time = time.time() - start
+    return len(latencies) / total_time, sorted(latencies)
+
+
+def print_result(name, requests_per_second, latencies):
+    print('%-32s %8.1f req/s   p50 %7.2f ms   p99 %7.2f ms' %
+          (name, requests_per_second, percentile(latencies, 0.5) * 1000,
+           percentile(latencies, 0.99) * 1000))
+
+
+def benchmark_servers(number_clients=8, requests_per_client=100, threads=4):
+    """
+    Compares the flask development server against the production server.
+    :param number_clients: Number of clients sending requests at once.
+    :param requests_per_client: Number of requests sent by each client.
+    :param threads: Number of threads of the production server.
+    """
+    alarm_mgr = AlarmManager(alarm_db=AlarmDb(db_name))
+    alarm_mgr.delete_all_alarms()
+    alarm_mgr.load_dummy_alarms()
+    Server.setup(alarm_mgr, silent=True)
+    print('%s with %d clients, %d requests each:' %
+          (PATH, number_clients, requests_per_client))
+
+    # Flask development server, as run by Server.run() by default
+    dev_server = make_server(HOST, 0, Server.flask_server)
+    dev_thread = threading.Thread(target=dev_server.serve_forever)
+    dev_thread.daemon = True
+    dev_thread.start()
+    print_result('Flask development server',
+                 *load_test(dev_server.server_port, number_clients,
+                            requests_per_client))
+    dev_server.shutdown()
+
+    # Production server
+    wsgi_server = Server.create_production_server(
+        host=HOST, port=0, threads=threads)
+    if wsgi_server is None:
+        return
+    wsgi_thread = threading.Thread(target=wsgi_server.run)
+    wsgi_thread.daemon = True
+    wsgi_thread.start()
+    print_result('Waitress server, %d threads' % threads,
+                 *load_test(wsgi_server.effective_port, number_clients,
+                            requests_per_client))
+    print_result('Waitress server, If-None-Match',
+                 *load_test(wsgi_server.effective_port, number_clients,
+                            requests_per_client, conditional=True))
+    # The server thread is a daemon, so it ends with the benchmark
+    alarm_mgr.delete_all_alarms()
+
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    server_threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    benchmark_servers(clients, requests, server_threads)
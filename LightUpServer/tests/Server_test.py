@@ -0,0 +1,424 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the LightUpServer Server requests and events streams.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import os
+import sys
+import json
+import mock
+import socket
+import unittest
+import threading
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+try:
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpServer import Server
+    from LightUpServer.ServerAlarmAdapter import ServerAlarmAdapter
+    from LightUpServer.ServerEventBroadcaster import ServerEventBroadcaster
+except ImportError:
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpServer import Server
+    from LightUpServer.ServerAlarmAdapter import ServerAlarmAdapter
+    from LightUpServer.ServerEventBroadcaster import ServerEventBroadcaster
+
+
+# Database name to be used for the unit test
+db_name = 'Server_test_db'
+
+HOST = '127.0.0.1'
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Tests for the Server events streams with the production server. """
+
+    #
+    # Helper methods
+    #
+    def setUp(self):
+        """ Starts a production server with 2 threads in the background. """
+        # Each test gets its own broadcaster, as closing it is permanent
+        patcher = mock.patch.object(
+            Server, 'event_broadcaster', ServerEventBroadcaster(heartbeat=1))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alarm_mgr = AlarmManager(alarm_db=AlarmDb(db_name))
+        self.alarm_mgr.delete_all_alarms()
+        Server.setup(self.alarm_mgr, silent=True)
+        self.wsgi_server = Server.create_production_server(
+            host=HOST, port=0, threads=2)
+        if self.wsgi_server is None:
+            self.skipTest('The waitress package is not installed')
+        wsgi_thread = threading.Thread(target=self.wsgi_server.run)
+        wsgi_thread.daemon = True
+        wsgi_thread.start()
+        self.port = self.wsgi_server.effective_port
+
+    def tearDown(self):
+        Server.event_broadcaster.close()
+        self.wsgi_server.close()
+        self.alarm_mgr.delete_all_alarms()
+
+    def open_stream(self):
+        """
+        Opens an events stream connection and reads its response status line.
+        :return: Tuple with the connected socket and the data received.
+        """
+        stream = socket.create_connection((HOST, self.port), timeout=5)
+        self.addCleanup(stream.close)
+        stream.sendall(b'GET /LightUpPi/events HTTP/1.1\r\n'
+                       b'Host: localhost\r\n\r\n')
+        data = b''
+        while b'\r\n\r\n' not in data:
+            data += stream.recv(4096)
+        return stream, data
+
+    #
+    # Tests
+    #
+    def test_request_while_streams_open(self):
+        """
+        Tests the events streams are limited to half of the server threads, so
+        other requests are served while the streams are open, and the stream
+        requests over the limit get a 503 response.
+        """
+        self.alarm_mgr.add_alarm(
+            7, 0, (True, False, False, False, False, False, False))
+        stream, data = self.open_stream()
+        self.assertIn(b' 200 ', data.split(b'\r\n')[0])
+        rejected_stream, data = self.open_stream()
+        self.assertIn(b' 503 ', data.split(b'\r\n')[0])
+        self.assertEqual(Server.event_broadcaster.get_stats()['rejected'], 1)
+
+        connection = httplib.HTTPConnection(HOST, self.port, timeout=5)
+        connection.request('GET', '/LightUpPi/getAlarm?id=all')
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertIn(b'hour', response.read())
+        connection.close()
+
+        # The open stream still receives the events
+        self.alarm_mgr.add_alarm(
+            8, 0, (True, False, False, False, False, False, False))
+        data = b''
+        while b'event: add' not in data:
+            data += stream.recv(4096)
+
+
+
+class ServerRequestsTestCase(unittest.TestCase):
+    """ Tests for the Server requests, with the flask test client. """
+
+    #
+    # Helper methods
+    #
+    def setUp(self):
+        patcher = mock.patch.object(
+            Server, 'event_broadcaster', ServerEventBroadcaster())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        alarm_db = AlarmDb(db_name)
+        alarm_db.delete_all_snoozes()
+        self.alarm_mgr = AlarmManager(alarm_db=alarm_db)
+        self.alarm_mgr.delete_all_alarms()
+        Server.setup(self.alarm_mgr, silent=True)
+        self.client = Server.flask_server.test_client()
+
+    def tearDown(self):
+        self.alarm_mgr.delete_all_alarms()
+
+    def get_json(self, path, **kwargs):
+        """
+        Sends a GET request and decodes its json response.
+        :param path: String with the request path and arguments.
+        :return: Decoded json data of the response.
+        """
+        response = self.client.get(path, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode('utf-8'))
+
+    def post_json(self, path, data):
+        """
+        Sends a POST request with a json body and decodes its json response.
+        :param path: String with the request path.
+        :param data: Data to send as the json body.
+        :return: Decoded json data of the response.
+        """
+        response = self.client.post(
+            path, data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode('utf-8'))
+
+    def remote_manager(self):
+        """ :return: AlarmManager with a second, empty, database. """
+        remote_name = '%s_remote' % db_name
+        remote_db = AlarmDb(remote_name)
+        self.addCleanup(os.remove, '%s.db' % remote_name)
+        self.addCleanup(remote_db.close)
+        remote_mgr = AlarmManager(alarm_db=remote_db)
+        remote_mgr.delete_all_alarms()
+        return remote_mgr
+
+    #
+    # Tests
+    #
+    def test_get_alarm_etag(self):
+        """
+        Tests the alarms are tagged with the alarms revision, so a request with
+        a matching If-None-Match header gets a 304 response, and with a stale
+        one gets the new alarms.
+        """
+        days = (True, False, False, False, False, False, False)
+        alarm_id = self.alarm_mgr.add_alarm(7, 0, days)
+        response = self.client.get('/LightUpPi/getAlarm?id=all')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.endswith(
+            '-%d"' % self.alarm_mgr.get_revision()))
+        self.assertEqual(
+            json.loads(response.data.decode('utf-8'))['size'], 1)
+
+        # The same revision is not modified, for all or a single alarm
+        for alarm_arg in ('all', str(alarm_id)):
+            response = self.client.get(
+                '/LightUpPi/getAlarm?id=%s' % alarm_arg,
+                headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+
+        # Any alarm change makes the tag stale
+        self.alarm_mgr.add_alarm(8, 0, days)
+        response = self.client.get('/LightUpPi/getAlarm?id=all',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        new_etag = response.headers['ETag']
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(new_etag.split('-')[0], etag.split('-')[0])
+        self.assertEqual(int(new_etag.split('-')[1].strip('"')),
+                         int(etag.split('-')[1].strip('"')) + 1)
+        self.assertEqual(
+            json.loads(response.data.decode('utf-8'))['size'], 2)
+        response = self.client.get('/LightUpPi/getAlarm?id=%d' % alarm_id,
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.data.decode('utf-8'))['id'], alarm_id)
+
+    def test_snooze_dismiss(self):
+        """ Tests snoozing and dismissing an alarm through the server. """
+        alarm_id = self.alarm_mgr.add_alarm(
+            7, 0, (True, False, False, False, False, False, False))
+        result = self.get_json('/LightUpPi/snooze?id=%d' % alarm_id)
+        self.assertEqual((result['id'], result['success']), (alarm_id, True))
+        self.assertEqual(result['alertTime'],
+                         self.alarm_mgr.get_snooze(alarm_id))
+        result = self.get_json('/LightUpPi/dismiss?id=%d' % alarm_id)
+        self.assertEqual((result['id'], result['success'],
+                          result['snoozeCancelled']), (alarm_id, True, True))
+        self.assertIsNone(self.alarm_mgr.get_snooze(alarm_id))
+        result = self.get_json('/LightUpPi/dismiss?id=%d' % alarm_id)
+        self.assertFalse(result['snoozeCancelled'])
+
+        # Unknown alarms
+        result = self.get_json('/LightUpPi/snooze?id=%d' % (alarm_id + 100))
+        self.assertFalse(result['success'])
+        self.assertEqual(result['error'], 'This alarm does not exists')
+        self.assertNotIn('alertTime', result)
+        result = self.get_json('/LightUpPi/dismiss?id=%d' % (alarm_id + 100))
+        self.assertFalse(result['snoozeCancelled'])
+
+        # Missing or invalid id argument
+        for request in ('snooze', 'dismiss'):
+            self.assertEqual(
+                self.get_json('/LightUpPi/%s' % request),
+                {'error': 'The \'id\' argument is required for \'%s\''
+                          % request})
+            self.assertEqual(
+                self.get_json('/LightUpPi/%s?id=first' % request),
+                {'error': 'The \'id\' argument has to be an integer'})
+        self.assertEqual(self.alarm_mgr.get_snooze(alarm_id), None)
+
+    def test_sync(self):
+        """
+        Tests getting the alarm changes from the server, and pushing the changes
+        of another system into it.
+        """
+        alarm_id = self.alarm_mgr.add_alarm(
+            7, 0, (True, False, False, False, False, False, False))
+        changes = self.get_json('/LightUpPi/sync?since=0')
+        self.assertEqual(changes['revision'], self.alarm_mgr.get_revision())
+        self.assertFalse(changes['full'])
+        self.assertEqual([alarm['id'] for alarm in changes['alarms']],
+                         [alarm_id])
+        self.assertEqual(len(changes['alarms'][0]['uid']), 32)
+        self.assertEqual(
+            self.get_json('/LightUpPi/sync?since=%d' % changes['revision'])
+            ['alarms'], [])
+        self.assertIn('error', self.get_json('/LightUpPi/sync?since=last'))
+
+        # The changes of another system are applied, in the GET json format
+        remote_mgr = self.remote_manager()
+        remote_id = remote_mgr.add_alarm(
+            8, 30, (False, True, False, False, False, False, False))
+        remote_mgr.delete_alarm(remote_mgr.add_alarm(
+            9, 0, (False, False, True, False, False, False, False)))
+        remote_changes = json.loads(
+            ServerAlarmAdapter(remote_mgr).json_get_changes(0))
+        result = self.post_json('/LightUpPi/sync', remote_changes)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['applied'], 1)
+        self.assertEqual(result['revision'], self.alarm_mgr.get_revision())
+        self.assertGreater(result['revision'], changes['revision'])
+        changes = self.get_json(
+            '/LightUpPi/sync?since=%d' % changes['revision'])
+        self.assertEqual([(alarm['uid'], alarm['hour'], alarm['minute'])
+                          for alarm in changes['alarms']],
+                         [(remote_changes['alarms'][0]['uid'], 8, 30)])
+        self.assertEqual(changes['deleted'], remote_changes['deleted'])
+        self.assertNotEqual(changes['alarms'][0]['id'], remote_id)
+
+        # Posting the same changes again does not apply anything
+        result = self.post_json('/LightUpPi/sync', remote_changes)
+        self.assertEqual((result['success'], result['applied']), (True, 0))
+        self.assertEqual(result['revision'], changes['revision'])
+
+    def test_sync_invalid_changes(self):
+        """
+        Tests the pushed changes are rejected, without applying any of them,
+        if any of the alarms or deletions is invalid.
+        """
+        self.alarm_mgr.add_alarm(
+            7, 0, (True, False, False, False, False, False, False))
+        revision = self.alarm_mgr.get_revision()
+        alarm = {'uid': 'a' * 32, 'hour': 8, 'minute': 0, 'enabled': True,
+                 'label': '', 'timestamp': 1000, 'monday': True}
+        invalid_alarms = [
+            dict((key, value) for key, value in alarm.items()
+                 if key != 'timestamp'),
+            dict(alarm, timestamp='now'),
+            dict(alarm, uid=123)]
+        for invalid_alarm in invalid_alarms:
+            result = self.post_json(
+                '/LightUpPi/sync', {'alarms': [alarm, invalid_alarm]})
+            self.assertFalse(result['success'])
+            self.assertEqual(result['error'],
+                             'The alarm changes data is invalid')
+            self.assertEqual(result['revision'], revision)
+        for invalid_changes in ({'deleted': [{'uid': 'b' * 32,
+                                              'timestamp': 1000.5}]},
+                                {'deleted': [{'uid': 'b' * 32}]},
+                                {'alarms': [alarm], 'full': 'yes'}):
+            result = self.post_json('/LightUpPi/sync', invalid_changes)
+            self.assertFalse(result['success'])
+            self.assertEqual(result['revision'], revision)
+        self.assertIn('error', self.post_json('/LightUpPi/sync', [alarm]))
+        self.assertEqual(self.alarm_mgr.get_number_of_alarms(), 1)
+        self.assertEqual(self.alarm_mgr.get_changes(revision)[1:3], ([], []))
+
+    def test_sync_full(self):
+        """
+        Tests a revision older than the kept tombstones gets a full sync, and
+        that pushing it into another system replaces all its alarms.
+        """
+        remote_mgr = self.remote_manager()
+        with mock.patch.object(AlarmDb, 'tombstone_retention', 2):
+            days = (True, False, False, False, False, False, False)
+            deleted_id = self.alarm_mgr.add_alarm(7, 0, days)
+            kept_id = self.alarm_mgr.add_alarm(8, 0, days)
+            changes = self.get_json('/LightUpPi/sync?since=0')
+            self.assertFalse(changes['full'])
+            self.assertEqual(
+                self.post_json('/LightUpPi/sync', changes)['applied'], 0)
+            ServerAlarmAdapter(remote_mgr).json_apply_changes(changes)
+            remote_mgr.add_alarm(9, 0, days)
+            self.alarm_mgr.delete_alarm(deleted_id)
+            for minute in range(1, 4):
+                self.alarm_mgr.edit_alarm(kept_id, minute=minute)
+
+            full_changes = self.get_json(
+                '/LightUpPi/sync?since=%d' % changes['revision'])
+            self.assertTrue(full_changes['full'])
+            self.assertEqual([alarm['id'] for alarm in full_changes['alarms']],
+                             [kept_id])
+            result = json.loads(ServerAlarmAdapter(
+                remote_mgr).json_apply_changes(full_changes))
+            self.assertEqual((result['success'], result['applied']), (True, 3))
+        self.assertEqual([(alarm.hour, alarm.minute) for alarm in
+                          remote_mgr.get_all_alarms()], [(8, 3)])
+
+    def test_batch(self):
+        """ Tests a batch with add, edit and delete operations. """
+        days = (True, False, False, False, False, False, False)
+        edit_id = self.alarm_mgr.add_alarm(7, 0, days)
+        delete_id = self.alarm_mgr.add_alarm(8, 0, days)
+        result = self.post_json('/LightUpPi/batch', [
+            {'op': 'add', 'hour': 9, 'minute': 15, 'sunday': False,
+             'label': 'batch'},
+            {'op': 'edit', 'id': edit_id, 'enabled': False, 'tuesday': True},
+            {'op': 'delete', 'id': delete_id}])
+        self.assertTrue(result['success'])
+        self.assertEqual([(op['op'], op['success']) for op in
+                          result['results']],
+                         [('add', True), ('edit', True), ('delete', True)])
+        self.assertEqual([op['id'] for op in result['results']][1:],
+                         [edit_id, delete_id])
+        added = self.alarm_mgr.get_alarm(result['results'][0]['id'])
+        self.assertEqual((added.hour, added.minute, added.label, added.sunday),
+                         (9, 15, 'batch', False))
+        self.assertEqual(added.timestamp, result['results'][0]['timestamp'])
+        edited = self.alarm_mgr.get_alarm(edit_id)
+        self.assertEqual((edited.enabled, edited.repeat[:3]),
+                         (False, (True, True, False)))
+        self.assertIsNone(self.alarm_mgr.get_alarm(delete_id))
+        self.assertIn('error', self.post_json('/LightUpPi/batch', {}))
+
+    def test_batch_invalid(self):
+        """
+        Tests a batch with an invalid operation, or an operation that fails, is
+        not applied at all.
+        """
+        days = (True, False, False, False, False, False, False)
+        alarm_id = self.alarm_mgr.add_alarm(7, 0, days)
+        revision = self.alarm_mgr.get_revision()
+        add = {'op': 'add', 'hour': 9, 'minute': 15}
+        delete = {'op': 'delete', 'id': alarm_id}
+        batches = (
+            ([add, 5], 'The operation must be a json object'),
+            ([delete, {'op': 'edit', 'id': alarm_id + 100, 'hour': 8}],
+             'This alarm does not exists'),
+            ([delete, dict(add, minute='15')], 'The alarm data is invalid'),
+            ([delete, {'op': 'edit', 'id': alarm_id, 'minute': '15'}],
+             'The alarm data is invalid'))
+        for operations, error in batches:
+            result = self.post_json('/LightUpPi/batch', operations)
+            self.assertFalse(result['success'])
+            self.assertEqual(result['results'][1]['error'], error)
+            self.assertEqual(result['results'][0]['error'],
+                             'Not applied, as another operation failed')
+            self.assertFalse(any(op['success'] for op in result['results']))
+            self.assertNotIn('timestamp', result['results'][0])
+
+        # Nothing has been written, not even the operations that succeeded
+        self.assertEqual(self.alarm_mgr.get_revision(), revision)
+        self.assertEqual([alarm.id_ for alarm in
+                          self.alarm_mgr.get_all_alarms()], [alarm_id])
+        alarm = self.alarm_mgr.get_alarm(alarm_id)
+        self.assertEqual((alarm.hour, alarm.minute), (7, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,8 +12,9 @@ LightUpPi.app = angular.module("lightUpPi", ["ui.bootstrap"]);
 
 /**
  * Main controller for the LightUpPi Angular App.
- * It sets short polling to the server to maintain the displayed alarm data 
- * refreshed.
+ * It refreshes the displayed alarm data when the server events stream reports
+ * a change, and falls back to short polling the server if the browser does not
+ * support Server-Sent Events or the stream is lost.
  */
 LightUpPi.app.controller("lightUpCtrl", ["$scope", "$interval", "$http",
     function($scope, $interval, $http) {
@@ -36,7 +37,41 @@ LightUpPi.app.controller("lightUpCtrl", ["$scope", "$interval", "$http",
            $scope.serverError = true;
          });
   };
-  var promise = $interval($scope.refreshAlarmsData, 2000);
+  var promise = null;
+  var startPolling = function() {
+    if (promise === null) {
+      promise = $interval($scope.refreshAlarmsData, 2000);
+    }
+  };
+  var stopPolling = function() {
+    if (promise !== null) {
+      $interval.cancel(promise);
+      promise = null;
+    }
+  };
+
+  if (typeof EventSource == 'undefined') {
+    startPolling();
+  } else {
+    var events = new EventSource(
+        "http://" + location.hostname + "/LightUpPi/events");
+    var alarmChanged = function() {
+      $scope.$apply($scope.refreshAlarmsData);
+    };
+    ["add", "edit", "delete", "delete_all"].forEach(function(eventType) {
+      events.addEventListener(eventType, alarmChanged);
+    });
+    // Events might have been missed while (re)connecting or if dropped
+    events.onopen = function() {
+      $scope.$apply(stopPolling);
+      alarmChanged();
+    };
+    events.addEventListener("dropped", alarmChanged);
+    events.onerror = function() {
+      $scope.$apply(startPolling);
+    };
+    $scope.refreshAlarmsData();
+  }
 }]);
 
 /**
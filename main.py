@@ -69,7 +69,8 @@ def alarm_offset_alert():
         lamp=(0, minutes(3)),
         room_light=(minutes(2), minutes(13)),
         coffee_time=minutes(10),
-        total_time=minutes(15))
+        total_time=minutes(15),
+        progress_callback=Server.publish_hardware_progress)
     hw_alert.start()
 
 
@@ -80,12 +81,17 @@ def parsing_args(argv):
     -c / --cli
     -s / --server
     -b / --both
+    -w / --wsgi
+    --host <address>
+    --port <number>
+    --threads <number>
     :return: dictionary with available options(keys) and value(value)
     """
     option_dict = {}
     try:
         opts, args = getopt.getopt(
-            argv, 'hscb', ['help', 'server', 'cli', 'both'])
+            argv, 'hscbw', ['help', 'server', 'cli', 'both', 'wsgi', 'host=',
+                            'port=', 'threads='])
     except getopt.GetoptError as e:
         print('There was a problem parsing the command line arguments:')
         print('\t%s' % e)
@@ -96,7 +102,11 @@ def parsing_args(argv):
             print('Choose between running the application in command line ' +
                   'interface, to launch the HTTP server, or both.\n' +
                   '\t-c Command Line Interface\n\t-s Launch HTTP server\n'
-                  '\t-b Both command line and server')
+                  '\t-b Both command line and server\n'
+                  '\t-w Serve with the waitress WSGI server\n'
+                  '\t--host <address> Server bind address\n'
+                  '\t--port <number> Server port\n'
+                  '\t--threads <number> WSGI server threads')
             sys.exit(0)
         elif opt in ('-c', '--cli'):
                 option_dict['cli'] = None
@@ -104,6 +114,16 @@ def parsing_args(argv):
                 option_dict['server'] = None
         elif opt in ('-b', '--both'):
                 option_dict['both'] = None
+        elif opt in ('-w', '--wsgi'):
+                option_dict['wsgi'] = None
+        elif opt == '--host':
+                option_dict['host'] = arg
+        elif opt in ('--port', '--threads'):
+            try:
+                option_dict[opt[2:]] = int(arg)
+            except ValueError:
+                print('The %s value must be an integer.' % opt)
+                sys.exit(1)
         else:
             print('Flag ' + opt + ' not recognised.')
 
@@ -122,6 +142,8 @@ def main(argv):
 
     # This variable is used to select between the different modes, defaults both
     start = 'both'
+    # Keyword arguments for the server run
+    server_options = {}
 
     # Checking command line arguments in order of priority
     print('\n======= Parsing Command line arguments =======')
@@ -136,6 +158,11 @@ def main(argv):
         elif 'server' in arguments:
             print('Server selected')
             start = 'server'
+        if 'wsgi' in arguments:
+            server_options['production'] = True
+        for option in ('host', 'port', 'threads'):
+            if option in arguments:
+                server_options[option] = arguments[option]
     else:
         print('No flags defaults to the command line interface.')
 
@@ -146,7 +173,7 @@ def main(argv):
         # headless and nothing else will be connected to ring/alert
         alarm_mgr = AlarmManager.AlarmManager(
             offset_alert_callback=alarm_offset_alert)
-        Server.run(alarm_mgr_arg=alarm_mgr)
+        Server.run(alarm_mgr_arg=alarm_mgr, **server_options)
     else:
         # The command line interface running on its own thread is common to
         # the 'cli' and 'both' options.
@@ -162,7 +189,8 @@ def main(argv):
                 Server.run(
                     alarm_mgr_arg=alarm_mgr,
                     silent=True,
-                    callback_arg=cli_thread.callback_event)
+                    callback_arg=cli_thread.callback_event,
+                    **server_options)
             else:
                 while cli_thread.isAlive():
                     sleep(0.2)